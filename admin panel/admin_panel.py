@@ -1,61 +1,457 @@
-from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QVBoxLayout
-from PyQt5.QtCore import QTimer
+"""Desktop admin dashboard for the Flask API.
+
+Every HTTP request runs as a ``FetchTask`` on a ``QThreadPool``; results come
+back to the GUI thread through queued signals, so the window never waits on
+the network. List pages are fetched with ``If-None-Match`` and the last page
+is kept per URL, so an unchanged table costs a ``304`` per page and no model
+work. Lockers and reservations are shown through ``RecordTableModel``, which
+diffs each new snapshot against the rows it holds and emits only the row
+removals, ``dataChanged`` ranges and insertions, so views keep their scroll
+position and selection and 10k lockers refresh without rebuilding anything.
+All animation (the typewriter headings) is driven by one ``AnimationClock``
+timer that stops itself when nothing is animating.
+
+    python admin_panel.py --url http://127.0.0.1:5000 --username serrah
+
+The password is read from ``ADMIN_PANEL_PASSWORD`` or prompted for on the
+terminal. ``QT_QPA_PLATFORM=offscreen`` runs it headless; see
+check_admin_panel.py.
+"""
+import argparse
+import getpass
+import gzip
+import http.cookiejar
+import json
+import os
 import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from PyQt5.QtWidgets import (QApplication, QWidget, QLabel, QVBoxLayout, QHBoxLayout, QLineEdit,
+                             QTabWidget, QTableView, QHeaderView, QAbstractItemView)
+from PyQt5.QtCore import (QTimer, QObject, QRunnable, QThreadPool, QAbstractTableModel, QModelIndex,
+                          QSortFilterProxyModel, QElapsedTimer, Qt, pyqtSignal)
+from PyQt5.QtGui import QColor
+
+API_URL = os.environ.get("ADMIN_PANEL_URL", "http://127.0.0.1:5000")
+REFRESH_INTERVAL_MS = 5000
+FRAME_MS = 16
+PAGE_SIZE = 1000
+RECENT_RESERVATIONS = 200
+REQUEST_TIMEOUT = 30
+
+STATUS_COLORS = {
+    "available": "#28a745",
+    "occupied": "#007bff",
+    "maintenance": "#ffc107",
+    "active": "#28a745",
+    "pending": "#ffc107",
+    "completed": "#6c757d",
+    "cancelled": "#dc3545",
+}
+
+class ApiError(Exception):
+    pass
+
+class ApiClient:
+    """Session-cookie client for the JSON API; safe to share between worker threads."""
+    def __init__(self, base_url=API_URL, timeout=REQUEST_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        # url -> (etag, decoded body, next cursor) of the last 200 response
+        self._pages = {}
+
+    def login(self, username, password):
+        data = urllib.parse.urlencode({"username": username, "password": password}).encode()
+        with self.opener.open(self.base_url + "/login", data=data, timeout=self.timeout) as response:
+            # Success redirects to the dashboard; failure renders the login form again.
+            if urllib.parse.urlparse(response.geturl()).path.rstrip("/") == "/login":
+                raise ApiError("Invalid username or password")
+
+    def _get(self, path):
+        """Return ``(body, next cursor, changed)`` for ``path``, revalidating the cached copy."""
+        url = self.base_url + path
+        request = urllib.request.Request(url, headers={"Accept-Encoding": "gzip"})
+        cached = self._pages.get(url)
+        if cached is not None:
+            request.add_header("If-None-Match", cached[0])
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                if urllib.parse.urlparse(response.geturl()).path.rstrip("/") == "/login":
+                    raise ApiError("Not logged in")
+                raw = response.read()
+                if response.headers.get("Content-Encoding") == "gzip":
+                    raw = gzip.decompress(raw)
+                body = json.loads(raw)
+                cursor = response.headers.get("X-Next-After-Id")
+                etag = response.headers.get("ETag")
+        except urllib.error.HTTPError as error:
+            if error.code == 304 and cached is not None:
+                return cached[1], cached[2], False
+            raise ApiError(f"GET {path} failed with HTTP {error.code}") from error
+        if etag:
+            self._pages[url] = (etag, body, cursor)
+        return body, cursor, True
+
+    def get_json(self, path):
+        """Return the decoded body of ``path``, or ``None`` if it did not change since the last call."""
+        body, _, changed = self._get(path)
+        return body if changed else None
+
+    def get_all(self, path):
+        """Follow ``X-Next-After-Id`` through every page of ``path``; ``None`` if no page changed."""
+        rows, changed, cursor = [], False, None
+        separator = "&" if "?" in path else "?"
+        while True:
+            page = f"{path}{separator}limit={PAGE_SIZE}" + (f"&after_id={cursor}" if cursor else "")
+            body, cursor, page_changed = self._get(page)
+            rows.extend(body)
+            changed = changed or page_changed
+            if not cursor:
+                return rows if changed else None
+
+class FetchSignals(QObject):
+    finished = pyqtSignal(str, object)
+    failed = pyqtSignal(str, str)
+
+class FetchTask(QRunnable):
+    """Run ``function`` on a pool thread and report its result under ``key``."""
+    def __init__(self, key, function):
+        super().__init__()
+        self.key = key
+        self.function = function
+        # Created on the GUI thread, so connected slots run there.
+        self.signals = FetchSignals()
+
+    def run(self):
+        try:
+            result = self.function()
+        except Exception as error:
+            self.signals.failed.emit(self.key, str(error))
+        else:
+            self.signals.finished.emit(self.key, result)
+
+class AnimationClock(QObject):
+    """One timer for every running animation; it only ticks while one is active."""
+    def __init__(self, interval=FRAME_MS, parent=None):
+        super().__init__(parent)
+        self.animations = []
+        self.elapsed = QElapsedTimer()
+        self.elapsed.start()
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.tick)
+
+    def add(self, animation):
+        animation.started = self.elapsed.elapsed()
+        self.animations.append(animation)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def tick(self):
+        now = self.elapsed.elapsed()
+        self.animations = [animation for animation in self.animations if animation.step(now - animation.started)]
+        if not self.animations:
+            self.timer.stop()
 
 class TypewriterEffect:
-    def __init__(self, label, text, speed=100):
+    def __init__(self, label, text, speed=100, clock=None):
         self.label = label
         self.text = text
-        self.index = 0
+        self.index = -1
         self.speed = speed
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.typing)
-        self.timer.start(self.speed)
+        if clock is not None:
+            clock.add(self)
 
-    def typing(self):
+    def step(self, elapsed):
+        """Show the text typed after ``elapsed`` ms; return whether it is still typing."""
+        index = min(int(elapsed // self.speed), len(self.text))
+        if index == self.index:
+            return True
+        self.index = index
         if self.index < len(self.text):
             self.label.setText(self.text[:self.index] + "|")  # Cursor efekti
-            self.index += 1
-        else:
-            self.label.setText(self.text)  # Tamamlanınca cursor kalkar
-            self.timer.stop()
+            return True
+        self.label.setText(self.text)  # Tamamlanınca cursor kalkar
+        return False
+
+def _sort_value(value):
+    return (value is None, 0 if value is None else value)
+
+class RecordTableModel(QAbstractTableModel):
+    """Rows of API records keyed by ``id``, updated by diffing whole snapshots.
+
+    Sorting happens here with ``list.sort`` rather than in a proxy, which would
+    call back into ``data()`` for every comparison.
+    """
+    def __init__(self, columns, parent=None):
+        super().__init__(parent)
+        self.columns = columns
+        self.rows = []
+        self.positions = {}
+        self.sort_order = None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.columns[section][1]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        value = self.rows[index.row()].get(self.columns[index.column()][0])
+        if role == Qt.DisplayRole:
+            return "" if value is None else str(value)
+        if role == Qt.ForegroundRole and value in STATUS_COLORS:
+            return QColor(STATUS_COLORS[value])
+        return None
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_order = (column, order) if column >= 0 else None
+        self._sort()
+
+    def _sort(self):
+        if self.sort_order is None:
+            return
+        column, order = self.sort_order
+        key = self.columns[column][0]
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        ids = [self.rows[index.row()]["id"] for index in persistent]
+        self.rows.sort(key=lambda row: _sort_value(row.get(key)), reverse=order == Qt.DescendingOrder)
+        self.positions = {row["id"]: index for index, row in enumerate(self.rows)}
+        self.changePersistentIndexList(
+            persistent, [self.index(self.positions[row_id], index.column()) for row_id, index in zip(ids, persistent)])
+        self.layoutChanged.emit()
+
+    def _runs(self, indexes):
+        """Group sorted row numbers into ``(first, last)`` runs."""
+        runs = []
+        for index in indexes:
+            if runs and runs[-1][1] == index - 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+        return runs
+
+    def apply(self, records):
+        """Make the model hold ``records``; return ``(removed, changed, added)`` row counts."""
+        incoming = {record["id"]: record for record in records}
+
+        removed = [index for index, row in enumerate(self.rows) if row["id"] not in incoming]
+        for first, last in reversed(self._runs(removed)):
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self.rows[first:last + 1]
+            self.endRemoveRows()
+        if removed:
+            self.positions = {row["id"]: index for index, row in enumerate(self.rows)}
+
+        changed = []
+        for index, row in enumerate(self.rows):
+            record = incoming[row["id"]]
+            if record != row:
+                self.rows[index] = record
+                changed.append(index)
+        last_column = len(self.columns) - 1
+        for first, last in self._runs(changed):
+            self.dataChanged.emit(self.index(first, 0), self.index(last, last_column))
+
+        added = [record for record in records if record["id"] not in self.positions]
+        if added:
+            first = len(self.rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(added) - 1)
+            self.rows.extend(added)
+            for offset, record in enumerate(added):
+                self.positions[record["id"]] = first + offset
+            self.endInsertRows()
+        if changed or added:
+            self._sort()
+        return len(removed), len(changed), len(added)
+
+class RecordFilterProxy(QSortFilterProxyModel):
+    """Case-insensitive substring filter over a ``RecordTableModel``; sorting is left to the model."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.text = ""
+
+    def setFilterText(self, text):
+        self.text = text.lower()
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if not self.text:
+            return True
+        model = self.sourceModel()
+        row = model.rows[source_row]
+        return any(self.text in str(row.get(key, "")).lower() for key, _ in model.columns)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sourceModel().sort(column, order)
 
 class AdminPanel(QWidget):
-    def __init__(self):
+    def __init__(self, client=None, refresh_interval=REFRESH_INTERVAL_MS, pool=None):
         super().__init__()
+        self.client = client or ApiClient()
+        self.pool = pool or QThreadPool(self)
+        self.clock = AnimationClock(parent=self)
+        self.in_flight = set()
+        self.last_diff = {}
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(refresh_interval)
+        self.refresh_timer.timeout.connect(self.refresh)
         self.initUI()
 
     def initUI(self):
         self.setWindowTitle("Smart Locker Admin Panel")
-        self.setGeometry(200, 200, 600, 400)
+        self.setGeometry(200, 200, 900, 600)
         layout = QVBoxLayout()
-        self.setStyleSheet("background-color: #222; color: white; font-size: 18px; padding: 20px;")
+        self.setStyleSheet("background-color: #222; color: white; font-size: 14px;")
 
         # Başlık (Cursor efekti ile yazılacak)
         self.header = QLabel("")
+        self.header.setStyleSheet("font-size: 20px; padding: 10px 0;")
         layout.addWidget(self.header)
-        TypewriterEffect(self.header, "📊 Dashboard", speed=50)
+        TypewriterEffect(self.header, "📊 Dashboard", speed=50, clock=self.clock)
+
+        self.stat_labels = {}
+        stats = QHBoxLayout()
+        for name, title in (("users", "👥 Users"), ("active_lockers", "🔒 Occupied"),
+                            ("total_lockers", "🔒 Lockers"), ("pending_payments", "💳 Pending payments")):
+            label = QLabel(f"{title}: –")
+            stats.addWidget(label)
+            self.stat_labels[name] = (label, title)
+        layout.addLayout(stats)
+
+        self.lockers = RecordTableModel([
+            ("id", "ID"), ("number", "Number"), ("status", "Status"),
+            ("assigned_user_name", "Assigned to"), ("version", "Version")], self)
+        self.reservations = RecordTableModel([
+            ("id", "ID"), ("user_id", "User"), ("locker_id", "Locker"),
+            ("start_time", "Start"), ("end_time", "End"), ("status", "Status")], self)
+
+        self.locker_filter = QLineEdit()
+        self.locker_filter.setPlaceholderText("Filter lockers...")
+        self.locker_proxy = self._proxy(self.lockers)
+        self.locker_filter.textChanged.connect(self.locker_proxy.setFilterText)
+
+        lockers_tab = QWidget()
+        lockers_layout = QVBoxLayout(lockers_tab)
+        lockers_layout.addWidget(self.locker_filter)
+        lockers_layout.addWidget(self._table(self.locker_proxy))
 
         # Menü Öğeleri (Cursor efekti ile yazılacak)
-        menu_items = [
-            "👥 User Management",
-            "🔒 Locker Management",
-            "📅 Reservation Management",
-            "💳 Payment Management",
-            "🔔 Notifications"
-        ]
-        self.labels = []
-        for item in menu_items:
-            lbl = QLabel("")
-            lbl.setStyleSheet("margin-top: 10px;")  # Menü öğeleri aralıklı olsun
-            layout.addWidget(lbl)
-            self.labels.append(lbl)
-            TypewriterEffect(lbl, item, speed=50)
+        self.tabs = QTabWidget()
+        self.tabs.addTab(lockers_tab, "")
+        self.tabs.addTab(self._table(self._proxy(self.reservations)), "")
+        for index, item in enumerate(["🔒 Locker Management", "📅 Reservation Management"]):
+            TypewriterEffect(_TabLabel(self.tabs, index), item, speed=50, clock=self.clock)
+        layout.addWidget(self.tabs)
 
+        self.status = QLabel("Connecting...")
+        self.status.setStyleSheet("color: #aaa; font-size: 12px;")
+        layout.addWidget(self.status)
         self.setLayout(layout)
 
-if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    window = AdminPanel()
+    def _proxy(self, model):
+        proxy = RecordFilterProxy(self)
+        proxy.setSourceModel(model)
+        return proxy
+
+    def _table(self, model):
+        view = QTableView()
+        view.setModel(model)
+        view.setSortingEnabled(True)
+        view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        # Fixed row heights and interactive columns: sizing never walks all rows.
+        view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        view.verticalHeader().setDefaultSectionSize(24)
+        view.verticalHeader().hide()
+        view.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        view.horizontalHeader().setStretchLastSection(True)
+        return view
+
+    def submit(self, key, function):
+        """Run ``function`` on the pool unless a fetch for ``key`` is still running."""
+        if key in self.in_flight:
+            return False
+        self.in_flight.add(key)
+        task = FetchTask(key, function)
+        task.signals.finished.connect(self.on_fetched)
+        task.signals.failed.connect(self.on_failed)
+        self.pool.start(task)
+        return True
+
+    def login(self, username, password):
+        self.submit("login", lambda: self.client.login(username, password))
+
+    def start(self):
+        self.refresh()
+        self.refresh_timer.start()
+
+    def refresh(self):
+        self.submit("stats", lambda: self.client.get_json("/api/stats"))
+        self.submit("lockers", lambda: self.client.get_all("/api/lockers"))
+        self.submit("reservations", lambda: self.client.get_json(
+            f"/api/reservations?sort=-id&limit={RECENT_RESERVATIONS}"))
+
+    def on_fetched(self, key, result):
+        self.in_flight.discard(key)
+        if key == "login":
+            self.status.setText("Logged in")
+            self.start()
+            return
+        if result is None:
+            return  # 304: nothing changed
+        if key == "stats":
+            for name, (label, title) in self.stat_labels.items():
+                label.setText(f"{title}: {result.get(name, '–')}")
+        else:
+            model = self.lockers if key == "lockers" else self.reservations
+            self.last_diff[key] = model.apply(result)
+        self.status.setText(f"Updated {time.strftime('%H:%M:%S')}")
+
+    def on_failed(self, key, message):
+        self.in_flight.discard(key)
+        self.status.setText(f"{key}: {message}")
+
+    def closeEvent(self, event):
+        self.refresh_timer.stop()
+        self.clock.timer.stop()
+        self.pool.waitForDone(REQUEST_TIMEOUT * 1000)
+        super().closeEvent(event)
+
+class _TabLabel:
+    """Adapts a tab title to the ``setText`` interface ``TypewriterEffect`` writes to."""
+    def __init__(self, tabs, index):
+        self.tabs = tabs
+        self.index = index
+
+    def setText(self, text):
+        self.tabs.setTabText(self.index, text)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Smart Locker desktop dashboard")
+    parser.add_argument("--url", default=API_URL, help="Base URL of the Flask API")
+    parser.add_argument("--username", default=os.environ.get("ADMIN_PANEL_USERNAME", "serrah"))
+    parser.add_argument("--interval", type=int, default=REFRESH_INTERVAL_MS, help="Refresh interval in ms")
+    args = parser.parse_args(argv)
+    password = os.environ.get("ADMIN_PANEL_PASSWORD") or getpass.getpass(f"Password for {args.username}: ")
+
+    app = QApplication(sys.argv[:1])
+    window = AdminPanel(ApiClient(args.url), args.interval)
     window.show()  # Pencereyi göster
-    sys.exit(app.exec_())  # Main event loop'u başlat
+    window.login(args.username, password)
+    return app.exec_()  # Main event loop'u başlat
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""Hourly and daily rollups behind /api/analytics and the dashboard charts.
+
+``analytics_rollup`` holds one row per (bucket, start, metric) with a
+``count`` and a ``total``:
+
+* ``payments.<status>`` -- payments created in the bucket by current status;
+  ``total`` is the revenue.
+* ``customers.new`` -- customers created in the bucket.
+* ``reservations`` -- reservations overlapping the bucket, cancelled ones
+  excluded; ``total`` is the locker-hours they cover, the basis of occupancy.
+
+The rollups are kept incrementally like the counters in counters.py: an
+``after_flush`` hook subtracts each flushed row's old contribution and adds
+its new one in the same transaction, as one ``INSERT ... ON CONFLICT DO
+UPDATE SET count = count + excluded.count`` on SQLite and PostgreSQL. Core
+writers (bulk customer import, ``availability.reserve``, /api/batch) bypass
+the hook and report their rows through ``collect`` and ``apply_deltas``.
+The expiry scheduler only moves reservations between counted statuses and
+reports nothing. ``rebuild`` recomputes everything; it backs ``flask
+backfill-analytics`` and runs after ``flask seed``.
+
+Reading a range touches only its own buckets through the primary key, so the
+cost of /api/analytics depends on the number of buckets requested and never
+on how much history the source tables hold.
+"""
+from collections import defaultdict
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+import re
+
+from sqlalchemy import delete, event, insert, inspect, select, update
+
+from models import db, AnalyticsRollup, User, Reservation, Payment
+from database import reads
+import counters
+
+BUCKETS = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+MAX_BUCKETS = 24 * 31
+PAYMENT_STATUSES = ('completed', 'pending', 'cancelled')
+UNCOUNTED_RESERVATION_STATUSES = ('cancelled',)
+REBUILD_CHUNK = 10000
+
+# kind -> (model, columns a row contributes through)
+TRACKED = {
+    'payment': (Payment, ('status', 'amount', 'created_at')),
+    'customer': (User, ('role', 'created_at')),
+    'reservation': (Reservation, ('status', 'start_time', 'end_time')),
+}
+
+def floor(when, bucket):
+    if bucket == 'hour':
+        return when.replace(minute=0, second=0, microsecond=0)
+    return when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _add(deltas, key, count, total):
+    entry = deltas[key]
+    entry[0] += count
+    entry[1] += total
+
+def collect(kind, row, weight=1, deltas=None):
+    """Add the contribution of ``row`` (a mapping or object) to ``deltas``; return them.
+
+    ``weight=-1`` removes it, e.g. for the old values of an updated row; a
+    larger weight counts that many identical rows.
+    """
+    if deltas is None:
+        deltas = defaultdict(lambda: [0, 0.0])
+    value = row.get if isinstance(row, Mapping) else lambda key: getattr(row, key, None)
+    if kind == 'payment':
+        created_at = value('created_at')
+        if created_at is not None:
+            metric = f"payments.{value('status')}"
+            for bucket in BUCKETS:
+                _add(deltas, (bucket, floor(created_at, bucket), metric), weight, weight * float(value('amount') or 0))
+    elif kind == 'customer':
+        created_at = value('created_at')
+        if created_at is not None and value('role') == 'customer':
+            for bucket in BUCKETS:
+                _add(deltas, (bucket, floor(created_at, bucket), 'customers.new'), weight, 0.0)
+    elif kind == 'reservation':
+        start, end = value('start_time'), value('end_time')
+        if start is not None and end is not None and start < end \
+                and value('status') not in UNCOUNTED_RESERVATION_STATUSES:
+            for bucket, step in BUCKETS.items():
+                slot = floor(start, bucket)
+                while slot < end:
+                    hours = (min(end, slot + step) - max(start, slot)).total_seconds() / 3600
+                    _add(deltas, (bucket, slot, 'reservations'), weight, weight * hours)
+                    slot += step
+    return deltas
+
+def _upsert(connection):
+    """An ``INSERT ... ON CONFLICT DO UPDATE`` adding to the stored rollup, where supported."""
+    table = AnalyticsRollup.__table__
+    if connection.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    statement = dialect_insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.bucket, table.c.start, table.c.metric],
+        set_={'count': table.c.count + statement.excluded.count,
+              'total': table.c.total + statement.excluded.total},
+    )
+
+def apply_deltas(connection, deltas):
+    """Add ``deltas`` to the stored rollups inside the caller's transaction."""
+    rows = [{'bucket': bucket, 'start': start, 'metric': metric, 'count': count, 'total': total}
+            for (bucket, start, metric), (count, total) in sorted(deltas.items()) if count or total]
+    if not rows:
+        return
+    upsert = _upsert(connection)
+    if upsert is not None:
+        connection.execute(upsert, rows)
+        return
+    table = AnalyticsRollup.__table__
+    for row in rows:
+        result = connection.execute(
+            update(table)
+            .where(table.c.bucket == row['bucket'], table.c.start == row['start'], table.c.metric == row['metric'])
+            .values(count=table.c.count + row['count'], total=table.c.total + row['total'])
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(table).values(**row))
+
+def _history_values(obj, columns, deleted=False):
+    """Return the tracked values of ``obj`` before and after the flush."""
+    state = inspect(obj)
+    old, new = {}, {}
+    for key in columns:
+        history = state.attrs[key].history
+        # A deleted row cannot load expired attributes any more.
+        new[key] = state.dict.get(key) if deleted else getattr(obj, key)
+        old[key] = history.deleted[0] if history.deleted else new[key]
+    return old, new
+
+def collect_flushed(session):
+    """Return the rollup deltas of the objects flushed by ``session``."""
+    deltas = defaultdict(lambda: [0, 0.0])
+    for kind, (model, columns) in TRACKED.items():
+        for obj in session.new:
+            if isinstance(obj, model):
+                collect(kind, obj, 1, deltas)
+        for obj in session.deleted:
+            if isinstance(obj, model):
+                collect(kind, _history_values(obj, columns, deleted=True)[0], -1, deltas)
+        for obj in session.dirty:
+            if isinstance(obj, model) and obj not in session.deleted:
+                old, new = _history_values(obj, columns)
+                if old != new:
+                    collect(kind, old, -1, deltas)
+                    collect(kind, new, 1, deltas)
+    return deltas
+
+def _after_flush(session, flush_context):
+    deltas = collect_flushed(session)
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+def rebuild(connection):
+    """Recompute every rollup from the source tables; return the number of rows."""
+    deltas = defaultdict(lambda: [0, 0.0])
+    for kind, (model, columns) in TRACKED.items():
+        statement = select(*(getattr(model, key) for key in columns))
+        if kind == 'customer':
+            statement = statement.where(User.role == 'customer')
+        result = connection.execution_options(yield_per=REBUILD_CHUNK).execute(statement)
+        for row in result.mappings():
+            collect(kind, row, 1, deltas)
+    table = AnalyticsRollup.__table__
+    connection.execute(delete(table))
+    rows = [{'bucket': bucket, 'start': start, 'metric': metric, 'count': count, 'total': total}
+            for (bucket, start, metric), (count, total) in deltas.items() if count or total]
+    for offset in range(0, len(rows), REBUILD_CHUNK):
+        connection.execute(insert(table), rows[offset:offset + REBUILD_CHUNK])
+    return len(rows)
+
+def upgrade(connection):
+    """Backfill the rollups if they are empty but the source tables are not; return whether it did."""
+    if connection.execute(select(AnalyticsRollup.bucket).limit(1)).first() is not None:
+        return False
+    for model, _ in TRACKED.values():
+        if connection.execute(select(model.id).limit(1)).first() is not None:
+            rebuild(connection)
+            return True
+    return False
+
+def parse_range(text, bucket):
+    """Turn ``range`` (``24h``, ``7d``, ...) into a number of ``bucket`` buckets, or raise ``ValueError``."""
+    match = re.fullmatch(r'(\d{1,5})([hd])', text or '')
+    if match is None:
+        raise ValueError('range must look like 24h or 30d')
+    span = timedelta(hours=int(match.group(1))) if match.group(2) == 'h' else timedelta(days=int(match.group(1)))
+    buckets = -(-span // BUCKETS[bucket])
+    if not 0 < buckets <= MAX_BUCKETS:
+        raise ValueError(f'range must cover between 1 and {MAX_BUCKETS} buckets')
+    return buckets
+
+def series(bucket, buckets, total_lockers, now=None):
+    """Return the chart series for the last ``buckets`` buckets up to ``now``."""
+    step = BUCKETS[bucket]
+    end = floor(now or datetime.utcnow(), bucket) + step
+    start = end - step * buckets
+    rows = reads.execute(
+        select(AnalyticsRollup.start, AnalyticsRollup.metric, AnalyticsRollup.count, AnalyticsRollup.total)
+        .where(AnalyticsRollup.bucket == bucket, AnalyticsRollup.start >= start, AnalyticsRollup.start < end)
+    )
+    slots = [start + step * index for index in range(buckets)]
+    position = {slot: index for index, slot in enumerate(slots)}
+    revenue = {status: [0.0] * buckets for status in PAYMENT_STATUSES}
+    payments = {status: [0] * buckets for status in PAYMENT_STATUSES}
+    customers = [0] * buckets
+    reservations = [0] * buckets
+    reserved_hours = [0.0] * buckets
+    for slot, metric, count, total in rows:
+        index = position[slot]
+        if metric.startswith('payments.'):
+            status = metric.split('.', 1)[1]
+            revenue.setdefault(status, [0.0] * buckets)[index] = round(total, 2)
+            payments.setdefault(status, [0] * buckets)[index] = count
+        elif metric == 'customers.new':
+            customers[index] = count
+        elif metric == 'reservations':
+            reservations[index] = count
+            reserved_hours[index] = round(total, 2)
+    capacity = total_lockers * step.total_seconds() / 3600
+    return {
+        'bucket': bucket,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'labels': [slot.isoformat() for slot in slots],
+        'revenue': revenue,
+        'payments': payments,
+        'new_customers': customers,
+        'reservations': reservations,
+        'reserved_hours': reserved_hours,
+        'occupancy': [round(100 * hours / capacity, 2) if capacity else 0.0 for hours in reserved_hours],
+    }
+
+def init_app(app):
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+        for model, columns in TRACKED.values():
+            for key in columns:
+                counters.keep_history(getattr(model, key))
+
+    @app.cli.command('backfill-analytics')
+    def backfill_analytics_command():
+        """Recompute the /api/analytics rollups from the database."""
+        started = datetime.utcnow()
+        with db.engine.begin() as connection:
+            rows = rebuild(connection)
+        elapsed = (datetime.utcnow() - started).total_seconds()
+        print(f'wrote {rows} rollup row(s) in {elapsed:.1f}s')
@@ -1,105 +1,179 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from datetime import datetime, timedelta
+from flask import Blueprint, Flask, Response, current_app, stream_with_context, render_template, request, jsonify, redirect, url_for, flash
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
+from datetime import datetime
+from functools import wraps
+import csv
+import io
 import os
-from werkzeug.security import generate_password_hash, check_password_hash
+import database
+from database import reads
+from sqlalchemy import String, cast, func, insert, or_, select
+from models import db, User, Locker, Reservation, Payment, EventLog
+import counters
+import broker
+import export
+import migrations
+import hashing
+import user_cache
+import availability
+import notifications
+import metrics
+import table_versions
+import compression
+import seed
+import expiry
+import search
+import batch
+import claims
+import analytics
+
+views = Blueprint('views', __name__)
+login_manager = LoginManager()
+login_manager.login_view = 'views.login'
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///smart_locker.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pagination and filtering helpers
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
-db = SQLAlchemy(app)
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
-
-# Database Models
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(128), nullable=False)
-    role = db.Column(db.String(20), default='user')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    active = db.Column(db.Boolean, default=True)
-
-    def set_password(self, password):
-        self.password = generate_password_hash(password)
-
-    def check_password(self, password):
-        return check_password_hash(self.password, password)
-
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'username': self.username,
-            'email': self.email,
-            'role': self.role,
-            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None,
-            'active': self.active
-        }
+class InvalidQuery(ValueError):
+    """Raised when a list endpoint receives a malformed query parameter."""
 
-class Locker(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    number = db.Column(db.String(10), unique=True, nullable=False)
-    status = db.Column(db.String(20), nullable=False, default='available')
-    assigned_user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    assigned_user_name = db.Column(db.String(100))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'number': self.number,
-            'status': self.status,
-            'assigned_user_id': self.assigned_user_id,
-            'assigned_user_name': self.assigned_user_name,
-            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None
-        }
+@views.app_errorhandler(InvalidQuery)
+def handle_invalid_query(error):
+    return jsonify({'error': str(error)}), 400
 
-class Reservation(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    locker_id = db.Column(db.Integer, db.ForeignKey('locker.id'))
-    start_time = db.Column(db.DateTime, nullable=False)
-    end_time = db.Column(db.DateTime, nullable=False)
-    status = db.Column(db.String(20), default='pending')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class Payment(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    amount = db.Column(db.Float, nullable=False)
-    status = db.Column(db.String(20), default='pending')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+@views.app_errorhandler(hashing.HashingBusy)
+def handle_hashing_busy(error):
+    response = jsonify({'error': 'Server busy, please retry'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def int_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidQuery(f'{name} must be an integer')
+
+def datetime_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidQuery(f'{name} must be an ISO 8601 date or datetime')
+
+def keyset_page(statement, model, date_column=None):
+    """Apply the shared list parameters to ``statement`` and fetch one page.
+
+    Supports ``after_id``/``limit`` keyset pagination on the primary key,
+    ``sort=id`` or ``sort=-id`` and a ``date_from``/``date_to`` range on
+    ``date_column``. Returns the page rows and the cursor for the next page
+    (``None`` on the last page). ``statement`` is a Core ``select`` of the
+    columns to return, including ``model.id``; it runs on the read session's
+    connection, bypassing the ORM, and the rows come back as named tuples.
+    """
+    after_id = int_arg('after_id')
+    limit = int_arg('limit', DEFAULT_PAGE_SIZE)
+    if limit < 1:
+        raise InvalidQuery('limit must be positive')
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    sort = request.args.get('sort', 'id')
+    if sort not in ('id', '-id'):
+        raise InvalidQuery('sort must be id or -id')
+    descending = sort == '-id'
+
+    if date_column is not None:
+        date_from = datetime_arg('date_from')
+        date_to = datetime_arg('date_to')
+        if date_from is not None:
+            statement = statement.where(date_column >= date_from)
+        if date_to is not None:
+            statement = statement.where(date_column < date_to)
+
+    if after_id is not None:
+        statement = statement.where(model.id < after_id if descending else model.id > after_id)
+    statement = statement.order_by(model.id.desc() if descending else model.id.asc())
+
+    # Fetch one extra row to know whether another page exists.
+    rows = reads.connection().execute(statement.limit(limit + 1)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1].id
+    return rows, None
+
+def formatted(column):
+    """Select ``column`` as ``YYYY-MM-DD HH:MM:SS`` text formatted by the database."""
+    return func.substr(cast(column, String), 1, 19).label(column.key)
+
+def page_response(items, next_after_id):
+    response = jsonify(items)
+    if next_after_id is not None:
+        response.headers['X-Next-After-Id'] = str(next_after_id)
+    return response
+
+def rows_response(rows, next_after_id):
+    fields = rows[0]._fields if rows else ()
+    return page_response([dict(zip(fields, row)) for row in rows], next_after_id)
+
+def admin_required(view):
+    """Answer 403 to non-admins; goes above ``table_versions.conditional``."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_user.role != 'admin':
+            return jsonify({'error': 'Unauthorized'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+def active_filter(statement):
+    status = request.args.get('status')
+    if status == 'active':
+        return statement.where(User.active.is_(True))
+    if status == 'inactive':
+        return statement.where(User.active.is_(False))
+    if status:
+        raise InvalidQuery('status must be active or inactive')
+    return statement
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user = user_cache.cache.load(int(user_id))
+    if user is None or not user.active:
+        return None
+    return user
 
 # Login routes
-@app.route('/login', methods=['GET', 'POST'])
+@views.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
         user = User.query.filter_by(username=username).first()
         
-        if user and user.check_password(password):
-            login_user(user)
-            return redirect(url_for('dashboard'))
-        else:
-            flash('Invalid username or password', 'error')
+        try:
+            if user and user.check_password(password):
+                if user.password_needs_rehash():
+                    # Hash parameters changed since this password was stored
+                    user.set_password(password)
+                    db.session.commit()
+                login_user(user)
+                return redirect(url_for('views.dashboard'))
+            else:
+                flash('Invalid username or password', 'error')
+        except hashing.HashingBusy:
+            flash('Server busy, please try again', 'error')
     
     return render_template('login.html')
 
-@app.route('/logout')
+@views.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('views.login'))
 
 # Create admin user if not exists
 def create_admin_user():
@@ -108,36 +182,69 @@ def create_admin_user():
         admin.set_password('serra123')
         db.session.add(admin)
         db.session.commit()
-        create_sample_data()  # Create sample data after admin user is created
 
 # Routes
-@app.route('/')
+@views.route('/')
 @login_required
 def dashboard():
     return render_template('index.html')
 
-@app.route('/api/stats')
+@views.route('/api/stats')
 @login_required
 def get_stats():
-    total_users = User.query.count()
-    active_lockers = Locker.query.filter_by(status='occupied').count()
-    total_lockers = Locker.query.count()
-    pending_payments = Payment.query.filter_by(status='pending').count()
-    
+    return jsonify(counters.snapshot())
+
+@views.route('/api/analytics')
+@login_required
+def get_analytics():
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in analytics.BUCKETS:
+        raise InvalidQuery('bucket must be hour or day')
+    try:
+        buckets = analytics.parse_range(request.args.get('range', '7d'), bucket)
+    except ValueError as e:
+        raise InvalidQuery(str(e))
+    return jsonify(analytics.series(bucket, buckets, counters.snapshot()['total_lockers']))
+
+@views.route('/api/stream')
+@login_required
+def stream():
+    last_id = broker.parse_last_event_id(
+        request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    response = Response(broker.stream(last_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@views.route('/api/system/stats')
+@login_required
+def get_system_stats():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
     return jsonify({
-        'users': total_users,
-        'active_lockers': active_lockers,
-        'total_lockers': total_lockers,
-        'pending_payments': pending_payments
+        'hashing': hashing.hasher.stats(),
+        'user_cache': user_cache.cache.stats(),
+        'response_cache': table_versions.responses.stats(),
+        'expiry': expiry.scheduler.stats()
     })
 
-@app.route('/api/users', methods=['GET'])
+@views.route('/metrics')
+def get_metrics():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return Response(metrics.metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+@views.route('/api/users', methods=['GET'])
 @login_required
 def get_users():
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users])
+    statement = active_filter(select(User.id, User.username, User.email, User.role, formatted(User.created_at), User.active))
+    if request.args.get('role'):
+        statement = statement.where(User.role == request.args['role'])
+    users, next_after_id = keyset_page(statement, User, User.created_at)
+    return rows_response(users, next_after_id)
 
-@app.route('/api/users', methods=['POST'])
+@views.route('/api/users', methods=['POST'])
 @login_required
 def create_user():
     if current_user.role != 'admin':
@@ -165,7 +272,7 @@ def create_user():
     
     return jsonify(user.to_dict()), 201
 
-@app.route('/api/users/<int:user_id>', methods=['PUT'])
+@views.route('/api/users/<int:user_id>', methods=['PUT'])
 @login_required
 def update_user(user_id):
     if current_user.role != 'admin' and current_user.id != user_id:
@@ -191,9 +298,10 @@ def update_user(user_id):
         user.role = data['role']
     
     db.session.commit()
+    user_cache.cache.invalidate(user_id)
     return jsonify(user.to_dict())
 
-@app.route('/api/users/<int:user_id>', methods=['DELETE'])
+@views.route('/api/users/<int:user_id>', methods=['DELETE'])
 @login_required
 def delete_user(user_id):
     if current_user.role != 'admin':
@@ -205,20 +313,97 @@ def delete_user(user_id):
     
     db.session.delete(user)
     db.session.commit()
+    user_cache.cache.invalidate(user_id)
     return '', 204
 
-@app.route('/api/lockers', methods=['GET'])
+@views.route('/api/lockers', methods=['GET'])
 @login_required
+@table_versions.conditional('locker')
 def get_lockers():
-    lockers = Locker.query.all()
-    return jsonify([{
-        'id': locker.id,
-        'number': locker.number,
-        'status': locker.status,
-        'assigned_user_name': locker.assigned_user_name
-    } for locker in lockers])
-
-@app.route('/api/users/<int:user_id>', methods=['GET'])
+    statement = select(Locker.id, Locker.number, Locker.status, Locker.assigned_user_name, Locker.version)
+    if request.args.get('status'):
+        statement = statement.where(Locker.status == request.args['status'])
+    user_id = int_arg('user_id')
+    if user_id is not None:
+        statement = statement.where(Locker.assigned_user_id == user_id)
+    lockers, next_after_id = keyset_page(statement, Locker, Locker.created_at)
+    return rows_response(lockers, next_after_id)
+
+@views.route('/api/lockers/available', methods=['GET'])
+@login_required
+def get_available_lockers():
+    start = datetime_arg('start')
+    end = datetime_arg('end')
+    if start is None or end is None:
+        raise InvalidQuery('start and end are required')
+    if start >= end:
+        raise InvalidQuery('start must be before end')
+    lockers, next_after_id = keyset_page(availability.available_lockers(start, end), Locker)
+    return rows_response(lockers, next_after_id)
+
+def claimant(data):
+    """The user a claim is for: the caller, or ``user_id`` when an admin sends one."""
+    if current_user.role != 'admin' or data.get('user_id') is None:
+        return current_user.id
+    try:
+        user_id = int(data['user_id'])
+    except (TypeError, ValueError):
+        raise InvalidQuery('user_id must be an integer')
+    if db.session.get(User, user_id) is None:
+        raise InvalidQuery('User not found')
+    return user_id
+
+def expected_version(data):
+    version = data.get('version')
+    if version is None:
+        return None
+    try:
+        return int(version)
+    except (TypeError, ValueError):
+        raise InvalidQuery('version must be an integer')
+
+def claimed_response(row):
+    db.session.commit()
+    return jsonify(dict(row._mapping))
+
+def claim_conflict(locker_id, error):
+    db.session.rollback()
+    locker = db.session.get(Locker, locker_id)
+    if locker is None:
+        return jsonify({'error': 'Locker not found'}), 404
+    return jsonify({'error': error, 'locker': locker.to_dict()}), 409
+
+@views.route('/api/lockers/<int:locker_id>/claim', methods=['POST'])
+@login_required
+def claim_locker(locker_id):
+    data = request.get_json(silent=True) or {}
+    row = claims.claim(locker_id, claimant(data), expected_version(data))
+    if row is None:
+        return claim_conflict(locker_id, 'Locker is not available')
+    return claimed_response(row)
+
+@views.route('/api/lockers/claim', methods=['POST'])
+@login_required
+def claim_any_locker():
+    data = request.get_json(silent=True) or {}
+    row = claims.claim_any(claimant(data))
+    if row is None:
+        db.session.rollback()
+        return jsonify({'error': 'No locker is available'}), 409
+    return claimed_response(row)
+
+@views.route('/api/lockers/<int:locker_id>/release', methods=['POST'])
+@login_required
+def release_locker(locker_id):
+    data = request.get_json(silent=True) or {}
+    # Customers may only release their own locker
+    owner = None if current_user.role == 'admin' else current_user.id
+    row = claims.release(locker_id, expected_version(data), owner)
+    if row is None:
+        return claim_conflict(locker_id, 'Locker cannot be released')
+    return claimed_response(row)
+
+@views.route('/api/users/<int:user_id>', methods=['GET'])
 @login_required
 def get_user(user_id):
     if current_user.role != 'admin' and current_user.id != user_id:
@@ -227,103 +412,222 @@ def get_user(user_id):
     user = User.query.get_or_404(user_id)
     return jsonify(user.to_dict())
 
-@app.route('/api/reservations', methods=['GET'])
+@views.route('/api/reservations', methods=['GET'])
 @login_required
+@table_versions.conditional('reservation')
 def get_reservations():
-    reservations = Reservation.query.all()
-    return jsonify([{
-        'id': r.id,
-        'user_id': r.user_id,
-        'locker_id': r.locker_id,
-        'start_time': r.start_time.strftime('%Y-%m-%d %H:%M:%S'),
-        'end_time': r.end_time.strftime('%Y-%m-%d %H:%M:%S'),
-        'status': r.status
-    } for r in reservations])
-
-@app.route('/api/payments', methods=['GET'])
+    statement = select(
+        Reservation.id, Reservation.user_id, Reservation.locker_id,
+        formatted(Reservation.start_time), formatted(Reservation.end_time), Reservation.status
+    )
+    if request.args.get('status'):
+        statement = statement.where(Reservation.status == request.args['status'])
+    user_id = int_arg('user_id')
+    if user_id is not None:
+        statement = statement.where(Reservation.user_id == user_id)
+    locker_id = int_arg('locker_id')
+    if locker_id is not None:
+        statement = statement.where(Reservation.locker_id == locker_id)
+    reservations, next_after_id = keyset_page(statement, Reservation, Reservation.start_time)
+    return rows_response(reservations, next_after_id)
+
+@views.route('/api/reservations', methods=['POST'])
+@login_required
+def create_reservation():
+    data = request.get_json()
+    if not data or not all(k in data for k in ['locker_id', 'start_time', 'end_time']):
+        return jsonify({'error': 'Missing required fields'}), 400
+
+    # Only admins may book on behalf of someone else
+    user_id = data.get('user_id', current_user.id) if current_user.role == 'admin' else current_user.id
+    try:
+        locker_id = int(data['locker_id'])
+        start = datetime.fromisoformat(data['start_time'])
+        end = datetime.fromisoformat(data['end_time'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid locker_id or time format'}), 400
+    if start >= end:
+        return jsonify({'error': 'start_time must be before end_time'}), 400
+
+    status = data.get('status', 'pending')
+    if status not in availability.BLOCKING_STATUSES:
+        return jsonify({'error': 'status must be pending or active'}), 400
+    locker = db.session.get(Locker, locker_id)
+    if locker is None:
+        return jsonify({'error': 'Locker not found'}), 404
+    if locker.status in availability.UNAVAILABLE_LOCKER_STATUSES:
+        return jsonify({'error': 'Locker is not available'}), 409
+
+    try:
+        reservation_id = availability.reserve(user_id, locker_id, start, end, status)
+        if reservation_id is None:
+            db.session.rollback()
+            overlapping = availability.conflicts(locker_id, start, end)
+            if not overlapping:
+                return jsonify({'error': 'Locker is not available'}), 409
+            return jsonify({
+                'error': 'Locker is already reserved for that time',
+                'conflicts': [r.id for r in overlapping]
+            }), 409
+        reservation = {
+            'id': reservation_id,
+            'user_id': user_id,
+            'locker_id': locker_id,
+            'start_time': start.strftime('%Y-%m-%d %H:%M:%S'),
+            'end_time': end.strftime('%Y-%m-%d %H:%M:%S'),
+            'status': status
+        }
+        broker.queue_event(db.session, 'reservation', {
+            'op': 'created',
+            'id': reservation_id,
+            'user_id': user_id,
+            'locker_id': locker_id,
+            'status': status
+        })
+        db.session.commit()
+        if status == 'pending':
+            expiry.scheduler.schedule(start)
+        expiry.scheduler.schedule(end)
+        return jsonify(reservation), 201
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('could not create reservation')
+        return jsonify({'error': 'Failed to create reservation'}), 500
+
+@views.route('/api/payments', methods=['GET'])
 @login_required
+@table_versions.conditional('payment')
 def get_payments():
-    payments = Payment.query.all()
-    return jsonify([{
-        'id': p.id,
-        'user_id': p.user_id,
-        'amount': float(p.amount),
-        'status': p.status,
-        'payment_date': p.created_at.strftime('%Y-%m-%d %H:%M:%S') if p.created_at else None
-    } for p in payments])
-
-@app.route('/api/notifications', methods=['GET'])
+    statement = select(
+        Payment.id, Payment.user_id, Payment.amount, Payment.status,
+        formatted(Payment.created_at).label('payment_date')
+    )
+    if request.args.get('status'):
+        statement = statement.where(Payment.status == request.args['status'])
+    user_id = int_arg('user_id')
+    if user_id is not None:
+        statement = statement.where(Payment.user_id == user_id)
+    payments, next_after_id = keyset_page(statement, Payment, Payment.created_at)
+    return rows_response(payments, next_after_id)
+
+# Columns of each search hit, the same as its list endpoint returns
+SEARCH_COLUMNS = {
+    'user': (User, lambda: select(User.id, User.username, User.email, User.role, formatted(User.created_at), User.active)),
+    'locker': (Locker, lambda: select(Locker.id, Locker.number, Locker.status, Locker.assigned_user_name)),
+    'payment': (Payment, lambda: select(
+        Payment.id, Payment.user_id, Payment.amount, Payment.status,
+        formatted(Payment.created_at).label('payment_date')
+    )),
+}
+
+@views.route('/api/search', methods=['GET'])
+@login_required
+@table_versions.conditional('user', 'locker', 'payment')
+def search_records():
+    expression = search.match_expression(request.args.get('q', ''))
+    if expression is None:
+        raise InvalidQuery('q must contain at least one word')
+    kind = request.args.get('type') or None
+    if kind is not None and kind not in search.KINDS:
+        raise InvalidQuery('type must be user, locker or payment')
+    limit = int_arg('limit', DEFAULT_PAGE_SIZE)
+    if limit < 1:
+        raise InvalidQuery('limit must be positive')
+    limit = min(limit, MAX_PAGE_SIZE)
+    offset = int_arg('offset', 0)
+    if offset < 0:
+        raise InvalidQuery('offset must not be negative')
+
+    connection = reads.connection()
+    if not search.supported(connection):
+        return jsonify({'error': 'Search needs SQLite FTS5'}), 501
+    hits = search.find(connection, expression, kind, limit + 1, offset)
+    next_offset = offset + limit if len(hits) > limit else None
+    hits = hits[:limit]
+
+    # Load the matched rows with one query per type, then restore the rank order.
+    rows = {}
+    for name, (model, columns) in SEARCH_COLUMNS.items():
+        ids = [row_id for hit_kind, row_id in hits if hit_kind == name]
+        if ids:
+            for row in connection.execute(columns().where(model.id.in_(ids))):
+                rows[name, row.id] = dict(row._mapping, type=name)
+    items = [rows[hit] for hit in hits if hit in rows]
+    response = jsonify(items)
+    if next_offset is not None:
+        response.headers['X-Next-Offset'] = str(next_offset)
+    return response
+
+def export_response(name, statement, fields, date_column, status_column):
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        raise InvalidQuery('format must be csv or ndjson')
+    date_from = datetime_arg('date_from')
+    date_to = datetime_arg('date_to')
+    if date_from is not None:
+        statement = statement.where(date_column >= date_from)
+    if date_to is not None:
+        statement = statement.where(date_column < date_to)
+    if request.args.get('status'):
+        statement = statement.where(status_column == request.args['status'])
+
+    rows = export.stream_rows(statement, fields, fmt)
+    response = Response(stream_with_context(rows), mimetype=export.FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={name}.{fmt}'
+    return response
+
+@views.route('/api/export/payments', methods=['GET'])
+@login_required
+def export_payments():
+    statement = select(
+        Payment.id, Payment.user_id, Payment.amount, Payment.status, Payment.created_at
+    ).order_by(Payment.id)
+    fields = ['id', 'user_id', 'amount', 'status', 'payment_date']
+    return export_response('payments', statement, fields, Payment.created_at, Payment.status)
+
+@views.route('/api/export/reservations', methods=['GET'])
+@login_required
+def export_reservations():
+    statement = select(
+        Reservation.id, Reservation.user_id, Reservation.locker_id, Reservation.start_time,
+        Reservation.end_time, Reservation.status, Reservation.created_at
+    ).order_by(Reservation.id)
+    fields = ['id', 'user_id', 'locker_id', 'start_time', 'end_time', 'status', 'created_at']
+    return export_response('reservations', statement, fields, Reservation.start_time, Reservation.status)
+
+@views.route('/api/notifications', methods=['GET'])
 @login_required
 def get_notifications():
-    notifications = [
-        {
-            'id': 1,
-            'title': 'New Reservation',
-            'message': 'Emma Wilson made a reservation for Locker #108',
-            'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
-            'type': 'info'
-        },
-        {
-            'id': 2,
-            'title': 'Payment Pending',
-            'message': 'Ahmet Yılmaz has a pending payment of $50.00',
-            'timestamp': (datetime.utcnow() - timedelta(minutes=30)).strftime('%Y-%m-%d %H:%M:%S'),
-            'type': 'warning'
-        },
-        {
-            'id': 3,
-            'title': 'Locker Vacancy',
-            'message': 'Locker #104 will be vacated by Zeynep Demir in 12 hours',
-            'timestamp': (datetime.utcnow() - timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S'),
-            'type': 'warning'
-        },
-        {
-            'id': 4,
-            'title': 'Payment Received',
-            'message': 'Payment of $45.00 received from Can ÖztÜrk',
-            'timestamp': (datetime.utcnow() - timedelta(hours=2)).strftime('%Y-%m-%d %H:%M:%S'),
-            'type': 'success'
-        },
-        {
-            'id': 5,
-            'title': 'Locker Maintenance',
-            'message': 'Lockers #102, #105, #107, and #110 are ready for use',
-            'timestamp': (datetime.utcnow() - timedelta(hours=3)).strftime('%Y-%m-%d %H:%M:%S'),
-            'type': 'info'
-        },
-        {
-            'id': 6,
-            'title': 'Long-term Reservation',
-            'message': 'Mehmet Kaya rented Locker #106 for 2 days',
-            'timestamp': (datetime.utcnow() - timedelta(hours=4)).strftime('%Y-%m-%d %H:%M:%S'),
-            'type': 'info'
-        },
-        {
-            'id': 7,
-            'title': 'New Customers',
-            'message': 'Maria Garcia and Hans Schmidt have registered',
-            'timestamp': (datetime.utcnow() - timedelta(hours=5)).strftime('%Y-%m-%d %H:%M:%S'),
-            'type': 'success'
-        }
-    ]
-    return jsonify(notifications)
-
-@app.route('/api/customers', methods=['GET'])
+    since = int_arg('since')
+    limit = min(max(int_arg('limit', 50), 1), MAX_PAGE_SIZE)
+    query = reads.query(
+        EventLog.id, EventLog.title, EventLog.message, EventLog.created_at, EventLog.type
+    )
+    if since is not None:
+        # Newer events, oldest first, so the client can keep advancing the cursor
+        rows = query.filter(EventLog.id > since).order_by(EventLog.id.asc()).limit(limit).all()
+    else:
+        rows = query.order_by(EventLog.id.desc()).limit(limit).all()[::-1]
+    response = jsonify([{
+        'id': row.id,
+        'title': row.title,
+        'message': row.message,
+        'timestamp': row.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'type': row.type
+    } for row in rows])
+    response.headers['X-Next-Since'] = str(rows[-1].id if rows else since or 0)
+    return response
+
+@views.route('/api/customers', methods=['GET'])
+@login_required
+@admin_required
+@table_versions.conditional('user')
 def get_customers():
-    if not current_user.is_authenticated or current_user.role != 'admin':
-        return jsonify({'error': 'Unauthorized'}), 403
-    
-    customers = User.query.filter_by(role='customer').all()
-    return jsonify([{
-        'id': user.id,
-        'username': user.username,
-        'email': user.email,
-        'role': user.role,
-        'created_at': user.created_at.strftime('%Y-%m-%d %H:%M:%S') if user.created_at else None,
-        'active': user.active
-    } for user in customers])
-
-@app.route('/api/customers', methods=['POST'])
+    statement = active_filter(select(User.id, User.username, User.email, User.role, formatted(User.created_at), User.active).where(User.role == 'customer'))
+    customers, next_after_id = keyset_page(statement, User, User.created_at)
+    return rows_response(customers, next_after_id)
+
+@views.route('/api/customers', methods=['POST'])
 def create_customer():
     if not current_user.is_authenticated or current_user.role != 'admin':
         return jsonify({'error': 'Unauthorized'}), 403
@@ -362,7 +666,115 @@ def create_customer():
         db.session.rollback()
         return jsonify({'error': 'Failed to create customer'}), 500
 
-@app.route('/api/customers/<int:customer_id>', methods=['PUT'])
+BULK_IMPORT_MAX_ROWS = 10000
+BULK_LOOKUP_CHUNK = 500  # stays under SQLite's bound-parameter limit
+
+def read_bulk_rows():
+    """Return the uploaded customer rows from a JSON array or a CSV file/body."""
+    upload = request.files.get('file')
+    if upload is not None or request.mimetype == 'text/csv':
+        raw = upload.read() if upload is not None else request.get_data()
+        try:
+            text = raw.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise InvalidQuery('CSV must be UTF-8 encoded')
+        return list(csv.DictReader(io.StringIO(text)))
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        raise InvalidQuery('Expected a JSON array or a CSV upload')
+    return data
+
+def existing_usernames_and_emails(usernames, emails):
+    taken_usernames, taken_emails = set(), set()
+    usernames, emails = list(usernames), list(emails)
+    for start in range(0, max(len(usernames), len(emails)), BULK_LOOKUP_CHUNK):
+        chunk_usernames = usernames[start:start + BULK_LOOKUP_CHUNK]
+        chunk_emails = emails[start:start + BULK_LOOKUP_CHUNK]
+        rows = db.session.execute(
+            select(User.username, User.email).where(or_(
+                User.username.in_(chunk_usernames), User.email.in_(chunk_emails)
+            ))
+        )
+        for username, email in rows:
+            taken_usernames.add(username)
+            taken_emails.add(email)
+    return taken_usernames, taken_emails
+
+@views.route('/api/customers/bulk', methods=['POST'])
+def bulk_create_customers():
+    if not current_user.is_authenticated or current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    rows = read_bulk_rows()
+    if len(rows) > BULK_IMPORT_MAX_ROWS:
+        return jsonify({'error': f'At most {BULK_IMPORT_MAX_ROWS} customers per import'}), 400
+
+    errors = []
+    candidates = []
+    seen_usernames, seen_emails = set(), set()
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors.append({'row': index, 'error': 'Row must be an object'})
+            continue
+        username = str(row.get('username') or '').strip()
+        email = str(row.get('email') or '').strip()
+        password = str(row.get('password') or '')
+        if not username or not email or not password:
+            errors.append({'row': index, 'error': 'Missing required fields'})
+        elif len(username) > 80 or len(email) > 120:
+            errors.append({'row': index, 'error': 'Username or email too long'})
+        elif username in seen_usernames:
+            errors.append({'row': index, 'error': 'Duplicate username in upload'})
+        elif email in seen_emails:
+            errors.append({'row': index, 'error': 'Duplicate email in upload'})
+        else:
+            seen_usernames.add(username)
+            seen_emails.add(email)
+            candidates.append((index, username, email, password))
+
+    taken_usernames, taken_emails = existing_usernames_and_emails(seen_usernames, seen_emails)
+    accepted = []
+    for index, username, email, password in candidates:
+        if username in taken_usernames:
+            errors.append({'row': index, 'error': 'Username already exists'})
+        elif email in taken_emails:
+            errors.append({'row': index, 'error': 'Email already exists'})
+        else:
+            accepted.append((username, email, password))
+
+    if accepted:
+        hashes = hashing.hasher.hash_many(password for _, _, password in accepted)
+        now = datetime.utcnow()
+        try:
+            db.session.execute(insert(User), [{
+                'username': username,
+                'email': email,
+                'password': pwhash,
+                'role': 'customer',
+                'active': True,
+                'created_at': now
+            } for (username, email, _), pwhash in zip(accepted, hashes)])
+            # Core inserts skip the flush hooks that maintain counters and events
+            counters.apply_deltas(db.session.connection(), {'users': len(accepted)})
+            analytics.apply_deltas(db.session.connection(), analytics.collect(
+                'customer', {'role': 'customer', 'created_at': now}, len(accepted)))
+            table_versions.bump(db.session.connection(), ['user'])
+            broker.queue_event(db.session, 'stats', {'users': len(accepted)})
+            broker.queue_event(db.session, 'customer', {'op': 'imported', 'count': len(accepted)})
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception('could not import %d customer(s)', len(accepted))
+            return jsonify({'error': 'Failed to import customers'}), 500
+
+    errors.sort(key=lambda error: error['row'])
+    return jsonify({
+        'created': len(accepted),
+        'failed': len(errors),
+        'errors': errors
+    }), 201 if accepted else 400
+
+@views.route('/api/customers/<int:customer_id>', methods=['PUT'])
 def update_customer(customer_id):
     if not current_user.is_authenticated or current_user.role != 'admin':
         return jsonify({'error': 'Unauthorized'}), 403
@@ -395,6 +807,7 @@ def update_customer(customer_id):
     
     try:
         db.session.commit()
+        user_cache.cache.invalidate(customer_id)
         return jsonify({
             'id': customer.id,
             'username': customer.username,
@@ -407,7 +820,7 @@ def update_customer(customer_id):
         db.session.rollback()
         return jsonify({'error': 'Failed to update customer'}), 500
 
-@app.route('/api/customers/<int:customer_id>', methods=['DELETE'])
+@views.route('/api/customers/<int:customer_id>', methods=['DELETE'])
 def delete_customer(customer_id):
     if not current_user.is_authenticated or current_user.role != 'admin':
         return jsonify({'error': 'Unauthorized'}), 403
@@ -420,109 +833,86 @@ def delete_customer(customer_id):
         # Instead of deleting, we can deactivate the customer
         customer.active = False
         db.session.commit()
+        user_cache.cache.invalidate(customer_id)
         return '', 204
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Failed to delete customer'}), 500
 
-# Add sample data creation function
-def create_sample_data():
-    # Create sample users first
-    if not User.query.filter_by(username='john_doe').first():
-        users = [
-            User(username='john_doe', email='john@example.com', role='customer'),
-            User(username='maria_garcia', email='maria@example.com', role='customer'),
-            User(username='ahmet_yilmaz', email='ahmet@example.com', role='customer'),
-            User(username='zeynep_demir', email='zeynep@example.com', role='customer'),
-            User(username='hans_schmidt', email='hans@example.com', role='customer'),
-            User(username='mehmet_kaya', email='mehmet@example.com', role='customer'),
-            User(username='ayse_celik', email='ayse@example.com', role='customer'),
-            User(username='emma_wilson', email='emma@example.com', role='customer'),
-            User(username='can_ozturk', email='can@example.com', role='customer'),
-            User(username='sofia_rossi', email='sofia@example.com', role='customer'),
-            User(username='murat_kaya', email='murat@example.com', role='customer'),
-            User(username='seyda_demir', email='seyda@example.com', role='customer'),
-            User(username='ali_yildiz', email='ali@example.com', role='customer'),
-            User(username='fatma_sahin', email='fatma@example.com', role='customer'),
-            User(username='deniz_arslan', email='deniz@example.com', role='customer')
-        ]
-        for user in users:
-            user.set_password('password123')
-            db.session.add(user)
-        db.session.commit()
+@views.route('/api/batch', methods=['POST'])
+def apply_batch():
+    if not current_user.is_authenticated or current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
 
-    # Create sample lockers with some empty ones
-    if not Locker.query.first():
-        lockers = [
-            Locker(number='L101', status='occupied', assigned_user_id=11, assigned_user_name='Murat Kaya'),
-            Locker(number='L102', status='occupied', assigned_user_id=12, assigned_user_name='Şeyda Demir'),
-            Locker(number='L103', status='occupied', assigned_user_id=3, assigned_user_name='Ahmet Yılmaz'),
-            Locker(number='L104', status='occupied', assigned_user_id=4, assigned_user_name='Zeynep Demir'),
-            Locker(number='L105', status='available', assigned_user_id=None, assigned_user_name=None),
-            Locker(number='L106', status='occupied', assigned_user_id=6, assigned_user_name='Mehmet Kaya'),
-            Locker(number='L107', status='available', assigned_user_id=None, assigned_user_name=None),
-            Locker(number='L108', status='occupied', assigned_user_id=8, assigned_user_name='Emma Wilson'),
-            Locker(number='L109', status='occupied', assigned_user_id=9, assigned_user_name='Can Öztürk'),
-            Locker(number='L110', status='available', assigned_user_id=None, assigned_user_name=None),
-            Locker(number='L111', status='occupied', assigned_user_id=2, assigned_user_name='Maria Garcia'),
-            Locker(number='L112', status='occupied', assigned_user_id=5, assigned_user_name='Hans Schmidt'),
-            Locker(number='L113', status='available', assigned_user_id=None, assigned_user_name=None),
-            Locker(number='L114', status='occupied', assigned_user_id=13, assigned_user_name='Ali Yıldız'),
-            Locker(number='L115', status='occupied', assigned_user_id=14, assigned_user_name='Fatma Şahin')
-        ]
-        for locker in lockers:
-            db.session.add(locker)
-        db.session.commit()
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else None
+    errors = batch.validate(operations)
+    if errors:
+        return jsonify({'error': 'Invalid batch', 'errors': errors}), 400
 
-    # Create sample reservations with mixed statuses
-    if not Reservation.query.first():
-        reservations = [
-            Reservation(user_id=12, locker_id=2, start_time=datetime.utcnow(), 
-                      end_time=datetime.utcnow() + timedelta(hours=2), status='active'),
-            Reservation(user_id=3, locker_id=3, start_time=datetime.utcnow() - timedelta(hours=2),
-                      end_time=datetime.utcnow() + timedelta(hours=22), status='active'),
-            Reservation(user_id=4, locker_id=4, start_time=datetime.utcnow() - timedelta(days=1),
-                      end_time=datetime.utcnow() + timedelta(hours=12), status='active'),
-            Reservation(user_id=6, locker_id=6, start_time=datetime.utcnow(),
-                      end_time=datetime.utcnow() + timedelta(days=2), status='active'),
-            Reservation(user_id=8, locker_id=8, start_time=datetime.utcnow() + timedelta(days=1),
-                      end_time=datetime.utcnow() + timedelta(days=3), status='pending'),
-            Reservation(user_id=9, locker_id=9, start_time=datetime.utcnow(),
-                      end_time=datetime.utcnow() + timedelta(hours=48), status='active'),
-            Reservation(user_id=13, locker_id=14, start_time=datetime.utcnow(),
-                      end_time=datetime.utcnow() + timedelta(hours=4), status='active'),
-            Reservation(user_id=14, locker_id=15, start_time=datetime.utcnow(),
-                      end_time=datetime.utcnow() + timedelta(hours=6), status='pending'),
-            Reservation(user_id=11, locker_id=1, start_time=datetime.utcnow(),
-                      end_time=datetime.utcnow() + timedelta(hours=1), status='active')
-        ]
-        for reservation in reservations:
-            db.session.add(reservation)
+    try:
+        results = batch.apply(operations)
         db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('could not apply batch')
+        return jsonify({'error': 'Failed to apply batch'}), 500
+    for user_id in batch.changed_users(results):
+        user_cache.cache.invalidate(user_id)
+    return jsonify({
+        'updated': sum(len(result['updated']) for result in results),
+        'results': results
+    })
 
-    # Create sample payments with different amounts and statuses
-    if not Payment.query.first():
-        payments = [
-            Payment(user_id=1, amount=25.00, status='completed'),
-            Payment(user_id=3, amount=50.00, status='pending'),
-            Payment(user_id=4, amount=15.00, status='completed'),
-            Payment(user_id=6, amount=75.00, status='completed'),
-            Payment(user_id=8, amount=30.00, status='pending'),
-            Payment(user_id=9, amount=45.00, status='completed'),
-            Payment(user_id=11, amount=20.00, status='pending'),
-            Payment(user_id=12, amount=35.00, status='completed'),
-            Payment(user_id=13, amount=40.00, status='pending'),
-            Payment(user_id=14, amount=55.00, status='completed'),
-            Payment(user_id=15, amount=60.00, status='pending')
-        ]
-        for payment in payments:
-            db.session.add(payment)
-        db.session.commit()
+def default_config():
+    """Configuration read from the environment."""
+    return {
+        'SECRET_KEY': os.environ.get('SECRET_KEY', 'your-secret-key-here'),
+        'SQLALCHEMY_DATABASE_URI': os.environ.get('DATABASE_URL', 'sqlite:///smart_locker.db'),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'PASSWORD_HASH_METHOD': os.environ.get('PASSWORD_HASH_METHOD', hashing.DEFAULT_METHOD),
+        'PASSWORD_HASH_WORKERS': int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1)),
+        'METRICS_SAMPLE_RATE': float(os.environ.get('METRICS_SAMPLE_RATE', 1.0)),
+        'METRICS_QUERY_BUDGET': int(os.environ.get('METRICS_QUERY_BUDGET', 20)),
+        'METRICS_TOKEN': os.environ.get('METRICS_TOKEN'),
+        'EXPIRY_SCHEDULER': os.environ.get('EXPIRY_SCHEDULER', 'thread'),
+        'BROKER_RELAY': os.environ.get('BROKER_RELAY', 'off') == 'on',
+    }
+
+def create_app(config=None):
+    """Build the application; ``config`` overrides the environment defaults.
+
+    The extensions keep process-wide state (engines, caches, the event
+    broker), so create one application per process. The schema is not
+    touched here: run ``flask upgrade-db`` before serving.
+    """
+    app = Flask(__name__)
+    app.config.update(default_config())
+    app.config.update(config or {})
+
+    database.init_app(app)
+    hashing.init_app(app)
+    user_cache.init_app(app)
+    counters.init_app(app)
+    analytics.init_app(app)
+    table_versions.init_app(app)
+    broker.init_app(app)
+    notifications.init_app(app)
+    metrics.init_app(app)
+    compression.init_app(app)
+    migrations.init_app(app)
+    seed.init_app(app)
+    search.init_app(app)
+    expiry.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(views)
+    return app
 
 if __name__ == '__main__':
+    # Development server. Existing data is kept; run `flask seed` to generate
+    # sample data and serve.py for production.
+    app = create_app()
     with app.app_context():
-        db.drop_all()  # Drop all tables
-        db.create_all()  # Create all tables
+        migrations.upgrade()  # Create missing tables, columns and indexes
         create_admin_user()  # Create admin user
-        create_sample_data()  # Create sample data
     app.run(debug=True) 
\ No newline at end of file
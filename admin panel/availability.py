@@ -0,0 +1,89 @@
+"""Locker availability over the reservation interval index.
+
+Reservations are intervals ``[start_time, end_time)`` per locker, indexed by
+``ix_reservation_locker_end`` (locker_id, end_time, start_time). A
+reservation overlapping ``[start, end)`` ends after ``start``, so an overlap
+probe is one range search on that index that skips the locker's past
+bookings, the bulk of its history, and reads ``start_time`` from the same
+index entries.
+
+Lockers can also be claimed without a reservation (see claims.py). A claim
+has no end, so a locker that is occupied while its assignee has no
+reservation in progress is unavailable for every interval; one occupied by a
+reservation stays bookable after that reservation.
+
+Creating a reservation is a single ``INSERT ... SELECT ... WHERE NOT EXISTS``.
+SQLite runs it under the database write lock, so the conflict check and the
+insert are atomic there; other backends first lock the locker row with
+``SELECT ... FOR UPDATE`` so concurrent bookings of one locker take turns.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, exists, func, insert, literal, select
+
+from models import db, Locker, Reservation
+import analytics
+import table_versions
+
+BLOCKING_STATUSES = ('pending', 'active')
+UNAVAILABLE_LOCKER_STATUSES = ('maintenance',)
+
+def overlaps(start, end, locker_id):
+    """SQL criterion for blocking reservations of ``locker_id`` overlapping ``[start, end)``."""
+    return and_(
+        Reservation.locker_id == locker_id,
+        Reservation.end_time > start,
+        # start_time is never NULL; the coalesce only keeps the planner from
+        # ranging over it on ix_reservation_locker_start, which would walk the
+        # locker's whole history, instead of over end_time.
+        func.coalesce(Reservation.start_time, end) < end,
+        Reservation.status.in_(BLOCKING_STATUSES),
+    )
+
+def in_progress(when, locker_id):
+    """SQL criterion for blocking reservations of ``locker_id`` in progress at ``when``."""
+    return overlaps(when, when + timedelta(microseconds=1), locker_id)
+
+def claimed(when):
+    """SQL criterion for lockers held by a claim: occupied with no reservation of the assignee at ``when``."""
+    return and_(
+        Locker.status == 'occupied',
+        ~exists().where(in_progress(when, Locker.id), Reservation.user_id == Locker.assigned_user_id),
+    )
+
+def available_lockers(start, end):
+    """Select lockers with no blocking reservation in ``[start, end)`` and no claim."""
+    return select(Locker.id, Locker.number, Locker.status).where(
+        Locker.status.notin_(UNAVAILABLE_LOCKER_STATUSES),
+        ~claimed(datetime.utcnow()),
+        ~exists().where(overlaps(start, end, Locker.id)),
+    )
+
+def conflicts(locker_id, start, end):
+    return Reservation.query.filter(overlaps(start, end, locker_id)).order_by(Reservation.start_time).all()
+
+def reserve(user_id, locker_id, start, end, status='pending'):
+    """Insert a reservation unless it overlaps another or the locker is claimed; return its id or ``None``.
+
+    Runs inside the caller's transaction; the caller commits.
+    """
+    if db.session.connection().dialect.name != 'sqlite':
+        db.session.execute(select(Locker.id).where(Locker.id == locker_id).with_for_update())
+    now = datetime.utcnow()
+    values = select(
+        literal(user_id), literal(locker_id), literal(start), literal(end),
+        literal(status), literal(now)
+    ).where(
+        ~exists().where(overlaps(start, end, locker_id)),
+        ~exists().where(Locker.id == locker_id, claimed(now)),
+    )
+    statement = insert(Reservation).from_select(
+        ['user_id', 'locker_id', 'start_time', 'end_time', 'status', 'created_at'], values
+    ).returning(Reservation.id)
+    reservation_id = db.session.execute(statement).scalar()
+    if reservation_id is not None:
+        connection = db.session.connection()
+        table_versions.bump(connection, ['reservation'])
+        analytics.apply_deltas(connection, analytics.collect('reservation', {
+            'status': status, 'start_time': start, 'end_time': end}))
+    return reservation_id
@@ -0,0 +1,261 @@
+"""Set-based bulk changes behind POST /api/batch.
+
+A batch is a list of operations, each naming an action and the ids it
+applies to::
+
+    {"operations": [
+        {"op": "locker.status", "ids": [1, 2, 3], "status": "maintenance"},
+        {"op": "locker.assign", "ids": [4], "user_id": 7},
+        {"op": "customer.deactivate", "ids": [10, 11]},
+        {"op": "payment.status", "ids": [5, 6], "status": "completed"}
+    ]}
+
+``locker.assign`` with ``"user_id": null`` releases the lockers, and so does
+``locker.status`` with ``"available"``. ``validate`` checks the whole batch
+first, so a malformed one changes nothing. ``apply`` then runs the
+operations in order in the caller's transaction. Each one is a ``SELECT`` of
+the current rows and an ``UPDATE ... WHERE id IN (...)`` for the rows that
+actually change, both in chunks of ``CHUNK`` ids. Every id is reported as updated, unchanged
+(already in the requested state), skipped (lockers under maintenance cannot
+be assigned, and only lockers with an assignee can be marked occupied) or
+not found.
+
+The statements bypass the flush hooks, so ``apply`` increments
+``User.version`` and ``Locker.version`` and records counter deltas,
+analytics rollups, table versions and broker events itself. Bumping the
+table versions first takes SQLite's write lock before anything is read, so
+the rows cannot change between the ``SELECT`` and the ``UPDATE``; other
+databases lock them with ``SELECT ... FOR UPDATE``. The caller commits and
+then drops the changed users from the user cache.
+"""
+from collections import Counter
+
+from sqlalchemy import select, update
+
+from models import db, User, Locker, Payment
+import analytics
+import broker
+import counters
+import table_versions
+import user_cache
+
+MAX_OPERATIONS = 100
+MAX_IDS = 10000
+CHUNK = 500  # stays under SQLite's bound-parameter limit
+LOCKER_STATUSES = ('available', 'occupied', 'maintenance')
+PAYMENT_STATUSES = ('pending', 'completed', 'cancelled')
+
+# op -> table it changes
+TABLES = {
+    'locker.status': 'locker',
+    'locker.assign': 'locker',
+    'customer.activate': 'user',
+    'customer.deactivate': 'user',
+    'payment.status': 'payment',
+}
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _check(operation):
+    if not isinstance(operation, dict):
+        return 'Operation must be an object'
+    op = operation.get('op')
+    if op not in TABLES:
+        return 'op must be one of ' + ', '.join(TABLES)
+    ids = operation.get('ids')
+    if not isinstance(ids, list) or not ids or not all(_is_id(value) for value in ids):
+        return 'ids must be a non-empty list of integers'
+    if len(ids) > MAX_IDS:
+        return f'At most {MAX_IDS} ids per operation'
+    if op == 'locker.status' and operation.get('status') not in LOCKER_STATUSES:
+        return 'status must be one of ' + ', '.join(LOCKER_STATUSES)
+    if op == 'payment.status' and operation.get('status') not in PAYMENT_STATUSES:
+        return 'status must be one of ' + ', '.join(PAYMENT_STATUSES)
+    if op == 'locker.assign' and operation.get('user_id') is not None and not _is_id(operation['user_id']):
+        return 'user_id must be an integer or null'
+    return None
+
+def validate(operations):
+    """Return ``[{'index': ..., 'error': ...}]`` for every invalid operation."""
+    if not isinstance(operations, list) or not operations:
+        return [{'index': None, 'error': 'operations must be a non-empty list'}]
+    if len(operations) > MAX_OPERATIONS:
+        return [{'index': None, 'error': f'At most {MAX_OPERATIONS} operations per batch'}]
+    errors = []
+    for index, operation in enumerate(operations):
+        error = _check(operation)
+        if error:
+            errors.append({'index': index, 'error': error})
+    if errors:
+        return errors
+
+    assignees = {op['user_id'] for op in operations if op['op'] == 'locker.assign' and op.get('user_id') is not None}
+    if assignees:
+        known = set(db.session.scalars(select(User.id).where(User.id.in_(assignees))))
+        for index, operation in enumerate(operations):
+            if operation['op'] == 'locker.assign' and operation.get('user_id') not in known | {None}:
+                errors.append({'index': index, 'error': 'User not found'})
+    return errors
+
+def _chunks(ids):
+    for start in range(0, len(ids), CHUNK):
+        yield ids[start:start + CHUNK]
+
+def _current(connection, table, ids, *columns, where=()):
+    """Return ``{id: row}`` for the rows of ``ids`` that exist, locked for update."""
+    rows = {}
+    for chunk in _chunks(ids):
+        statement = select(table.c.id, *columns).where(table.c.id.in_(chunk), *where).with_for_update()
+        rows.update((row.id, row) for row in connection.execute(statement))
+    return rows
+
+def _update(connection, table, ids, **values):
+    """Set ``values`` on the rows of ``ids``."""
+    for chunk in _chunks(ids):
+        connection.execute(update(table).where(table.c.id.in_(chunk)).values(**values))
+
+def _partition(ids, rows, result, unchanged, skipped=lambda row: False):
+    """Sort ``ids`` into the result lists; return the ids to update."""
+    changing = []
+    for row_id in ids:
+        row = rows.get(row_id)
+        if row is None:
+            result['not_found'].append(row_id)
+        elif unchanged(row):
+            result['unchanged'].append(row_id)
+        elif skipped(row):
+            result['skipped'].append(row_id)
+        else:
+            changing.append(row_id)
+    result['updated'] = changing
+    return changing
+
+def _locker_event(session, row_id, number, status, assigned_user_name):
+    broker.queue_event(session, 'locker', {
+        'op': 'updated',
+        'id': row_id,
+        'number': number,
+        'status': status,
+        'assigned_user_name': assigned_user_name
+    })
+
+def _locker_status(session, connection, operation, ids, result, deltas):
+    locker = Locker.__table__
+    status = operation['status']
+    rows = _current(connection, locker, ids, locker.c.number, locker.c.status,
+                    locker.c.assigned_user_id, locker.c.assigned_user_name)
+    releasing = status == 'available'
+    changing = _partition(
+        ids, rows, result,
+        unchanged=lambda row: row.status == status and (not releasing or row.assigned_user_id is None),
+        skipped=lambda row: status == 'occupied' and row.assigned_user_id is None,
+    )
+    if not changing:
+        return
+    values = {'status': status, 'version': locker.c.version + 1}
+    if releasing:
+        values.update(assigned_user_id=None, assigned_user_name=None)
+    _update(connection, locker, changing, **values)
+    for row_id in changing:
+        row = rows[row_id]
+        deltas['active_lockers'] += (status == 'occupied') - (row.status == 'occupied')
+        _locker_event(session, row_id, row.number, status, None if releasing else row.assigned_user_name)
+
+def _locker_assign(session, connection, operation, ids, result, deltas):
+    locker = Locker.__table__
+    user_id = operation.get('user_id')
+    username = None
+    if user_id is not None:
+        username = connection.execute(select(User.username).where(User.id == user_id)).scalar()
+    status = 'available' if user_id is None else 'occupied'
+    rows = _current(connection, locker, ids, locker.c.number, locker.c.status, locker.c.assigned_user_id)
+    changing = _partition(
+        ids, rows, result,
+        unchanged=lambda row: row.assigned_user_id == user_id and row.status == status,
+        skipped=lambda row: row.status == 'maintenance',
+    )
+    if not changing:
+        return
+    _update(connection, locker, changing, status=status, assigned_user_id=user_id,
+            assigned_user_name=username, version=locker.c.version + 1)
+    for row_id in changing:
+        row = rows[row_id]
+        deltas['active_lockers'] += (status == 'occupied') - (row.status == 'occupied')
+        _locker_event(session, row_id, row.number, status, username)
+
+def _customer_active(session, connection, operation, ids, result, deltas):
+    user = User.__table__
+    active = operation['op'] == 'customer.activate'
+    rows = _current(connection, user, ids, user.c.username, user.c.active, where=[user.c.role == 'customer'])
+    changing = _partition(ids, rows, result, unchanged=lambda row: bool(row.active) == active)
+    if not changing:
+        return
+    # The user cache and the ORM's optimistic locking both key on the version.
+    _update(connection, user, changing, active=active, version=user.c.version + 1)
+    user_cache.queue_event(session, dict.fromkeys(changing))
+    for row_id in changing:
+        broker.queue_event(session, 'customer', {
+            'op': 'updated',
+            'id': row_id,
+            'username': rows[row_id].username,
+            'active': active
+        })
+
+def _payment_status(session, connection, operation, ids, result, deltas):
+    payment = Payment.__table__
+    status = operation['status']
+    rows = _current(connection, payment, ids, payment.c.user_id, payment.c.amount, payment.c.status,
+                    payment.c.created_at)
+    changing = _partition(ids, rows, result, unchanged=lambda row: row.status == status)
+    if not changing:
+        return
+    _update(connection, payment, changing, status=status)
+    rollups = None
+    for row_id in changing:
+        row = rows[row_id]
+        deltas['pending_payments'] += (status == 'pending') - (row.status == 'pending')
+        rollups = analytics.collect('payment', row._mapping, -1, rollups)
+        rollups = analytics.collect('payment', {**row._mapping, 'status': status}, 1, rollups)
+        broker.queue_event(session, 'payment', {
+            'op': 'updated',
+            'id': row_id,
+            'user_id': row.user_id,
+            'amount': float(row.amount),
+            'status': status
+        })
+    analytics.apply_deltas(connection, rollups)
+
+HANDLERS = {
+    'locker.status': _locker_status,
+    'locker.assign': _locker_assign,
+    'customer.activate': _customer_active,
+    'customer.deactivate': _customer_active,
+    'payment.status': _payment_status,
+}
+
+def apply(operations):
+    """Apply validated ``operations`` in the current transaction; return per-operation results."""
+    session = db.session
+    connection = session.connection()
+    table_versions.bump(connection, {TABLES[operation['op']] for operation in operations})
+    deltas = Counter()
+    results = []
+    for index, operation in enumerate(operations):
+        result = {'index': index, 'op': operation['op'], 'updated': [], 'unchanged': [], 'skipped': [], 'not_found': []}
+        ids = list(dict.fromkeys(operation['ids']))
+        HANDLERS[operation['op']](session, connection, operation, ids, result, deltas)
+        results.append(result)
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if deltas:
+        counters.apply_deltas(connection, deltas)
+        broker.queue_event(session, 'stats', deltas)
+    return results
+
+def changed_users(results):
+    """Ids of the users whose rows ``results`` changed."""
+    return {
+        user_id
+        for result in results if TABLES[result['op']] == 'user'
+        for user_id in result['updated']
+    }
@@ -0,0 +1,219 @@
+"""Concurrent locker-claim benchmark and double-booking check.
+
+Builds a throwaway database with ``--lockers`` available lockers and one
+customer per client, then lets ``--concurrency`` clients claim lockers until
+none are left, each on behalf of its own customer:
+
+* ``any``   -- ``POST /api/lockers/claim`` (the server picks a free locker)
+* ``first`` -- read the first listed available locker and its version from
+  ``GET /api/lockers?status=available&limit=1``, then
+  ``POST /api/lockers/<id>/claim`` with that version, retrying on 409
+
+Every mode must hand out each locker exactly once. The run fails if a
+locker was claimed twice, if a locker's assignee differs from the client that
+won it, or if the ``active_lockers`` counter disagrees with a recount:
+
+    python bench_claims.py --lockers 5000 --concurrency 50
+    python bench_claims.py --base-url http://127.0.0.1:8000 --database instance/bench.db
+
+Results are written as JSON like bench_endpoints.py's.
+"""
+import argparse
+from collections import Counter
+from datetime import datetime
+import http.cookiejar
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from bench_endpoints import ADMIN_PASSWORD, ADMIN_USERNAME, git_commit, percentile
+import scratch_db
+
+MODES = ('any', 'first')
+
+class TestClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.client.post('/login', data={'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD})
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        login = urllib.parse.urlencode({'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD}).encode()
+        self.opener.open(self.base_url + '/login', data=login).read()
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with self.opener.open(request) as response:
+                return response.status, json.loads(response.read() or 'null')
+        except urllib.error.HTTPError as error:
+            return error.code, json.loads(error.read() or 'null')
+
+def claim_any(client, user_id):
+    """Claim one locker; return ``(locker_id or None, attempts)``."""
+    status, body = client.request('POST', '/api/lockers/claim', {'user_id': user_id})
+    return (body['id'] if status == 200 else None), 1
+
+def claim_first(client, user_id):
+    attempts = 0
+    while True:
+        _, lockers = client.request('GET', '/api/lockers?status=available&limit=1')
+        if not lockers:
+            return None, attempts
+        attempts += 1
+        locker = lockers[0]
+        status, body = client.request('POST', f"/api/lockers/{locker['id']}/claim",
+                                      {'user_id': user_id, 'version': locker['version']})
+        if status == 200:
+            return body['id'], attempts
+
+def run(make_client, mode, user_ids):
+    claim = claim_any if mode == 'any' else claim_first
+    wins, latencies, attempts = [], [], []
+    lock = threading.Lock()
+
+    def worker(user_id):
+        client = make_client()
+        while True:
+            started = time.perf_counter()
+            locker_id, tries = claim(client, user_id)
+            elapsed = time.perf_counter() - started
+            with lock:
+                attempts.append(tries)
+                if locker_id is None:
+                    return
+                wins.append((locker_id, user_id))
+                latencies.append(elapsed * 1000)
+
+    threads = [threading.Thread(target=worker, args=(user_id,)) for user_id in user_ids]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return wins, {
+        'claims': len(wins),
+        'clients': len(user_ids),
+        'claims_per_second': round(len(wins) / wall, 1) if wall else None,
+        'p50_ms': round(percentile(latencies, 0.50), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99), 2) if latencies else None,
+        'lost_races': sum(attempts) - len(attempts),
+    }
+
+def verify(db, wins):
+    """Return a list of problems with the claims in ``wins``; empty when consistent."""
+    import counters
+    from models import Locker
+
+    problems = []
+    for locker_id, count in Counter(locker_id for locker_id, _ in wins).items():
+        if count > 1:
+            problems.append(f'locker {locker_id} was claimed {count} times')
+    assigned = dict(db.session.execute(
+        db.select(Locker.id, Locker.assigned_user_id).where(Locker.status == 'occupied')).all())
+    for locker_id, user_id in wins:
+        if assigned.get(locker_id) != user_id:
+            problems.append(f'locker {locker_id} won by user {user_id} is assigned to {assigned.get(locker_id)}')
+    if len(assigned) != len(wins):
+        problems.append(f'{len(assigned)} lockers are occupied but {len(wins)} claims succeeded')
+    stored = counters.snapshot()['active_lockers']
+    recount = counters.rebuild()['active_lockers']
+    if stored != recount:
+        problems.append(f'active_lockers counter was {stored}, recount {recount}')
+    return problems
+
+def reset(db, clients):
+    """Free every locker; return the ids of ``clients`` customers, creating any missing."""
+    import counters
+    import seed
+    import table_versions
+    from models import Locker, User
+
+    db.session.execute(db.update(Locker).values(status='available', assigned_user_id=None,
+                                                assigned_user_name=None))
+    table_versions.bump(db.session.connection(), ['locker'])
+    db.session.commit()
+    counters.rebuild()
+    missing = clients - db.session.scalar(db.select(db.func.count(User.id)).where(User.role == 'customer'))
+    if missing > 0:
+        seed.generate(users=missing, lockers=0, reservations=0, payments=0)
+    return db.session.scalars(db.select(User.id).where(User.role == 'customer')
+                              .order_by(User.id).limit(clients)).all()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lockers', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=50, help='concurrent clients')
+    parser.add_argument('--modes', default=','.join(MODES), help='comma-separated modes to run')
+    parser.add_argument('--base-url', help='drive a running server instead of the test client')
+    parser.add_argument('--database', help='reuse this SQLite file instead of building a new one')
+    parser.add_argument('--output', default='bench_claims.json')
+    args = parser.parse_args(argv)
+
+    workdir = scratch_db.use('claim-bench-', args.database)
+    # Every client needs enough connections to keep all of them in flight.
+    os.environ.setdefault('DB_POOL_SIZE', str(args.concurrency))
+
+    from models import db, Locker
+    import seed
+
+    app, _ = scratch_db.build(ADMIN_USERNAME, ADMIN_PASSWORD, {'EXPIRY_SCHEDULER': 'off'})
+    with app.app_context():
+        # A reused database may have fewer lockers than asked for.
+        missing = args.lockers - db.session.scalar(db.select(db.func.count(Locker.id)))
+        if missing > 0:
+            seed.generate(users=0, lockers=missing, reservations=0, payments=0)
+
+    if args.base_url:
+        make_client = lambda: HttpClient(args.base_url)
+    else:
+        make_client = lambda: TestClient(app)
+
+    results, failed = {}, False
+    for mode in args.modes.split(','):
+        with app.app_context():
+            user_ids = reset(db, args.concurrency)
+        wins, stats = run(make_client, mode, user_ids)
+        with app.app_context():
+            problems = verify(db, wins)
+        stats['double_bookings'] = len(problems)
+        results[mode] = stats
+        print(f"{mode:6} {stats['claims']:>6} claims  {stats['claims_per_second']:>8} claims/s  "
+              f"p50 {stats['p50_ms']} ms  p99 {stats['p99_ms']} ms  lost races {stats['lost_races']}  "
+              f"problems {len(problems)}", file=sys.stderr)
+        for problem in problems[:20]:
+            print('  ' + problem, file=sys.stderr)
+        failed = failed or bool(problems)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+        'target': args.base_url or 'test-client',
+        'lockers': args.lockers,
+        'concurrency': args.concurrency,
+        'modes': results,
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+
+    scratch_db.remove(app, workdir)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""Concurrent read/write throughput of the database engine layer.
+
+Runs writer threads that insert payments and commit one at a time, and reader
+threads that run the /api/payments list query through the read session, for a
+fixed time against a throwaway SQLite file. Compare journal modes to see what
+WAL and the busy timeout buy:
+
+    python bench_db.py --journal-mode DELETE --busy-timeout 0.1
+    python bench_db.py --journal-mode WAL
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--journal-mode', default='WAL')
+    parser.add_argument('--busy-timeout', type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='db-bench-')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    os.environ['SQLITE_JOURNAL_MODE'] = args.journal_mode
+    os.environ['DB_BUSY_TIMEOUT'] = str(args.busy_timeout)
+
+    from app import create_app
+    from database import reads
+    from models import db, Payment
+    import counters
+
+    app = create_app()
+
+    with app.app_context():
+        db.create_all()
+        counters.rebuild()
+
+    results = {'writes': 0, 'reads': 0, 'write_errors': 0, 'read_errors': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.seconds
+
+    def record(key):
+        with lock:
+            results[key] += 1
+
+    def writer():
+        while time.monotonic() < deadline:
+            with app.app_context():
+                try:
+                    db.session.add(Payment(user_id=1, amount=10.0))
+                    db.session.commit()
+                    record('writes')
+                except Exception:
+                    db.session.rollback()
+                    record('write_errors')
+
+    def reader():
+        while time.monotonic() < deadline:
+            with app.app_context():
+                try:
+                    reads.query(Payment).filter_by(status='pending').order_by(Payment.id.desc()).limit(100).all()
+                    record('reads')
+                except Exception:
+                    record('read_errors')
+
+    threads = [threading.Thread(target=writer) for _ in range(args.writers)]
+    threads += [threading.Thread(target=reader) for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        db.engine.dispose()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    results.update({
+        'journal_mode': args.journal_mode,
+        'busy_timeout': args.busy_timeout,
+        'writers': args.writers,
+        'readers': args.readers,
+        'seconds': args.seconds,
+        'writes_per_second': round(results['writes'] / args.seconds, 1),
+        'reads_per_second': round(results['reads'] / args.seconds, 1),
+    })
+    print(json.dumps(results, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
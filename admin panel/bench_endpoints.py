@@ -0,0 +1,253 @@
+"""Load test and latency benchmark for every /api route and /login.
+
+Builds a throwaway database at the requested scale with bulk inserts, then
+drives each route from concurrent worker threads and reports p50/p95/p99
+latency, throughput and SQL statements per request. Results are written as
+JSON (tagged with the current git commit) so runs can be diffed:
+
+    python bench_endpoints.py --users 100000 --payments 1000000 --output before.json
+
+By default requests go through the Flask test client in this process, which
+also lets the harness count SQL statements. With ``--base-url`` it drives a
+running server over HTTP instead (it must use the same database, and SQL
+counts are not available).
+"""
+import argparse
+from datetime import datetime, timedelta
+import http.cookiejar
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import scratch_db
+
+ADMIN_USERNAME = 'bench_admin'
+ADMIN_PASSWORD = 'bench-password'
+
+def routes(scale):
+    """Return ``{name: factory}``; each factory returns ``(method, path, kwargs)``."""
+    users, lockers = scale['users'], scale['lockers']
+    day = lambda rng: (datetime.utcnow() - timedelta(days=rng.randint(1, 300))).strftime('%Y-%m-%d')
+
+    def window(rng):
+        start = datetime.utcnow() + timedelta(days=400 + rng.randint(0, 3000), hours=rng.randint(0, 23))
+        return start, start + timedelta(hours=rng.randint(1, 6))
+
+    def reservation_body(rng):
+        start, end = window(rng)
+        return {'json': {'locker_id': rng.randint(1, lockers), 'start_time': start.isoformat(),
+                         'end_time': end.isoformat()}}
+
+    return {
+        'GET /api/stats': lambda rng: ('GET', '/api/stats', {}),
+        'GET /api/users': lambda rng: ('GET', f'/api/users?after_id={rng.randint(0, users)}', {}),
+        'GET /api/users/<id>': lambda rng: ('GET', f'/api/users/{rng.randint(1, users)}', {}),
+        'GET /api/customers': lambda rng: ('GET', f'/api/customers?status=active&after_id={rng.randint(0, users)}', {}),
+        'GET /api/lockers': lambda rng: ('GET', '/api/lockers?status=available', {}),
+        'GET /api/lockers/available': lambda rng: ('GET', '/api/lockers/available?start={}&end={}'.format(
+            *(t.isoformat() for t in window(rng))), {}),
+        'GET /api/reservations': lambda rng: ('GET', f'/api/reservations?locker_id={rng.randint(1, lockers)}', {}),
+        'GET /api/payments': lambda rng: ('GET', f'/api/payments?status=pending&user_id={rng.randint(2, users)}', {}),
+        'GET /api/payments?date': lambda rng: ('GET', f'/api/payments?date_from={day(rng)}&limit=100', {}),
+        'GET /api/search': lambda rng: ('GET', '/api/search?q={}&limit=20'.format(
+            rng.choice(['ahm', 'maria sch', 'yilmaz', 'L000', str(rng.randint(1, 9999))])), {}),
+        'GET /api/analytics': lambda rng: ('GET', '/api/analytics?range={}'.format(
+            rng.choice(['24h&bucket=hour', '7d&bucket=day', '365d&bucket=day'])), {}),
+        'GET /api/notifications': lambda rng: ('GET', '/api/notifications?limit=50', {}),
+        'GET /api/export/payments': lambda rng: ('GET', f'/api/export/payments?date_from={day(rng)}&date_to={day(rng)}', {}),
+        'GET /api/system/stats': lambda rng: ('GET', '/api/system/stats', {}),
+        'POST /api/reservations': lambda rng: ('POST', '/api/reservations', reservation_body(rng)),
+        'POST /api/customers': lambda rng: ('POST', '/api/customers', {'json': {
+            'username': f'bench{rng.getrandbits(48)}', 'email': f'bench{rng.getrandbits(48)}@example.com',
+            'password': 'pw'}}),
+        'POST /api/batch': lambda rng: ('POST', '/api/batch', {'json': {'operations': [
+            {'op': 'payment.status', 'ids': rng.sample(range(1, scale['payments'] + 1), min(100, scale['payments'])),
+             'status': rng.choice(['pending', 'completed'])}]}}),
+        'POST /login': lambda rng: ('POST', '/login', {'data': {
+            'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD}}),
+    }
+
+class TestClientDriver:
+    def __init__(self, app, accept_encoding):
+        self.client = app.test_client()
+        self.client.environ_base['HTTP_ACCEPT_ENCODING'] = accept_encoding
+        self.client.post('/login', data={'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD})
+
+    def request(self, method, path, kwargs):
+        response = self.client.open(path, method=method, **kwargs)
+        body = response.get_data()
+        return response.status_code, len(body)
+
+class HttpDriver:
+    def __init__(self, base_url, accept_encoding):
+        self.base_url = base_url.rstrip('/')
+        self.accept_encoding = accept_encoding
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.request('POST', '/login', {'data': {'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD}})
+
+    def request(self, method, path, kwargs):
+        headers = {'Accept-Encoding': self.accept_encoding}
+        data = None
+        if 'json' in kwargs:
+            data = json.dumps(kwargs['json']).encode()
+            headers['Content-Type'] = 'application/json'
+        elif 'data' in kwargs:
+            data = urllib.parse.urlencode(kwargs['data']).encode()
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(request) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as error:
+            return error.code, len(error.read())
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def run_route(make_driver, factory, requests, concurrency, sql_counter, seed):
+    latencies, statements, statuses, sizes = [], [], {}, []
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker(worker_id):
+        rng = random.Random(seed + worker_id)
+        driver = make_driver()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            method, path, kwargs = factory(rng)
+            sql_counter.reset()
+            started = time.perf_counter()
+            status, size = driver.request(method, path, kwargs)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed * 1000)
+                statements.append(sql_counter.value())
+                sizes.append(size)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    counted = [count for count in statements if count is not None]
+    return {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else None,
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'max_ms': round(latencies[-1], 2),
+        'sql_per_request': round(sum(counted) / len(counted), 2) if counted else None,
+        'avg_response_bytes': round(sum(sizes) / len(sizes)) if sizes else 0,
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+class SqlCounter:
+    """Counts statements executed by the current thread since ``reset``."""
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self._local = threading.local()
+
+    def reset(self):
+        self._local.count = 0
+
+    def value(self):
+        return self._local.count if self.enabled else None
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--lockers', type=int, default=2000)
+    parser.add_argument('--reservations', type=int, default=100000)
+    parser.add_argument('--payments', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--routes', help='comma-separated route names to run (default: all)')
+    parser.add_argument('--base-url', help='drive a running server instead of the test client')
+    parser.add_argument('--database', help='reuse this SQLite file instead of building a new one')
+    parser.add_argument('--accept-encoding', default='gzip, br',
+                        help="Accept-Encoding sent with every request ('identity' disables compression)")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    scale = {'users': args.users, 'lockers': args.lockers,
+             'reservations': args.reservations, 'payments': args.payments}
+    workdir = scratch_db.use('endpoint-bench-', args.database)
+
+    from sqlalchemy import event
+    from models import db
+
+    started = time.perf_counter()
+    app, seeded = scratch_db.build(ADMIN_USERNAME, ADMIN_PASSWORD, seed=args.seed, **scale)
+    if seeded:
+        print(f'built database in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    with app.app_context():
+        engines = {db.engine, app.extensions['read_engine']}
+
+    sql_counter = SqlCounter(enabled=not args.base_url)
+    if sql_counter.enabled:
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', sql_counter)
+        make_driver = lambda: TestClientDriver(app, args.accept_encoding)
+    else:
+        make_driver = lambda: HttpDriver(args.base_url, args.accept_encoding)
+
+    selected = routes(scale)
+    if args.routes:
+        wanted = {name.strip() for name in args.routes.split(',')}
+        selected = {name: factory for name, factory in selected.items() if name in wanted}
+
+    results = {}
+    for name, factory in selected.items():
+        results[name] = run_route(make_driver, factory, args.requests, args.concurrency, sql_counter, args.seed)
+        stats = results[name]
+        print(f"{name:32} {stats['throughput_rps']:>8} req/s  p50 {stats['p50_ms']:>8} ms  "
+              f"p95 {stats['p95_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms  sql {stats['sql_per_request']}",
+              file=sys.stderr)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+        'target': args.base_url or 'test-client',
+        'accept_encoding': args.accept_encoding,
+        'scale': scale,
+        'routes': results,
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+
+    scratch_db.remove(app, workdir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
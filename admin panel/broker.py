@@ -0,0 +1,343 @@
+"""Fan-out of committed changes to /api/stream subscribers.
+
+Session hooks record locker, reservation, payment and customer changes plus
+the stats counter deltas during each flush and publish them only once the
+transaction commits. Published events go into one bounded ring buffer
+guarded by a condition variable: a publish is a single append plus
+``notify_all``, and an idle subscriber is just a thread parked on the
+condition, so one writer can serve thousands of open dashboards. Subscribers
+resume from ``Last-Event-ID`` as long as the id is still in the buffer;
+otherwise they receive a ``reset`` event and should reload.
+
+With ``BROKER_RELAY`` on (serve.py turns it on), the events of every
+transaction are instead inserted into ``broker_event`` in that transaction,
+and each process runs an ``EventRelay`` thread that tails the table every
+``RELAY_INTERVAL`` (or right after a local commit) and delivers its events,
+its own included, in id order with the ``broker_event`` id as the event id.
+Every worker therefore numbers events the same way and a client can resume
+on any of them; a dashboard sees changes made through any worker and by the
+expiry scheduler. The listeners (the notification writer) still run at
+commit in the process that made the change. A skipped id holds delivery back
+for up to ``GAP_SECONDS``, in case its transaction commits after a later
+one; the table is trimmed to the last ``RELAY_KEEP`` events.
+"""
+from collections import deque
+import json
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import delete, event, func, insert, inspect, select
+
+from models import db, BrokerEvent, User, Locker, Reservation, Payment
+import counters
+from threads import PerProcessThread
+
+HISTORY_SIZE = 1000
+HEARTBEAT_SECONDS = 15.0
+RETRY_MILLISECONDS = 1000
+RELAY_INTERVAL = 0.25
+RELAY_BATCH = 1000
+RELAY_KEEP = 10000
+GAP_SECONDS = 5.0
+
+class EventBroker:
+    def __init__(self, history=HISTORY_SIZE):
+        self._events = deque(maxlen=history)
+        # Millisecond start keeps ids increasing across restarts, so a client
+        # resuming with an id from a previous run always gets a reset.
+        self._last_id = time.time_ns() // 1_000_000 - 1
+        # Events up to this id are no longer (or were never) in the buffer.
+        self._forgotten = self._last_id
+        self._condition = threading.Condition()
+        self._listeners = []
+        self._closed = False
+
+    def add_listener(self, callback):
+        """Call ``callback(name, data)`` synchronously for every published event."""
+        self._listeners.append(callback)
+
+    def publish(self, name, data):
+        event_id = self.deliver(name, data)
+        self.notify_listeners(name, data)
+        return event_id
+
+    def notify_listeners(self, name, data):
+        for callback in self._listeners:
+            callback(name, data)
+
+    def deliver(self, name, data, event_id=None):
+        """Hand an event to this process's subscribers without calling the listeners.
+
+        ``event_id`` defaults to the next local id; given ids must increase.
+        """
+        with self._condition:
+            if event_id is None:
+                event_id = self._last_id + 1
+            if len(self._events) == self._events.maxlen:
+                self._forgotten = self._events[0][0]
+            self._last_id = event_id
+            self._events.append((event_id, name, data))
+            self._condition.notify_all()
+        return event_id
+
+    def restart(self, last_id):
+        """Drop the buffered events and continue after ``last_id``."""
+        with self._condition:
+            self._events.clear()
+            self._last_id = self._forgotten = last_id
+            self._condition.notify_all()
+
+    def close(self):
+        """End every subscription, e.g. before a graceful shutdown."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _since(self, last_id):
+        """Return ``(events, gap)`` for everything published after ``last_id``.
+
+        Must be called with the condition held.
+        """
+        if last_id >= self._last_id:
+            return [], last_id > self._last_id
+        if last_id < self._forgotten:
+            return [], True
+        events = []
+        for item in reversed(self._events):
+            if item[0] <= last_id:
+                break
+            events.append(item)
+        events.reverse()
+        return events, False
+
+    def subscribe(self, last_id=None, heartbeat=HEARTBEAT_SECONDS):
+        """Yield ``(id, name, data)`` tuples until closed, ``None`` on idle heartbeats."""
+        with self._condition:
+            if last_id is None:
+                last_id = self._last_id
+        while True:
+            with self._condition:
+                events, gap = self._since(last_id)
+                if not events and not gap:
+                    if self._closed:
+                        return
+                    self._condition.wait(heartbeat)
+                    events, gap = self._since(last_id)
+                if gap:
+                    last_id = self._last_id
+            if gap:
+                yield last_id, 'reset', {}
+            elif not events:
+                yield None
+            for item in events:
+                last_id = item[0]
+                yield item
+
+broker = EventBroker()
+
+def record(connection, events):
+    """Insert ``[(name, data)]`` into ``broker_event`` inside the caller's transaction."""
+    connection.execute(insert(BrokerEvent), [
+        {'name': name, 'data': json.dumps(data)} for name, data in events
+    ])
+
+class EventRelay:
+    """Tails ``broker_event`` and delivers its events to this process's subscribers."""
+    def __init__(self, interval=RELAY_INTERVAL):
+        self.enabled = False
+        self.interval = interval
+        self._thread = PerProcessThread()
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+        self._gap_since = None
+        self._listeners = []
+        self.relayed = 0
+        self.errors = 0
+
+    def start(self, app):
+        """Run the relay on a background thread of this process."""
+        def thread():
+            with app.app_context():
+                engine = db.engine
+            with engine.connect() as connection:
+                # Earlier events predate every subscriber of this process.
+                last_id = connection.execute(select(func.max(BrokerEvent.id))).scalar() or 0
+            broker.restart(last_id)
+            self._stopping = threading.Event()
+            return threading.Thread(target=self._run, args=(app, engine, last_id),
+                                    name='event-relay', daemon=True)
+        self._thread.start(thread)
+
+    def add_listener(self, callback):
+        """Call ``callback(name, data)`` for every event relayed in this process."""
+        self._listeners.append(callback)
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def wake(self):
+        """Poll now instead of after the interval, e.g. after a local commit."""
+        self._wake.set()
+
+    def _run(self, app, engine, last_id):
+        table = BrokerEvent.__table__
+        pruned = last_id
+        while not self._stopping.is_set():
+            self._wake.clear()
+            try:
+                with engine.begin() as connection:
+                    last_id = self._poll(connection, last_id)
+                    if last_id - pruned >= RELAY_KEEP // 10:
+                        connection.execute(delete(table).where(table.c.id <= last_id - RELAY_KEEP))
+                        pruned = last_id
+            except Exception:
+                self.errors += 1
+                app.logger.exception('event relay failed; retrying')
+            self._wake.wait(self.interval)
+
+    def _poll(self, connection, last_id):
+        table = BrokerEvent.__table__
+        rows = connection.execute(
+            select(table.c.id, table.c.name, table.c.data)
+            .where(table.c.id > last_id).order_by(table.c.id).limit(RELAY_BATCH)
+        ).all()
+        for row in rows:
+            if row.id > last_id + 1:
+                # The missing ids may belong to transactions that have not
+                # committed yet; give them GAP_SECONDS to show up.
+                now = time.monotonic()
+                if self._gap_since is None:
+                    self._gap_since = now
+                if now - self._gap_since < GAP_SECONDS:
+                    break
+            self._gap_since = None
+            data = json.loads(row.data)
+            broker.deliver(row.name, data, row.id)
+            for callback in self._listeners:
+                callback(row.name, data)
+            self.relayed += 1
+            last_id = row.id
+        return last_id
+
+    def stats(self):
+        return {
+            'running': self._thread.running,
+            'relayed': self.relayed,
+            'errors': self.errors,
+        }
+
+relay = EventRelay()
+
+def format_sse(item):
+    if item is None:
+        return ': keep-alive\n\n'
+    event_id, name, data = item
+    return f'id: {event_id}\nevent: {name}\ndata: {json.dumps(data)}\n\n'
+
+def stream(last_id=None):
+    """Yield the text/event-stream body for one subscriber."""
+    # Send something right away so proxies and the browser see an open stream.
+    yield f'retry: {RETRY_MILLISECONDS}\n\n'
+    for item in broker.subscribe(last_id):
+        yield format_sse(item)
+
+def parse_last_event_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def queue_event(session, name, data):
+    """Publish ``name`` when ``session`` commits; dropped on rollback."""
+    session.info.setdefault('pending_events', []).append((name, data))
+
+def _op(obj, session):
+    if obj in session.new:
+        return 'created'
+    if obj in session.deleted:
+        return 'deleted'
+    return 'updated'
+
+def _changed(obj, *keys):
+    state = inspect(obj)
+    return any(state.attrs[key].history.has_changes() for key in keys)
+
+def _after_flush(session, flush_context):
+    for obj in session.new | session.dirty | session.deleted:
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        op = _op(obj, session)
+        if isinstance(obj, Locker):
+            queue_event(session, 'locker', {
+                'op': op,
+                'id': obj.id,
+                'number': obj.number,
+                'status': obj.status,
+                'assigned_user_name': obj.assigned_user_name
+            })
+        elif isinstance(obj, Reservation):
+            queue_event(session, 'reservation', {
+                'op': op,
+                'id': obj.id,
+                'user_id': obj.user_id,
+                'locker_id': obj.locker_id,
+                'status': obj.status
+            })
+        elif isinstance(obj, Payment) and (op != 'updated' or _changed(obj, 'status')):
+            queue_event(session, 'payment', {
+                'op': op,
+                'id': obj.id,
+                'user_id': obj.user_id,
+                'amount': float(obj.amount),
+                'status': obj.status
+            })
+        elif isinstance(obj, User) and obj.role == 'customer' and (
+                op != 'updated' or _changed(obj, 'username', 'email', 'active', 'role')):
+            queue_event(session, 'customer', {
+                'op': op,
+                'id': obj.id,
+                'username': obj.username,
+                'active': obj.active
+            })
+    deltas = counters.collect_deltas(session)
+    if deltas:
+        queue_event(session, 'stats', deltas)
+
+def _before_commit(session):
+    if not relay.enabled:
+        return
+    # The final flush queues events of its own; run it now to record them.
+    session.flush()
+    events = session.info.get('pending_events')
+    if events:
+        record(session.connection(), events)
+
+def _after_commit(session):
+    events = session.info.pop('pending_events', ())
+    if relay.enabled:
+        # Subscribers get the events from broker_event, with its ids.
+        for name, data in events:
+            broker.notify_listeners(name, data)
+        if events:
+            relay.wake()
+        return
+    for name, data in events:
+        broker.publish(name, data)
+
+def _after_rollback(session):
+    session.info.pop('pending_events', None)
+
+def _start_relay():
+    relay.start(current_app._get_current_object())
+
+def init_app(app):
+    relay.enabled = app.config.get('BROKER_RELAY', False)
+    if relay.enabled:
+        app.before_request(_start_relay)
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+        event.listen(db.session, 'before_commit', _before_commit)
+        event.listen(db.session, 'after_commit', _after_commit)
+        event.listen(db.session, 'after_rollback', _after_rollback)
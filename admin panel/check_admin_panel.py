@@ -0,0 +1,191 @@
+"""Headless responsiveness check for the PyQt dashboard in admin_panel.py.
+
+Seeds a throwaway database with ``--lockers`` lockers, serves it with
+serve.py, and drives ``AdminPanel`` against it on Qt's offscreen platform:
+
+1. load every locker, timing it;
+2. put ``--changes`` lockers into maintenance through /api/batch and wait for
+   the next refresh to apply them as an incremental diff (no rows inserted
+   or removed);
+3. let one more refresh go by with nothing changed, which must not touch the
+   model at all.
+
+Throughout, a 5 ms heartbeat timer on the GUI thread records the longest
+stall of the event loop. The run fails if any phase times out, the model
+disagrees with the server, or the stall exceeds ``--max-stall-ms``:
+
+    python check_admin_panel.py --lockers 10000
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import scratch_db
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+ADMIN_USERNAME = 'panel_admin'
+ADMIN_PASSWORD = 'panel-check'
+HEARTBEAT_MS = 5
+PHASE_TIMEOUT = 120
+
+def build_database(lockers):
+    """Seed the scratch database; return the app and the ids of the available lockers."""
+    from models import db, Locker
+
+    app, _ = scratch_db.build(ADMIN_USERNAME, ADMIN_PASSWORD, {'EXPIRY_SCHEDULER': 'off'},
+                              users=200, lockers=lockers, reservations=lockers, payments=0, seed=7)
+    with app.app_context():
+        ids = db.session.scalars(db.select(Locker.id).where(Locker.status == 'available')).all()
+    return app, ids
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_server(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('serve.py exited early')
+        try:
+            urllib.request.urlopen(url + '/login', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('serve.py did not start')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lockers', type=int, default=10000)
+    parser.add_argument('--changes', type=int, default=500, help='lockers changed between refreshes')
+    parser.add_argument('--interval', type=int, default=1000, help='panel refresh interval in ms')
+    parser.add_argument('--max-stall-ms', type=float, default=100.0)
+    args = parser.parse_args(argv)
+
+    workdir = scratch_db.use('panel-check-')
+    app = server = None
+    try:
+        app, available = build_database(args.lockers)
+        changed_ids = available[:args.changes]
+
+        port = free_port()
+        url = f'http://127.0.0.1:{port}'
+        server = subprocess.Popen(
+            [sys.executable, 'serve.py', '--bind', f'127.0.0.1:{port}', '--workers', '2', '--no-expiry'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for_server(url, server)
+        return run_panel(url, args, changed_ids)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(30)
+        scratch_db.remove(app, workdir)
+
+def run_panel(url, args, changed_ids):
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QElapsedTimer, QTimer
+    from admin_panel import AdminPanel, ApiClient
+
+    app = QApplication(sys.argv[:1])
+    panel = AdminPanel(ApiClient(url), args.interval)
+    panel.show()
+
+    clock = QElapsedTimer()
+    clock.start()
+    stall = {'last': 0, 'max': 0.0}
+
+    def heartbeat():
+        now = clock.elapsed()
+        stall['max'] = max(stall['max'], now - stall['last'] - HEARTBEAT_MS)
+        stall['last'] = now
+
+    beat = QTimer()
+    beat.timeout.connect(heartbeat)
+    beat.start(HEARTBEAT_MS)
+
+    results = {'lockers': args.lockers, 'changes': len(changed_ids)}
+    failures = []
+    applied = []
+    original_apply = panel.lockers.apply
+
+    def counting_apply(records):
+        diff = original_apply(records)
+        applied.append(diff)
+        return diff
+    panel.lockers.apply = counting_apply
+
+    def change_lockers():
+        client = ApiClient(url)
+        client.login(ADMIN_USERNAME, ADMIN_PASSWORD)
+        body = json.dumps({'operations': [
+            {'op': 'locker.status', 'ids': changed_ids, 'status': 'maintenance'}]}).encode()
+        request = urllib.request.Request(url + '/api/batch', data=body, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        client.opener.open(request).read()
+
+    def changes_shown():
+        statuses = {row['id']: row['status'] for row in panel.lockers.rows}
+        return all(statuses[locker_id] == 'maintenance' for locker_id in changed_ids)
+
+    phases = [
+        ('load', lambda: panel.lockers.rowCount() == args.lockers, None),
+        ('diff', lambda: len(applied) > 1 and changes_shown(),
+         lambda: threading.Thread(target=change_lockers, daemon=True).start()),
+        ('idle', lambda: clock.elapsed() - phase['started'] > 2.5 * args.interval, None),
+    ]
+    phase = {'index': -1, 'started': 0}
+
+    def next_phase():
+        phase['index'] += 1
+        phase['started'] = clock.elapsed()
+        phase['applied'] = len(applied)
+        if phase['index'] == len(phases):
+            app.quit()
+            return
+        action = phases[phase['index']][2]
+        if action:
+            action()
+
+    def poll():
+        name, done, _ = phases[phase['index']]
+        elapsed = clock.elapsed() - phase['started']
+        if done():
+            results[f'{name}_ms'] = elapsed
+            if name == 'diff':
+                results['diff'] = dict(zip(('removed', 'changed', 'added'), applied[-1]))
+                if applied[-1] != (0, len(changed_ids), 0):
+                    failures.append(f'expected a diff of {len(changed_ids)} changed rows, got {applied[-1]}')
+            if name == 'idle' and len(applied) != phase['applied']:
+                failures.append('an unchanged refresh touched the model')
+            next_phase()
+        elif elapsed > PHASE_TIMEOUT * 1000:
+            failures.append(f'{name} timed out; status: {panel.status.text()}')
+            app.quit()
+
+    watcher = QTimer()
+    watcher.timeout.connect(poll)
+    panel.login(ADMIN_USERNAME, ADMIN_PASSWORD)
+    next_phase()
+    watcher.start(20)
+    app.exec_()
+
+    panel.close()
+    results['max_stall_ms'] = round(stall['max'], 1)
+    results['timers'] = len(panel.findChildren(QTimer))
+    if stall['max'] > args.max_stall_ms:
+        failures.append(f"event loop stalled for {stall['max']:.0f} ms")
+    results['failures'] = failures
+    print(json.dumps(results, indent=2))
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""Query-plan regression check for the API endpoints.
+
+Seeds a throwaway SQLite database, calls each endpoint through the Flask test
+client, runs ``EXPLAIN QUERY PLAN`` on every SELECT the request issued against
+the case's table and fails if that table is not read through the expected
+index. Exits non-zero on any regression so it can gate CI:
+
+    python check_query_plans.py --rows 50000
+"""
+import argparse
+import sys
+from datetime import datetime
+
+import scratch_db
+
+# (endpoint, table, index the plan must use, or a tuple of equally good ones)
+CASES = [
+    ('/api/lockers?status=available', 'locker', 'ix_locker_status_id'),
+    ('/api/lockers?user_id=7', 'locker', 'ix_locker_assigned_user_id'),
+    ('/api/customers', 'user', 'ix_user_role_id'),
+    ('/api/users?role=admin', 'user', 'ix_user_role_id'),
+    # Both locker indexes lead with locker_id, and SQLite picks either.
+    ('/api/reservations?locker_id=3', 'reservation', ('ix_reservation_locker_start', 'ix_reservation_locker_end')),
+    ('/api/reservations?user_id=7', 'reservation', 'ix_reservation_user_id'),
+    ('/api/reservations?status=pending', 'reservation', 'ix_reservation_status_id'),
+    ('/api/reservations?date_from=2024-03-01&date_to=2024-03-02', 'reservation', 'ix_reservation_start_time'),
+    ('/api/lockers/available?start=2024-03-01T10:00&end=2024-03-01T12:00', 'reservation', 'ix_reservation_locker_end'),
+    ('/api/payments?status=pending', 'payment', 'ix_payment_status_id'),
+    ('/api/payments?user_id=7', 'payment', 'ix_payment_user_id'),
+    ('/api/payments?date_from=2024-03-01&date_to=2024-03-02', 'payment', 'ix_payment_created_at'),
+    ('/api/payments?after_id=1000', 'payment', 'INTEGER PRIMARY KEY'),
+    ('/api/notifications?since=1000', 'event_log', 'INTEGER PRIMARY KEY'),
+    ('/api/analytics?range=30d&bucket=day', 'analytics_rollup', 'sqlite_autoindex_analytics_rollup_1'),
+]
+
+ADMIN_USERNAME = 'plan_admin'
+ADMIN_PASSWORD = 'plan-check'
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000,
+                        help='payments and reservations to seed (default: 50000)')
+    args = parser.parse_args(argv)
+
+    workdir = scratch_db.use('plan-check-')
+
+    from sqlalchemy import event
+    from models import db
+
+    # ``rows`` payments and reservations over rows // 10 users and lockers. The
+    # expiry scheduler's own queries would land among the captured ones.
+    people = max(args.rows // 10, 20)
+    app, _ = scratch_db.build(ADMIN_USERNAME, ADMIN_PASSWORD, {'EXPIRY_SCHEDULER': 'off'},
+                              users=people, lockers=people, reservations=args.rows, payments=args.rows,
+                              now=datetime(2024, 6, 1), seed=42)
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    with app.app_context():
+        for engine in {db.engine, app.extensions['read_engine']}:
+            event.listen(engine, 'before_cursor_execute', capture)
+
+        client = app.test_client()
+        client.post('/login', data={'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD})
+
+        failures = 0
+        for url, table, indexes in CASES:
+            if isinstance(indexes, str):
+                indexes = (indexes,)
+            statements.clear()
+            response = client.get(url)
+            plans = []
+            with db.engine.connect() as connection:
+                for statement, parameters in statements:
+                    if f'FROM {table}' not in statement and f'FROM "{table}"' not in statement:
+                        continue
+                    rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)
+                    plans.extend(row[-1] for row in rows)
+            ok = response.status_code == 200 and plans and all(
+                any(index in detail for index in indexes)
+                for detail in plans if detail.split()[1:2] == [table]
+            )
+            print(f"{'ok  ' if ok else 'FAIL'} {url}")
+            for detail in plans:
+                print(f'       {detail}')
+            failures += not ok
+    scratch_db.remove(app, workdir)
+
+    print(f'{len(CASES) - failures}/{len(CASES)} endpoint queries use their index')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Atomic locker claims and releases with optimistic versioning.
+
+A claim is one conditional ``UPDATE locker ... WHERE status = 'available'``
+(plus ``AND version = :version`` when the caller read the locker first)
+with ``RETURNING``. The database decides which of several concurrent
+claimants wins, without a read-modify-write in Python and without an
+application lock. Every change increments ``Locker.version``: the ORM does it
+through ``version_id_col``, and Core writers (the expiry scheduler, /api/batch
+and this module) do it in their ``UPDATE``. A client holding a stale version
+gets ``None`` and can re-read the locker and retry. A locker with a pending
+or active reservation in progress belongs to that reservation and cannot be
+claimed; in turn availability.py treats claimed lockers as unavailable.
+
+``claim_any`` hands out any free locker. It starts at a random id and takes
+the first available locker at or after it, wrapping around to the lowest. A
+single indexed seek on ``ix_locker_status_id`` spreads concurrent claimants
+over the whole range, so they do not all race for the lowest free id. On
+databases that run concurrent writers, a claimant that loses a race simply
+draws a new starting point.
+
+All functions run in the caller's transaction and record the counter delta,
+table version and broker event; the caller commits.
+"""
+from datetime import datetime
+import random
+
+from sqlalchemy import exists, func, select, update
+
+from models import db, User, Locker
+from availability import in_progress
+import broker
+import counters
+import table_versions
+
+ATTEMPTS = 5
+RETURNED = ('id', 'number', 'status', 'assigned_user_id', 'assigned_user_name', 'version')
+
+def _record(row, active_delta):
+    session = db.session
+    connection = session.connection()
+    counters.apply_deltas(connection, {'active_lockers': active_delta})
+    table_versions.bump(connection, ['locker'])
+    broker.queue_event(session, 'locker', {
+        'op': 'updated',
+        'id': row.id,
+        'number': row.number,
+        'status': row.status,
+        'assigned_user_name': row.assigned_user_name
+    })
+    broker.queue_event(session, 'stats', {'active_lockers': active_delta})
+
+def _update(criteria, values):
+    locker = Locker.__table__
+    statement = (
+        update(locker).where(*criteria)
+        .values(version=locker.c.version + 1, **values)
+        .returning(*(locker.c[name] for name in RETURNED))
+    )
+    return db.session.connection().execute(statement).first()
+
+def _claim(criteria, user_id):
+    locker = Locker.__table__
+    row = _update(
+        [locker.c.status == 'available', ~exists().where(in_progress(datetime.utcnow(), locker.c.id)),
+         *criteria],
+        {
+            'status': 'occupied',
+            'assigned_user_id': user_id,
+            'assigned_user_name': select(User.username).where(User.id == user_id).scalar_subquery(),
+        },
+    )
+    if row is not None:
+        _record(row, 1)
+    return row
+
+def claim(locker_id, user_id, version=None):
+    """Assign ``locker_id`` to ``user_id`` if it is available (and at ``version``).
+
+    Returns the updated row, or ``None`` when someone else got there first.
+    """
+    locker = Locker.__table__
+    criteria = [locker.c.id == locker_id]
+    if version is not None:
+        criteria.append(locker.c.version == version)
+    return _claim(criteria, user_id)
+
+def claim_any(user_id, attempts=ATTEMPTS, rng=random):
+    """Assign some available locker to ``user_id``; ``None`` if none is free."""
+    locker = Locker.__table__
+    highest = db.session.scalar(select(func.max(locker.c.id)))
+    if highest is None:
+        return None
+    candidate = locker.alias('candidate')
+    free = [candidate.c.status == 'available', ~exists().where(in_progress(datetime.utcnow(), candidate.c.id))]
+    available = select(candidate.c.id).where(*free).order_by(candidate.c.id).limit(1)
+    for _ in range(attempts):
+        start = rng.randint(1, highest)
+        pick = func.coalesce(
+            available.where(candidate.c.id >= start).scalar_subquery(),
+            available.scalar_subquery(),
+        )
+        row = _claim([locker.c.id == pick], user_id)
+        if row is not None:
+            return row
+        if db.session.scalar(available) is None:
+            return None
+    return None
+
+def release(locker_id, version=None, user_id=None):
+    """Free ``locker_id`` if it is occupied (by ``user_id``, at ``version``, when given).
+
+    Returns the updated row or ``None``.
+    """
+    locker = Locker.__table__
+    criteria = [locker.c.id == locker_id, locker.c.status == 'occupied']
+    if version is not None:
+        criteria.append(locker.c.version == version)
+    if user_id is not None:
+        criteria.append(locker.c.assigned_user_id == user_id)
+    row = _update(criteria, {'status': 'available', 'assigned_user_id': None, 'assigned_user_name': None})
+    if row is not None:
+        _record(row, -1)
+    return row
@@ -0,0 +1,90 @@
+"""gzip/brotli response compression negotiated from ``Accept-Encoding``.
+
+JSON pages and exports are highly repetitive (the same keys on every row) and
+shrink by an order of magnitude. Buffered responses are compressed in one
+call; streamed CSV/NDJSON exports are compressed chunk by chunk so they stay
+constant-memory. Server-sent events are never compressed, since a compressor
+would hold events back until its buffer fills.
+
+Brotli is used when the ``brotli`` package is installed and the client
+prefers it; otherwise gzip from the standard library.
+"""
+import gzip
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE = {
+    'application/json',
+    'application/x-ndjson',
+    'text/csv',
+    'text/html',
+    'text/plain',
+    'text/css',
+    'text/javascript',
+}
+
+def negotiate():
+    """Return the best encoding the client accepts: ``'br'``, ``'gzip'`` or ``None``."""
+    accept = request.accept_encodings
+    gzip_quality = accept['gzip']
+    if brotli is not None and accept['br'] and accept['br'] >= gzip_quality:
+        return 'br'
+    return 'gzip' if gzip_quality else None
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+def _compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+    try:
+        for chunk in chunks:
+            data = process(chunk.encode() if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def compress_response(response, encoding):
+    """Compress ``response`` in place with ``encoding`` if it is worth it."""
+    if (encoding is None
+            or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE):
+        return response
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def _after_request(response):
+    if response.direct_passthrough:
+        return response
+    return compress_response(response, negotiate())
+
+def init_app(app):
+    app.after_request(_after_request)
@@ -0,0 +1,117 @@
+"""Row counters behind /api/stats, kept in step with every flush.
+
+Each counter is one row in the ``stats_counter`` table. A session
+``after_flush`` hook turns the flushed inserts, updates and deletes into
+deltas and applies them with ``UPDATE ... SET value = value + :delta`` on the
+flush connection, so the counts commit or roll back together with the change
+that caused them. ``rebuild()`` recomputes everything with ``COUNT(*)``.
+"""
+from sqlalchemy import delete, event, func, insert, inspect, select, update
+
+from models import db, StatsCounter, User, Locker, Payment
+from database import reads
+
+# counter name -> (model, column values a row needs to be counted)
+COUNTERS = {
+    'users': (User, {}),
+    'active_lockers': (Locker, {'status': 'occupied'}),
+    'total_lockers': (Locker, {}),
+    'pending_payments': (Payment, {'status': 'pending'}),
+}
+
+def _row_values(obj, where, old):
+    """Read the counted columns of ``obj`` before (``old``) or after the flush."""
+    state = inspect(obj)
+    values = {}
+    for key in where:
+        history = state.attrs[key].history
+        if old and history.deleted:
+            values[key] = history.deleted[0]
+        else:
+            values[key] = state.dict.get(key)
+    return values
+
+def _counted(obj, where, old):
+    values = _row_values(obj, where, old)
+    return all(values[key] == value for key, value in where.items())
+
+def collect_deltas(session):
+    """Return ``{counter: delta}`` for the objects flushed by ``session``."""
+    deltas = {}
+    for name, (model, where) in COUNTERS.items():
+        delta = 0
+        for obj in session.new:
+            if isinstance(obj, model) and _counted(obj, where, old=False):
+                delta += 1
+        for obj in session.deleted:
+            if isinstance(obj, model) and _counted(obj, where, old=True):
+                delta -= 1
+        if where:
+            for obj in session.dirty:
+                if isinstance(obj, model) and obj not in session.deleted:
+                    delta += _counted(obj, where, old=False) - _counted(obj, where, old=True)
+        if delta:
+            deltas[name] = delta
+    return deltas
+
+def apply_deltas(connection, deltas):
+    """Add ``deltas`` to the stored counters inside the caller's transaction.
+
+    Code that changes rows with bulk ``UPDATE``/``DELETE`` statements bypasses
+    the flush hook and must report its own deltas through this function.
+    """
+    table = StatsCounter.__table__
+    for name, delta in deltas.items():
+        if delta:
+            connection.execute(
+                update(table).where(table.c.name == name).values(value=table.c.value + delta)
+            )
+
+def _after_flush(session, flush_context):
+    deltas = collect_deltas(session)
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+def rebuild():
+    """Recount every counter from the source tables and store the result."""
+    values = {}
+    for name, (model, where) in COUNTERS.items():
+        criteria = [getattr(model, key) == value for key, value in where.items()]
+        values[name] = db.session.scalar(select(func.count(model.id)).where(*criteria))
+    db.session.execute(delete(StatsCounter))
+    db.session.execute(insert(StatsCounter), [
+        {'name': name, 'value': value} for name, value in values.items()
+    ])
+    db.session.commit()
+    return values
+
+def snapshot():
+    """Return all counters, rebuilding them first if any row is missing."""
+    values = dict(reads.execute(select(StatsCounter.name, StatsCounter.value)).all())
+    if values.keys() != COUNTERS.keys():
+        return rebuild()
+    return values
+
+def _force_old_value(target, value, oldvalue, initiator):
+    return value
+
+def keep_history(attribute):
+    """Load the previous value of ``attribute`` before it is overwritten.
+
+    Otherwise updates to expired objects have no history for flush hooks.
+    """
+    if not event.contains(attribute, 'set', _force_old_value):
+        event.listen(attribute, 'set', _force_old_value, retval=True, active_history=True)
+
+def init_app(app):
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+        for model, where in COUNTERS.values():
+            for key in where:
+                keep_history(getattr(model, key))
+
+    @app.cli.command('rebuild-counters')
+    def rebuild_counters_command():
+        """Recompute the /api/stats counters from the database."""
+        for name, value in rebuild().items():
+            print(f'{name}: {value}')
@@ -0,0 +1,121 @@
+"""Engine configuration and read/write routing.
+
+``init_app`` replaces a bare ``db.init_app``: it sizes the connection pool
+from the environment, applies SQLite pragmas on every new connection (WAL so
+readers never wait for the writer, a busy timeout so writers queue instead of
+failing with ``database is locked``) and builds a second engine for reads.
+
+Read-only endpoints query through ``reads`` (a scoped session on the read
+engine). It points at ``DATABASE_READ_URL`` when a replica is configured; for
+a SQLite file it is a separate pool on the same file with ``query_only`` set,
+which under WAL reads a consistent snapshot without blocking writers.
+
+Environment:
+
+* ``DATABASE_URL`` / ``DATABASE_READ_URL`` -- primary and optional replica.
+* ``DB_POOL_SIZE``, ``DB_MAX_OVERFLOW``, ``DB_POOL_TIMEOUT``,
+  ``DB_POOL_RECYCLE`` -- pool sizing.
+* ``DB_BUSY_TIMEOUT`` -- seconds a SQLite writer waits for the lock.
+* ``SQLITE_JOURNAL_MODE`` -- ``WAL`` by default; ``DELETE`` restores the
+  rollback journal, e.g. for before/after measurements.
+"""
+import os
+
+from flask.globals import app_ctx
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from models import db
+
+_read_factory = sessionmaker()
+reads = scoped_session(_read_factory, scopefunc=lambda: id(app_ctx._get_current_object()))
+
+def _is_sqlite(url):
+    return url.drivername.startswith('sqlite')
+
+def _is_sqlite_file(url):
+    return _is_sqlite(url) and url.database not in (None, '', ':memory:')
+
+def engine_options(url):
+    """Pool and driver options for ``url`` taken from the environment."""
+    url = make_url(url)
+    if _is_sqlite(url) and not _is_sqlite_file(url):
+        return {}
+    options = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+    if _is_sqlite(url):
+        options['connect_args'] = {'timeout': float(os.environ.get('DB_BUSY_TIMEOUT', 30))}
+    else:
+        options['pool_pre_ping'] = True
+    return options
+
+def sqlite_pragmas(read_only=False):
+    busy_ms = int(float(os.environ.get('DB_BUSY_TIMEOUT', 30)) * 1000)
+    pragmas = [
+        f'busy_timeout = {busy_ms}',
+        'synchronous = NORMAL',
+        'cache_size = -20000',
+        'temp_store = MEMORY',
+    ]
+    if read_only:
+        pragmas.append('query_only = ON')
+    else:
+        pragmas.insert(0, f"journal_mode = {os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')}")
+    return pragmas
+
+def _apply_pragmas(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(f'PRAGMA {pragma}')
+        cursor.close()
+
+def init_app(app):
+    url = app.config['SQLALCHEMY_DATABASE_URI']
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(url))
+    db.init_app(app)
+
+    with app.app_context():
+        engine = db.engine
+    if _is_sqlite_file(engine.url):
+        _apply_pragmas(engine, sqlite_pragmas())
+
+    read_url = os.environ.get('DATABASE_READ_URL')
+    if read_url:
+        read_url = make_url(read_url)
+        if _is_sqlite_file(read_url) and not os.path.isabs(read_url.database):
+            read_url = read_url.set(database=os.path.join(app.instance_path, read_url.database))
+        read_engine = create_engine(read_url, **engine_options(read_url))
+        if _is_sqlite_file(read_url):
+            _apply_pragmas(read_engine, sqlite_pragmas(read_only=True))
+    elif _is_sqlite_file(engine.url):
+        read_engine = create_engine(engine.url, **engine_options(engine.url))
+        _apply_pragmas(read_engine, sqlite_pragmas(read_only=True))
+    else:
+        read_engine = engine
+    _read_factory.configure(bind=read_engine)
+    app.extensions['read_engine'] = read_engine
+
+    # End the read transaction after every request so the next one sees a
+    # fresh snapshot, even when an outer app context is reused.
+    @app.teardown_request
+    @app.teardown_appcontext
+    def remove_read_session(exception=None):
+        reads.remove()
+
+def dispose_after_fork(app):
+    """Forget pooled connections inherited from the parent process.
+
+    Call first thing in a forked worker; the parent's connections are left
+    open for the parent and each worker builds its own pool.
+    """
+    with app.app_context():
+        engines = {db.engine, app.extensions['read_engine']}
+    for engine in engines:
+        engine.dispose(close=False)
@@ -0,0 +1,312 @@
+"""Background expiry of reservations and release of their lockers.
+
+Reservations move from ``pending`` to ``active`` to ``completed`` here rather
+than being compared against the clock on every read. The scheduler keeps a
+heap of the upcoming ``start_time`` and ``end_time`` values within
+``HORIZON`` and sleeps until the earliest one. ``process_due`` then works in
+batches of up to ``batch_size`` reservations, each in one transaction:
+blocking reservations whose ``end_time`` has passed become ``completed`` and
+free their locker, and ``pending`` reservations whose ``start_time`` has
+arrived become ``active`` and occupy theirs. A locker is only freed while it
+is still assigned to the customer whose booking ended, and only occupied if
+it is available or already assigned to the booker; a reservation that finds
+its locker held by someone else (or in maintenance) is counted under
+``conflicts``, logged and published as a ``conflict`` event. A batch is a handful of
+set-based statements, so it reports its own counter deltas, table versions
+and broker events.
+
+No state lives outside the database. The heap is rebuilt from the
+reservation table on start and every ``RELOAD_INTERVAL``, and each reload
+first catches up on everything that fell due while no scheduler was running.
+The updates only match rows still in their old status, so a second
+scheduler never applies a change twice.
+
+``EXPIRY_SCHEDULER`` selects where it runs: ``thread`` (the default) starts a
+thread in the process on its first request; ``off`` leaves it to serve.py,
+which runs it in a process of its own, or to
+``flask expire-reservations --watch``. Reservations created in another
+process are picked up by the next reload.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+import heapq
+import os
+import threading
+
+import click
+from flask import current_app
+from sqlalchemy import bindparam, exists, or_, select, update
+
+from models import db, User, Locker, Reservation
+from database import reads
+from availability import BLOCKING_STATUSES, UNAVAILABLE_LOCKER_STATUSES
+import broker
+import counters
+import table_versions
+from threads import PerProcessThread
+
+BATCH_SIZE = 1000
+HORIZON = timedelta(minutes=10)
+RELOAD_INTERVAL = timedelta(minutes=1)
+RESULT_KEYS = ('completed', 'activated', 'released', 'occupied', 'conflicts')
+
+def _process_batch(now, limit):
+    session = db.session
+    connection = session.connection()
+    reservation = Reservation.__table__
+    locker = Locker.__table__
+
+    expired = connection.execute(
+        update(reservation)
+        .where(reservation.c.id.in_(
+            select(reservation.c.id)
+            .where(reservation.c.status.in_(BLOCKING_STATUSES), reservation.c.end_time <= now)
+            .limit(limit)
+        ), reservation.c.status.in_(BLOCKING_STATUSES))
+        .values(status='completed')
+        .returning(reservation.c.id, reservation.c.user_id, reservation.c.locker_id, reservation.c.status)
+    ).all()
+    started = connection.execute(
+        update(reservation)
+        .where(reservation.c.id.in_(
+            select(reservation.c.id)
+            .where(reservation.c.status == 'pending',
+                   reservation.c.start_time <= now, reservation.c.end_time > now)
+            .limit(limit)
+        ), reservation.c.status == 'pending')
+        .values(status='active')
+        .returning(reservation.c.id, reservation.c.user_id, reservation.c.locker_id, reservation.c.status)
+    ).all()
+    counts = {'completed': len(expired), 'activated': len(started), 'released': 0, 'occupied': 0,
+              'conflicts': 0}
+    if not expired and not started:
+        session.commit()
+        return counts
+
+    locker_columns = (locker.c.id, locker.c.number, locker.c.status,
+                      locker.c.assigned_user_id, locker.c.assigned_user_name)
+    touched = {row.locker_id for row in expired} | {row.locker_id for row in started}
+    before = {row.id: row for row in connection.execute(
+        select(*locker_columns).where(locker.c.id.in_(touched)))}
+
+    # A locker stays with its customer while they still have an active
+    # reservation on it; handing it to the next customer happens below.
+    released = {(row.locker_id, row.user_id) for row in expired}
+    if released:
+        connection.execute(
+            update(locker)
+            .where(locker.c.id == bindparam('release_locker'),
+                   locker.c.assigned_user_id == bindparam('release_user'),
+                   locker.c.status == 'occupied',
+                   ~exists().where(reservation.c.locker_id == locker.c.id,
+                                   reservation.c.user_id == locker.c.assigned_user_id,
+                                   reservation.c.status == 'active',
+                                   reservation.c.end_time > now))
+            .values(status='available', assigned_user_id=None, assigned_user_name=None,
+                    version=locker.c.version + 1),
+            [{'release_locker': locker_id, 'release_user': user_id} for locker_id, user_id in released]
+        )
+    if started:
+        connection.execute(
+            update(locker)
+            .where(locker.c.id == bindparam('occupy_locker'),
+                   or_(locker.c.status == 'available',
+                       locker.c.assigned_user_id == bindparam('occupy_user')),
+                   *(locker.c.status != status for status in UNAVAILABLE_LOCKER_STATUSES))
+            .values(status='occupied', version=locker.c.version + 1,
+                    assigned_user_id=bindparam('occupy_user'),
+                    assigned_user_name=select(User.username)
+                    .where(User.id == bindparam('occupy_user')).scalar_subquery()),
+            [{'occupy_locker': row.locker_id, 'occupy_user': row.user_id} for row in started]
+        )
+    after = {row.id: row for row in connection.execute(
+        select(*locker_columns).where(locker.c.id.in_(touched)))}
+
+    changed = [row for locker_id, row in after.items() if row != before.get(locker_id)]
+    for row in changed:
+        was_occupied = before[row.id].status == 'occupied'
+        counts['released'] += was_occupied and row.status != 'occupied'
+        counts['occupied'] += row.status == 'occupied' and not was_occupied
+        broker.queue_event(session, 'locker', {
+            'op': 'updated',
+            'id': row.id,
+            'number': row.number,
+            'status': row.status,
+            'assigned_user_name': row.assigned_user_name
+        })
+    for row in expired + started:
+        broker.queue_event(session, 'reservation', {
+            'op': 'updated',
+            'id': row.id,
+            'user_id': row.user_id,
+            'locker_id': row.locker_id,
+            'status': row.status
+        })
+    for row in started:
+        held = after.get(row.locker_id)
+        if held is None or held.status != 'occupied' or held.assigned_user_id != row.user_id:
+            counts['conflicts'] += 1
+            current_app.logger.warning(
+                'reservation %s started but locker %s is %s (assigned to %s)', row.id, row.locker_id,
+                held.status if held else 'missing', held.assigned_user_id if held else None)
+            broker.queue_event(session, 'reservation', {
+                'op': 'conflict',
+                'id': row.id,
+                'user_id': row.user_id,
+                'locker_id': row.locker_id,
+                'status': row.status
+            })
+
+    deltas = {'active_lockers': counts['occupied'] - counts['released']}
+    if deltas['active_lockers']:
+        counters.apply_deltas(connection, deltas)
+        broker.queue_event(session, 'stats', deltas)
+    table_versions.bump(connection, ['reservation', 'locker'] if changed else ['reservation'])
+    session.commit()
+    return counts
+
+def process_due(now=None, batch_size=BATCH_SIZE):
+    """Apply every start and end due at ``now``; return what changed.
+
+    Must run inside an app context. Commits once per batch of ``batch_size``
+    reservations.
+    """
+    now = now or datetime.utcnow()
+    totals = Counter()
+    while True:
+        counts = _process_batch(now, batch_size)
+        totals.update(counts)
+        if counts['completed'] < batch_size and counts['activated'] < batch_size:
+            return {key: totals[key] for key in RESULT_KEYS}
+
+def upcoming(now, until):
+    """Return the start and end times in ``(now, until]`` the scheduler must wake for."""
+    ends = reads.scalars(
+        select(Reservation.end_time)
+        .where(Reservation.status.in_(BLOCKING_STATUSES),
+               Reservation.end_time > now, Reservation.end_time <= until)
+    ).all()
+    starts = reads.scalars(
+        select(Reservation.start_time)
+        .where(Reservation.status == 'pending',
+               Reservation.start_time > now, Reservation.start_time <= until)
+    ).all()
+    return set(ends) | set(starts)
+
+class ExpiryScheduler:
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self._heap = []
+        self._condition = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread = PerProcessThread()
+        self._running_pid = None
+        self.runs = 0
+        self.errors = 0
+        self.totals = Counter()
+        self.last_run = None
+
+    def start(self, app):
+        """Run the scheduler on a background thread of this process."""
+        def thread():
+            self._heap = []
+            self._stopping = threading.Event()
+            return threading.Thread(target=self.run, args=(app,), name='reservation-expiry', daemon=True)
+        self._thread.start(thread)
+
+    def stop(self):
+        with self._condition:
+            self._stopping.set()
+            self._condition.notify_all()
+
+    def schedule(self, when):
+        """Wake up at ``when`` (naive UTC) if this process runs the scheduler."""
+        if self._running_pid != os.getpid() or when > datetime.utcnow() + HORIZON:
+            return
+        with self._condition:
+            heapq.heappush(self._heap, when)
+            if self._heap[0] == when:
+                self._condition.notify_all()
+
+    def _run_due(self, app, now, reload):
+        with app.app_context():
+            counts = process_due(now, self.batch_size)
+            if reload:
+                times = upcoming(now, now + HORIZON)
+        with self._condition:
+            if reload:
+                times.update(when for when in self._heap if when > now)
+                self._heap = list(times)
+                heapq.heapify(self._heap)
+            self.runs += 1
+            self.totals.update(counts)
+            self.last_run = now
+
+    def run(self, app):
+        """Process reservations as they fall due until ``stop`` is called."""
+        self._running_pid = os.getpid()
+        reload_at = datetime.min
+        while not self._stopping.is_set():
+            now = datetime.utcnow()
+            reload = now >= reload_at
+            with self._condition:
+                due = False
+                while self._heap and self._heap[0] <= now:
+                    heapq.heappop(self._heap)
+                    due = True
+            if reload or due:
+                try:
+                    self._run_due(app, now, reload)
+                    if reload:
+                        reload_at = now + RELOAD_INTERVAL
+                except Exception:
+                    self.errors += 1
+                    app.logger.exception('reservation expiry failed; retrying at the next reload')
+                    reload_at = now + RELOAD_INTERVAL
+            with self._condition:
+                wake = min(self._heap[0], reload_at) if self._heap else reload_at
+                timeout = (wake - datetime.utcnow()).total_seconds()
+                if timeout > 0 and not self._stopping.is_set():
+                    self._condition.wait(timeout)
+
+    def stats(self):
+        with self._condition:
+            stats = {
+                'running': self._running_pid == os.getpid(),
+                'scheduled': len(self._heap),
+                'next_due': self._heap[0].isoformat() if self._heap else None,
+                'last_run': self.last_run.isoformat() if self.last_run else None,
+                'runs': self.runs,
+                'errors': self.errors,
+            }
+            stats.update((key, self.totals[key]) for key in RESULT_KEYS)
+        return stats
+
+scheduler = ExpiryScheduler()
+
+def _start_scheduler():
+    if current_app.config.get('EXPIRY_SCHEDULER', 'thread') == 'thread':
+        scheduler.start(current_app._get_current_object())
+
+def init_app(app):
+    scheduler.batch_size = app.config.get('EXPIRY_BATCH_SIZE', scheduler.batch_size)
+    app.before_request(_start_scheduler)
+
+    @app.cli.command('expire-reservations')
+    @click.option('--watch', is_flag=True, help='Keep running and process reservations as they fall due.')
+    @click.option('--batch-size', default=BATCH_SIZE, show_default=True, help='Reservations per transaction.')
+    def expire_reservations_command(watch, batch_size):
+        """Complete ended reservations, activate started ones and update their lockers."""
+        if watch:
+            scheduler.batch_size = batch_size
+            try:
+                scheduler.run(current_app._get_current_object())
+            except KeyboardInterrupt:
+                pass
+            return
+        started = datetime.utcnow()
+        counts = process_due(batch_size=batch_size)
+        elapsed = (datetime.utcnow() - started).total_seconds()
+        for name, count in counts.items():
+            print(f'{name}: {count}')
+        print(f'done in {elapsed:.1f}s')
@@ -0,0 +1,54 @@
+"""Constant-memory CSV and NDJSON serialization of large result sets.
+
+Rows are fetched from the database in ``BATCH_SIZE`` partitions with
+``yield_per`` and each partition is encoded and handed to the WSGI server
+before the next one is read, so an export starts sending bytes immediately and
+never holds more than one batch in memory.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from database import reads
+
+BATCH_SIZE = 1000
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+def _cell(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+def _csv_batches(fields, partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    yield buffer.getvalue()
+    for rows in partitions:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_cell(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+
+def _ndjson_batches(fields, partitions):
+    for rows in partitions:
+        yield ''.join(
+            json.dumps(dict(zip(fields, map(_cell, row)))) + '\n' for row in rows
+        )
+
+def stream_rows(statement, fields, fmt):
+    """Execute ``statement`` and yield it encoded as ``fmt`` in batches.
+
+    ``fields`` names the selected columns in order. Must run inside an app
+    context (wrap the generator with ``stream_with_context``).
+    """
+    result = reads.execute(statement.execution_options(yield_per=BATCH_SIZE))
+    try:
+        encode = _csv_batches if fmt == 'csv' else _ndjson_batches
+        yield from encode(fields, result.partitions())
+    finally:
+        result.close()
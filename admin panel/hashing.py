@@ -0,0 +1,196 @@
+"""Password hashing on a bounded process pool.
+
+scrypt costs tens of milliseconds of CPU per call. Running it in worker
+processes keeps request threads free (they only wait on a future, without
+holding the GIL) and lets a login storm use every core. A semaphore caps the
+number of hashes admitted at once; callers that cannot get a slot within
+``PASSWORD_HASH_TIMEOUT`` seconds get ``HashingBusy`` instead of piling up.
+Bulk hashing takes one slot per chunk of ``BULK_CHUNK`` passwords, so an
+import competes with logins chunk by chunk instead of jumping the queue.
+
+Configuration (``app.config``):
+
+* ``PASSWORD_HASH_METHOD``  -- Werkzeug method spec, e.g. ``scrypt:32768:8:1``.
+  Stored hashes with a different spec are upgraded on the next login.
+* ``PASSWORD_HASH_WORKERS`` -- pool size per process; ``0`` hashes inline in
+  the caller. serve.py divides the CPU count between its workers.
+* ``PASSWORD_HASH_QUEUE``   -- maximum hashes in flight or queued.
+* ``PASSWORD_HASH_TIMEOUT`` -- seconds to wait for a slot before giving up.
+* ``PASSWORD_HASH_RESULT_TIMEOUT`` -- seconds to wait for an admitted hash
+  (or chunk) to finish before giving up.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import multiprocessing
+import os
+import threading
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+BULK_CHUNK = 16
+
+class HashingBusy(RuntimeError):
+    """Raised when the hashing queue is full."""
+
+def _hash_chunk(passwords, method):
+    return [generate_password_hash(password, method) for password in passwords]
+
+class PasswordHasher:
+    def __init__(self, method=DEFAULT_METHOD, workers=None, queue_size=None, timeout=2.0,
+                 result_timeout=30.0):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._waiting = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self.configure(method, workers, queue_size, timeout, result_timeout)
+
+    def configure(self, method=DEFAULT_METHOD, workers=None, queue_size=None, timeout=2.0,
+                  result_timeout=30.0):
+        """Apply new settings; call before serving traffic."""
+        self.shutdown()
+        self.method = method
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.queue_size = queue_size or max(self.workers, 1) * 8
+        self.timeout = timeout
+        self.result_timeout = result_timeout
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+
+    def _executor(self):
+        # Pools do not survive fork; a forked worker builds its own. The
+        # children come from a forkserver rather than a fork of this
+        # multithreaded process, which could copy locks other threads hold.
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('forkserver'))
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _acquire(self):
+        with self._lock:
+            self._waiting += 1
+        acquired = self._slots.acquire(timeout=self.timeout)
+        with self._lock:
+            self._waiting -= 1
+            if not acquired:
+                self._rejected += 1
+            else:
+                self._in_flight += 1
+        if not acquired:
+            raise HashingBusy('Password hashing queue is full')
+
+    def _release(self, succeeded):
+        self._slots.release()
+        with self._lock:
+            self._in_flight -= 1
+            if succeeded:
+                self._completed += 1
+            else:
+                self._failed += 1
+
+    @contextmanager
+    def _slot(self):
+        self._acquire()
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+        finally:
+            self._release(succeeded)
+
+    def _wait(self, future):
+        try:
+            return future.result(timeout=self.result_timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HashingBusy('Password hashing timed out') from None
+
+    def _submit(self, executor, func, *args):
+        """Submit ``func`` in a slot that is held until it finishes, even if nobody waits for it."""
+        self._acquire()
+        try:
+            future = executor.submit(func, *args)
+        except BaseException:
+            self._release(False)
+            raise
+        # A timed-out caller cannot cancel a running task; it keeps the slot until done.
+        future.add_done_callback(
+            lambda done: self._release(not done.cancelled() and done.exception() is None))
+        return future
+
+    def _call(self, func, *args):
+        if self.workers == 0:
+            with self._slot():
+                return func(*args)
+        return self._wait(self._submit(self._executor(), func, *args))
+
+    def hash(self, password):
+        return self._call(generate_password_hash, password, self.method)
+
+    def hash_many(self, passwords):
+        """Hash a batch across all workers, taking one queue slot per chunk.
+
+        Raises ``HashingBusy`` if a chunk cannot get a slot or does not finish
+        in time; chunks already submitted are cancelled.
+        """
+        passwords = list(passwords)
+        chunks = [passwords[start:start + BULK_CHUNK] for start in range(0, len(passwords), BULK_CHUNK)]
+        if self.workers == 0:
+            hashes = []
+            for chunk in chunks:
+                with self._slot():
+                    hashes.extend(_hash_chunk(chunk, self.method))
+            return hashes
+        executor = self._executor()
+        futures = []
+        try:
+            for chunk in chunks:
+                futures.append(self._submit(executor, _hash_chunk, chunk, self.method))
+            return [pwhash for future in futures for pwhash in self._wait(future)]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def check(self, pwhash, password):
+        return self._call(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True when ``pwhash`` was made with different parameters than ``method``."""
+        return pwhash.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'method': self.method,
+                'workers': self.workers,
+                'capacity': self.queue_size,
+                'queue_depth': self._in_flight + self._waiting,
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'completed': self._completed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+            }
+
+hasher = PasswordHasher()
+
+def init_app(app):
+    hasher.configure(
+        method=app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+        workers=app.config.get('PASSWORD_HASH_WORKERS'),
+        queue_size=app.config.get('PASSWORD_HASH_QUEUE'),
+        timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 2.0),
+        result_timeout=app.config.get('PASSWORD_HASH_RESULT_TIMEOUT', 30.0),
+    )
@@ -0,0 +1,341 @@
+"""Per-request latency and SQL instrumentation exported at /metrics.
+
+Flask request hooks time every request and SQLAlchemy cursor hooks on the
+primary and read engines count the statements it runs and the time spent in
+the database. Results are aggregated per endpoint and rendered in the
+Prometheus text format by ``render()``. Streamed responses (exports, SSE)
+have no known length and add nothing to the response size.
+
+Only a ``METRICS_SAMPLE_RATE`` fraction of requests is measured in detail;
+the others just increment ``http_requests_total``, and the cursor hooks return
+immediately for them. A sampled request that runs more than
+``METRICS_QUERY_BUDGET`` statements is counted in
+``db_query_budget_exceeded_total`` and logged with its most repeated
+statement, which is almost always an N+1 loop.
+
+Every process counts its own requests. With ``METRICS_DIR`` set (serve.py
+points it at a directory of its own), each process writes a JSON snapshot
+of its metrics there every ``SNAPSHOT_INTERVAL`` seconds and on exit, and
+``render()`` adds up the counters and histograms of every snapshot, so any
+worker answers /metrics for the whole server. Gauges describe one process
+and are reported per live process with a ``process`` label.
+"""
+from collections import Counter
+import json
+import os
+import random
+import threading
+import time
+
+from flask import current_app, request
+from sqlalchemy import event
+
+from models import db
+import broker
+import expiry
+import hashing
+import table_versions
+import user_cache
+from threads import PerProcessThread
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SNAPSHOT_INTERVAL = 5.0
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def add(self, counts, total, count):
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, counts)]
+        self.sum += total
+        self.count += count
+
+class EndpointMetrics:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = 0.0
+        self.response_bytes = 0
+        self.budget_exceeded = 0
+
+class _RequestState:
+    __slots__ = ('started', 'queries', 'db_seconds', 'statements', 'status', 'size')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements = Counter()
+        self.status = None
+        self.size = None
+
+class RequestMetrics:
+    def __init__(self, sample_rate=1.0, query_budget=20):
+        self.sample_rate = sample_rate
+        self.query_budget = query_budget
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._requests = Counter()
+        self._endpoints = {}
+        self.directory = None
+        self._thread = PerProcessThread()
+        self._stopping = threading.Event()
+
+    # Flask hooks
+    def before_request(self):
+        sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        self._local.state = _RequestState() if sampled else None
+
+    def after_request(self, response):
+        key = (request.endpoint or 'unmatched', request.method, response.status_code)
+        with self._lock:
+            self._requests[key] += 1
+        state = getattr(self._local, 'state', None)
+        if state is not None:
+            state.status = response.status_code
+            state.size = response.content_length
+        return response
+
+    def teardown_request(self, exception=None):
+        state = getattr(self._local, 'state', None)
+        if state is None:
+            return
+        self._local.state = None
+        endpoint = request.endpoint or 'unmatched'
+        elapsed = time.perf_counter() - state.started
+        over_budget = state.queries > self.query_budget
+        with self._lock:
+            if state.status is None:
+                self._requests[(endpoint, request.method, 500)] += 1
+            metrics = self._endpoints.get(endpoint)
+            if metrics is None:
+                metrics = self._endpoints[endpoint] = EndpointMetrics()
+            metrics.latency.observe(elapsed)
+            metrics.queries.observe(state.queries)
+            metrics.db_seconds += state.db_seconds
+            metrics.response_bytes += state.size or 0
+            metrics.budget_exceeded += over_budget
+        if over_budget:
+            statement, repeats = state.statements.most_common(1)[0]
+            current_app.logger.warning(
+                '%s %s ran %d queries (budget %d); repeated %d times: %s',
+                request.method, request.path, state.queries, self.query_budget,
+                repeats, ' '.join(statement.split())[:200])
+
+    # SQLAlchemy hooks
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if getattr(self._local, 'state', None) is not None:
+            context._metrics_started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        state = getattr(self._local, 'state', None)
+        started = getattr(context, '_metrics_started', None)
+        if state is None or started is None:
+            return
+        state.queries += 1
+        state.db_seconds += time.perf_counter() - started
+        state.statements[statement] += 1
+
+    def reset(self):
+        with self._lock:
+            self._requests.clear()
+            self._endpoints.clear()
+
+    # Sharing between processes
+    def start(self, app):
+        """Write snapshots to ``directory`` from a background thread of this process."""
+        if self.directory is None:
+            return
+        def thread():
+            self._stopping = threading.Event()
+            return threading.Thread(target=self._run, args=(app,), name='metrics-snapshots', daemon=True)
+        self._thread.start(thread)
+
+    def stop(self):
+        """Write a last snapshot and stop the snapshot thread."""
+        self._stopping.set()
+        if self.directory is not None:
+            self.save()
+
+    def _run(self, app):
+        stopping = self._stopping
+        while not stopping.wait(SNAPSHOT_INTERVAL):
+            try:
+                self.save()
+            except OSError:
+                app.logger.exception('could not write the metrics snapshot')
+
+    def snapshot(self):
+        """Return this process's metrics as JSON-serialisable data."""
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'requests': [[*key, count] for key, count in self._requests.items()],
+                'endpoints': {
+                    endpoint: {
+                        'latency': [metrics.latency.counts, metrics.latency.sum, metrics.latency.count],
+                        'queries': [metrics.queries.counts, metrics.queries.sum, metrics.queries.count],
+                        'db_seconds': metrics.db_seconds,
+                        'response_bytes': metrics.response_bytes,
+                        'budget_exceeded': metrics.budget_exceeded,
+                    } for endpoint, metrics in self._endpoints.items()
+                },
+                'gauges': _process_gauges(),
+            }
+
+    def save(self):
+        """Replace this process's snapshot in ``directory``."""
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        partial = f'{path}.{threading.get_ident()}.tmp'
+        with open(partial, 'w') as handle:
+            json.dump(self.snapshot(), handle)
+        os.replace(partial, path)
+
+    def _snapshots(self):
+        """Return the snapshots of every process, this one's taken now."""
+        own = self.snapshot()
+        snapshots = [own]
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json') or name == f"{own['pid']}.json":
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as handle:
+                    snapshots.append(json.load(handle))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        if self.directory is None:
+            snapshots = [self.snapshot()]
+        else:
+            snapshots = self._snapshots()
+        requests = Counter()
+        endpoints = {}
+        for snapshot in snapshots:
+            for endpoint, method, status, count in snapshot['requests']:
+                requests[(endpoint, method, status)] += count
+            for endpoint, data in snapshot['endpoints'].items():
+                metrics = endpoints.get(endpoint)
+                if metrics is None:
+                    metrics = endpoints[endpoint] = EndpointMetrics()
+                metrics.latency.add(*data['latency'])
+                metrics.queries.add(*data['queries'])
+                metrics.db_seconds += data['db_seconds']
+                metrics.response_bytes += data['response_bytes']
+                metrics.budget_exceeded += data['budget_exceeded']
+        requests = sorted(requests.items())
+        endpoints = sorted(endpoints.items())
+        lines = []
+        _header(lines, 'http_requests_total', 'counter', 'Requests by endpoint, method and status.')
+        for (endpoint, method, status), count in requests:
+            lines.append(f'http_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}')
+        _histograms(lines, 'http_request_duration_seconds', 'Sampled request latency.',
+                    [(endpoint, metrics.latency) for endpoint, metrics in endpoints])
+        _histograms(lines, 'db_queries_per_request', 'SQL statements per sampled request.',
+                    [(endpoint, metrics.queries) for endpoint, metrics in endpoints])
+        _counters(lines, 'db_query_duration_seconds_total', 'Time spent in SQL by sampled requests.',
+                  [(endpoint, round(metrics.db_seconds, 6)) for endpoint, metrics in endpoints])
+        _counters(lines, 'http_response_size_bytes_total', 'Response bytes of sampled requests.',
+                  [(endpoint, metrics.response_bytes) for endpoint, metrics in endpoints])
+        _counters(lines, 'db_query_budget_exceeded_total',
+                  'Sampled requests that ran more statements than the query budget.',
+                  [(endpoint, metrics.budget_exceeded) for endpoint, metrics in endpoints])
+        if self.directory is None:
+            _gauges(lines, {None: snapshots[0]['gauges']})
+        else:
+            # A dead process's counters still count; its gauges are gone.
+            _gauges(lines, {snapshot['pid']: snapshot['gauges'] for snapshot in snapshots
+                            if _alive(snapshot['pid'])})
+        return '\n'.join(lines) + '\n'
+
+def _process_gauges():
+    return {
+        'password_hashing': hashing.hasher.stats(),
+        'user_cache': user_cache.cache.stats(),
+        'response_cache': table_versions.responses.stats(),
+        'reservation_expiry': expiry.scheduler.stats(),
+        'broker_relay': broker.relay.stats(),
+    }
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _labels(**labels):
+    escaped = (
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+def _header(lines, name, kind, help_text):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+
+def _histograms(lines, name, help_text, series):
+    _header(lines, name, 'histogram', help_text)
+    for endpoint, histogram in series:
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(endpoint=endpoint, le=bound)} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(endpoint=endpoint, le="+Inf")} {histogram.count}')
+        lines.append(f'{name}_sum{_labels(endpoint=endpoint)} {round(histogram.sum, 6)}')
+        lines.append(f'{name}_count{_labels(endpoint=endpoint)} {histogram.count}')
+
+def _counters(lines, name, help_text, series):
+    _header(lines, name, 'counter', help_text)
+    for endpoint, value in series:
+        lines.append(f'{name}{_labels(endpoint=endpoint)} {value}')
+
+def _gauges(lines, processes):
+    """Add the gauges of ``{pid: {prefix: stats}}``, labelled by pid unless it is ``None``."""
+    series = {}
+    for pid, gauges in processes.items():
+        for prefix, stats in gauges.items():
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                series.setdefault((prefix, key), []).append((pid, value))
+    for (prefix, key), values in series.items():
+        name = f'{prefix}_{key}'
+        _header(lines, name, 'gauge', f'{prefix} {key.replace("_", " ")}.')
+        for pid, value in values:
+            lines.append(f'{name}{"" if pid is None else _labels(process=pid)} {value}')
+
+metrics = RequestMetrics()
+
+def init_app(app):
+    metrics.sample_rate = app.config.get('METRICS_SAMPLE_RATE', metrics.sample_rate)
+    metrics.query_budget = app.config.get('METRICS_QUERY_BUDGET', metrics.query_budget)
+    metrics.directory = app.config.get('METRICS_DIR')
+    app.before_request(metrics.before_request)
+    app.after_request(metrics.after_request)
+    app.teardown_request(metrics.teardown_request)
+
+    with app.app_context():
+        engines = {db.engine, app.extensions['read_engine']}
+    for engine in engines:
+        if not event.contains(engine, 'before_cursor_execute', metrics.before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', metrics.before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', metrics.after_cursor_execute)
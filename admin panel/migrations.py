@@ -0,0 +1,49 @@
+"""Additive schema upgrades that never drop existing data.
+
+``db.create_all()`` creates missing tables but skips columns and indexes
+added to tables that already exist, so older databases would keep scanning or
+fail on new columns. ``upgrade()`` adds all three, and is safe to run on every
+deploy. New columns on existing tables must be nullable or carry a
+``server_default``. It also creates the search index and its triggers (see
+search.py), filling the index the first time, and backfills the analytics
+rollups when they are still empty (see analytics.py).
+"""
+from sqlalchemy.schema import CreateColumn
+
+from models import db
+import analytics
+import search
+
+def upgrade():
+    """Create missing tables, columns and indexes; return what was added."""
+    db.create_all()
+    created = []
+    with db.engine.begin() as connection:
+        inspector = db.inspect(connection)
+        preparer = connection.dialect.identifier_preparer
+        for table in db.metadata.sorted_tables:
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    spec = CreateColumn(column).compile(dialect=connection.dialect)
+                    connection.exec_driver_sql(
+                        f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {spec}'
+                    )
+                    created.append(f'{table.name}.{column.name}')
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(connection)
+                    created.append(index.name)
+        if search.upgrade(connection):
+            created.append('search_index')
+        if analytics.upgrade(connection):
+            created.append('analytics_rollup')
+    return created
+
+def init_app(app):
+    @app.cli.command('upgrade-db')
+    def upgrade_db_command():
+        """Create missing tables, columns and indexes without touching existing rows."""
+        created = upgrade()
+        print(f'Added {len(created)} column(s)/index(es)' + (': ' + ', '.join(created) if created else ''))
@@ -0,0 +1,134 @@
+from flask_sqlalchemy import SQLAlchemy
+from flask_login import UserMixin
+from datetime import datetime
+from hashing import hasher
+
+db = SQLAlchemy()
+
+# Database Models
+class User(UserMixin, db.Model):
+    __table_args__ = (
+        db.Index('ix_user_role_id', 'role', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password = db.Column(db.String(128), nullable=False)
+    role = db.Column(db.String(20), default='user')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    active = db.Column(db.Boolean, default=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
+
+    def set_password(self, password):
+        self.password = hasher.hash(password)
+
+    def check_password(self, password):
+        return hasher.check(self.password, password)
+
+    def password_needs_rehash(self):
+        return hasher.needs_rehash(self.password)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'username': self.username,
+            'email': self.email,
+            'role': self.role,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None,
+            'active': self.active
+        }
+
+class Locker(db.Model):
+    __table_args__ = (
+        db.Index('ix_locker_status_id', 'status', 'id'),
+        db.Index('ix_locker_assigned_user_id', 'assigned_user_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    number = db.Column(db.String(10), unique=True, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='available')
+    assigned_user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    assigned_user_name = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'number': self.number,
+            'status': self.status,
+            'assigned_user_id': self.assigned_user_id,
+            'assigned_user_name': self.assigned_user_name,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None,
+            'version': self.version
+        }
+
+class Reservation(db.Model):
+    __table_args__ = (
+        db.Index('ix_reservation_locker_start', 'locker_id', 'start_time', 'end_time'),
+        db.Index('ix_reservation_locker_end', 'locker_id', 'end_time', 'start_time'),
+        db.Index('ix_reservation_user_id', 'user_id', 'id'),
+        db.Index('ix_reservation_status_id', 'status', 'id'),
+        db.Index('ix_reservation_start_time', 'start_time'),
+        db.Index('ix_reservation_status_start_time', 'status', 'start_time'),
+        db.Index('ix_reservation_status_end_time', 'status', 'end_time'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    locker_id = db.Column(db.Integer, db.ForeignKey('locker.id'))
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), default='pending')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Payment(db.Model):
+    __table_args__ = (
+        db.Index('ix_payment_status_id', 'status', 'id'),
+        db.Index('ix_payment_user_id', 'user_id', 'id'),
+        db.Index('ix_payment_created_at', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    amount = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(20), default='pending')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class StatsCounter(db.Model):
+    name = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class AnalyticsRollup(db.Model):
+    """Per-bucket aggregates behind /api/analytics, maintained by analytics.py."""
+    bucket = db.Column(db.String(8), primary_key=True)
+    start = db.Column(db.DateTime, primary_key=True)
+    metric = db.Column(db.String(40), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0)
+
+class EventLog(db.Model):
+    """Append-only feed behind /api/notifications; rows are never updated."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(40), nullable=False)
+    title = db.Column(db.String(80), nullable=False)
+    message = db.Column(db.String(255), nullable=False)
+    type = db.Column(db.String(20), nullable=False, default='info')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class TableVersion(db.Model):
+    """Change counter per table, bumped in the transaction that changes it."""
+    name = db.Column(db.String(40), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class BrokerEvent(db.Model):
+    """Committed /api/stream events, delivered to every process by broker.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(40), nullable=False)
+    data = db.Column(db.Text, nullable=False)
@@ -0,0 +1,166 @@
+"""Append-only event log behind /api/notifications.
+
+Every committed locker, reservation, payment and customer change published by
+the broker is turned into an ``EventLog`` row. Rows are not written on the
+request path: the broker listener only puts them on a queue, and a background
+thread inserts whatever has accumulated in one ``executemany`` per
+``FLUSH_INTERVAL`` (or every ``BATCH_SIZE`` rows), then publishes a
+``notifications`` event so dashboards fetch the new rows with their ``since``
+cursor; with the broker relay on, that event goes through ``broker_event``
+like every other. Events still buffered when a process dies are lost; the
+log is a feed, not an audit trail.
+"""
+import atexit
+from datetime import datetime
+import queue
+import threading
+import time
+
+from sqlalchemy import insert
+
+from models import db, EventLog
+import broker
+from threads import PerProcessThread
+
+FLUSH_INTERVAL = 0.5
+BATCH_SIZE = 500
+MAX_BUFFERED = 10000
+
+def describe(name, data):
+    """Return ``(kind, title, message, type)`` for a broker event, or ``None``."""
+    op = data.get('op')
+    if name == 'reservation':
+        if op == 'created':
+            return ('reservation.created', 'New Reservation',
+                    f"User #{data['user_id']} reserved locker #{data['locker_id']}", 'info')
+        if op == 'conflict':
+            return ('reservation.conflict', 'Reservation Conflict',
+                    f"Reservation #{data['id']} started but locker #{data['locker_id']} is not free",
+                    'warning')
+        return (f'reservation.{op}', 'Reservation Updated',
+                f"Reservation #{data['id']} is now {data['status']}", 'info')
+    if name == 'payment':
+        amount = f"${data['amount']:.2f}"
+        if data['status'] == 'pending':
+            return (f'payment.{op}', 'Payment Pending',
+                    f"User #{data['user_id']} has a pending payment of {amount}", 'warning')
+        if data['status'] == 'completed':
+            return (f'payment.{op}', 'Payment Received',
+                    f"Payment of {amount} received from user #{data['user_id']}", 'success')
+        return (f'payment.{op}', 'Payment Updated',
+                f"Payment #{data['id']} of {amount} is now {data['status']}", 'warning')
+    if name == 'locker':
+        if op == 'created':
+            return ('locker.created', 'Locker Added', f"Locker {data['number']} was added", 'info')
+        if op == 'deleted':
+            return ('locker.deleted', 'Locker Removed', f"Locker {data['number']} was removed", 'warning')
+        return ('locker.updated', 'Locker Status',
+                f"Locker {data['number']} is now {data['status']}", 'info')
+    if name == 'customer':
+        if op == 'imported':
+            return ('customer.imported', 'New Customers',
+                    f"{data['count']} customers were imported", 'success')
+        if op == 'created':
+            return ('customer.created', 'New Customer', f"{data['username']} has registered", 'success')
+        if op == 'updated' and not data['active']:
+            return ('customer.deactivated', 'Customer Deactivated',
+                    f"{data['username']} was deactivated", 'warning')
+        return (f'customer.{op}', 'Customer Updated', f"{data['username']} was updated", 'info')
+    return None
+
+class BufferedEventWriter:
+    def __init__(self):
+        self._queue = queue.Queue(MAX_BUFFERED)
+        self._thread = PerProcessThread()
+        self._engine = None
+        self._logger = None
+        self.listening = False
+        self.dropped = 0
+        self.written = 0
+
+    def start(self, engine, logger):
+        self._engine = engine
+        self._logger = logger
+
+    def _ensure_thread(self):
+        def thread():
+            self._queue = queue.Queue(MAX_BUFFERED)
+            return threading.Thread(target=self._run, name='event-log-writer', daemon=True)
+        self._thread.start(thread)
+
+    def append(self, row):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self):
+        rows = [self._queue.get()]
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(rows) < BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                rows.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return rows
+
+    def _run(self):
+        while True:
+            rows = self._drain()
+            waiters = [row for row in rows if isinstance(row, threading.Event)]
+            rows = [row for row in rows if not isinstance(row, threading.Event)]
+            if rows:
+                self._write(rows)
+            for waiter in waiters:
+                waiter.set()
+
+    def _write(self, rows):
+        notice = ('notifications', {'count': len(rows)})
+        try:
+            with self._engine.begin() as connection:
+                connection.execute(insert(EventLog), rows)
+                if broker.relay.enabled:
+                    broker.record(connection, [notice])
+        except Exception:
+            self.dropped += len(rows)
+            self._logger.exception('could not write %d notification(s); dropped them', len(rows))
+            return
+        self.written += len(rows)
+        if broker.relay.enabled:
+            broker.relay.wake()
+        else:
+            broker.broker.publish(*notice)
+
+    def flush(self, timeout=5.0):
+        """Block until everything appended so far has been written."""
+        if not self._thread.running:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+writer = BufferedEventWriter()
+
+def _on_event(name, data):
+    described = describe(name, data)
+    if described is not None:
+        kind, title, message, type_ = described
+        writer.append({
+            'kind': kind,
+            'title': title,
+            'message': message,
+            'type': type_,
+            'created_at': datetime.utcnow()
+        })
+
+def init_app(app):
+    with app.app_context():
+        writer.start(db.engine, app.logger)
+    if not writer.listening:
+        writer.listening = True
+        broker.broker.add_listener(_on_event)
+        atexit.register(writer.flush)
@@ -0,0 +1,68 @@
+"""Throwaway databases for the benchmark and check scripts.
+
+bench_endpoints.py, bench_claims.py, check_query_plans.py and
+check_admin_panel.py all run against a SQLite file seeded by ``flask seed``'s
+generator, with an admin account to log in as::
+
+    workdir = scratch_db.use('plan-check-')
+    app, seeded = scratch_db.build('plan_admin', 'plan-check', users=2000, ...)
+    ...
+    scratch_db.remove(app, workdir)
+"""
+import os
+import shutil
+import tempfile
+
+def use(prefix, database=None):
+    """Point DATABASE_URL at ``database``, or at a new file in a temporary directory.
+
+    Call it before importing the app. Returns the temporary directory, or
+    None when ``database`` was given.
+    """
+    if database:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(database)
+        return None
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'scratch.db')
+    return workdir
+
+def build(username, password, config=None, **scale):
+    """Create the app, bring the schema up to date and add the admin ``username``.
+
+    A database that already has the admin is left as it is; otherwise
+    ``scale`` goes to ``seed.generate`` (nothing is seeded without it).
+    Returns the app and whether the database was new.
+    """
+    from app import create_app
+    from models import db, User
+    import migrations
+    import seed
+
+    app = create_app(config)
+    with app.app_context():
+        migrations.upgrade()
+        if db.session.query(User.id).filter_by(username=username).first() is not None:
+            return app, False
+        admin = User(username=username, email=username + '@example.com', role='admin')
+        admin.set_password(password)
+        db.session.add(admin)
+        db.session.commit()
+        if scale:
+            seed.generate(**scale)
+    return app, True
+
+def remove(app, workdir):
+    """Close the app's connections, if it got that far, and delete ``workdir`` if there is one.
+
+    Buffered notifications are written first, so the writer thread does not
+    open the database again after it is gone.
+    """
+    from models import db
+    import notifications
+
+    if app is not None:
+        notifications.writer.flush()
+        with app.app_context():
+            db.engine.dispose()
+    if workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,145 @@
+"""Full-text search over customers, lockers and payments behind /api/search.
+
+One SQLite FTS5 table, ``search_index``, holds a document per user (username
+and email), locker (number and assigned user name) and payment (its id as
+the reference and the payer's username). The document rowid encodes the
+source row as ``id * 4 + KINDS[kind]``, so every change is a primary-key
+write. Triggers on the source tables keep the index in step with every
+write, including bulk Core statements, the seed generator and the expiry
+scheduler, which bypass the session hooks.
+
+Queries are split into words and each word of two or more characters is
+matched as a prefix (``ahm yil`` finds ``ahmet_yilmaz12``) using the two-
+and three-character prefix indexes; a single character only matches itself,
+since expanding it would touch most of the index. Hits are ranked with
+BM25, weighing the title column (username, locker number, payment reference)
+above the detail column, and paged with ``LIMIT``/``OFFSET`` in the same
+statement, ties broken by rowid, so every match is ranked and pages never
+repeat or skip a hit. SQLite keeps only the best ``offset + limit`` rows while
+sorting, but still scores every match: a broad term such as ``com`` costs
+time in proportion to how many documents it matches.
+
+The index is created and filled by ``flask upgrade-db``, and
+``flask rebuild-search`` rebuilds it. Other databases have no index and the
+endpoint answers 501.
+"""
+import re
+
+from sqlalchemy import text
+
+from models import db
+
+KINDS = {'user': 0, 'locker': 1, 'payment': 2}
+MAX_TERMS = 8
+TITLE_WEIGHT = 10.0
+DETAIL_WEIGHT = 1.0
+
+SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        title, detail, prefix='2 3', tokenize='unicode61 remove_diacritics 2')""",
+
+    """CREATE TRIGGER IF NOT EXISTS search_user_insert AFTER INSERT ON user BEGIN
+        INSERT INTO search_index (rowid, title, detail) VALUES (new.id * 4, new.username, new.email);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_user_update AFTER UPDATE OF username, email ON user BEGIN
+        UPDATE search_index SET title = new.username, detail = new.email WHERE rowid = new.id * 4;
+        UPDATE search_index SET detail = new.username
+        WHERE old.username IS NOT new.username
+          AND rowid IN (SELECT id * 4 + 2 FROM payment WHERE user_id = new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_user_delete AFTER DELETE ON user BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 4;
+    END""",
+
+    """CREATE TRIGGER IF NOT EXISTS search_locker_insert AFTER INSERT ON locker BEGIN
+        INSERT INTO search_index (rowid, title, detail) VALUES (new.id * 4 + 1, new.number, new.assigned_user_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_locker_update AFTER UPDATE OF number, assigned_user_name ON locker BEGIN
+        UPDATE search_index SET title = new.number, detail = new.assigned_user_name WHERE rowid = new.id * 4 + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_locker_delete AFTER DELETE ON locker BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 4 + 1;
+    END""",
+
+    """CREATE TRIGGER IF NOT EXISTS search_payment_insert AFTER INSERT ON payment BEGIN
+        INSERT INTO search_index (rowid, title, detail)
+        VALUES (new.id * 4 + 2, new.id, (SELECT username FROM user WHERE id = new.user_id));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_payment_update AFTER UPDATE OF user_id ON payment BEGIN
+        UPDATE search_index SET detail = (SELECT username FROM user WHERE id = new.user_id)
+        WHERE rowid = new.id * 4 + 2;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_payment_delete AFTER DELETE ON payment BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 4 + 2;
+    END""",
+]
+
+POPULATE = [
+    "INSERT INTO search_index (rowid, title, detail) SELECT id * 4, username, email FROM user",
+    "INSERT INTO search_index (rowid, title, detail) SELECT id * 4 + 1, number, assigned_user_name FROM locker",
+    """INSERT INTO search_index (rowid, title, detail)
+       SELECT payment.id * 4 + 2, payment.id, user.username
+       FROM payment LEFT JOIN user ON user.id = payment.user_id""",
+]
+
+def supported(connection):
+    return connection.dialect.name == 'sqlite'
+
+def _exists(connection):
+    return connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"
+    ).first() is not None
+
+def upgrade(connection):
+    """Create the index and its triggers if missing; return whether it was built."""
+    if not supported(connection):
+        return False
+    created = not _exists(connection)
+    for statement in SCHEMA:
+        connection.exec_driver_sql(statement)
+    if created:
+        for statement in POPULATE:
+            connection.exec_driver_sql(statement)
+    return created
+
+def rebuild():
+    """Refill the index from the source tables; return the number of documents."""
+    with db.engine.begin() as connection:
+        for statement in SCHEMA:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql('DELETE FROM search_index')
+        for statement in POPULATE:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql("INSERT INTO search_index (search_index) VALUES ('optimize')")
+        return connection.exec_driver_sql('SELECT count(*) FROM search_index').scalar()
+
+def match_expression(query):
+    """Turn free text into an FTS5 query matching every word as a prefix, or ``None``."""
+    terms = re.findall(r'\w+', query.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' if len(term) > 1 else f'"{term}"' for term in terms)
+
+def find(connection, expression, kind=None, limit=100, offset=0):
+    """Return ``[(kind, id)]`` for a page of the best ranked matches."""
+    statement = (
+        f'SELECT rowid, bm25(search_index, {TITLE_WEIGHT}, {DETAIL_WEIGHT}) AS score'
+        ' FROM search_index WHERE search_index MATCH :expression'
+    )
+    params = {'expression': expression, 'limit': limit, 'offset': offset}
+    if kind is not None:
+        statement += ' AND rowid % 4 = :kind'
+        params['kind'] = KINDS[kind]
+    statement += ' ORDER BY score, rowid LIMIT :limit OFFSET :offset'
+    names = {code: name for name, code in KINDS.items()}
+    return [(names[rowid % 4], rowid // 4) for rowid, _ in connection.execute(text(statement), params)]
+
+def init_app(app):
+    @app.cli.command('rebuild-search')
+    def rebuild_search_command():
+        """Rebuild the /api/search index from the database."""
+        with db.engine.connect() as connection:
+            if not supported(connection):
+                print('search needs SQLite FTS5')
+                return
+        print(f'indexed {rebuild()} document(s)')
@@ -0,0 +1,257 @@
+"""Multi-process launcher: preforked worker processes behind one socket.
+
+The master process builds the application once (so imports and
+configuration are paid for before forking), binds the listening socket and
+forks ``--workers`` processes that all accept on it, letting the kernel spread
+connections over the cores. Each worker drops the database connections it
+inherited, serves requests on threads and is restarted if it dies.
+
+SIGTERM or SIGINT shuts down gracefully: workers stop accepting, end open
+event streams, finish in-flight requests, flush the notification writer and
+exit; any worker still busy after ``--graceful-timeout`` seconds is killed.
+
+The schema is never created here. Run ``flask upgrade-db`` (and
+``flask seed`` for sample data) first:
+
+    flask --app app upgrade-db
+    python serve.py --bind 127.0.0.1:8000 --workers 4
+
+The workers serve HTTP with werkzeug's ``ThreadedWSGIServer``, which is
+werkzeug's development server. It starts a thread for every connection with
+no upper bound, puts no limit on header or body size and does not speak
+TLS. It is not safe to expose directly: bind to localhost and put a reverse
+proxy such as nginx in front to terminate TLS, buffer requests and cap
+connections.
+
+Reservations are started and expired by one extra scheduler process (see
+expiry.py) instead of a thread in every worker; ``--no-expiry`` turns it off
+when ``flask expire-reservations --watch`` runs elsewhere.
+
+Each worker hashes passwords on its own process pool (see hashing.py), so
+unless ``PASSWORD_HASH_WORKERS`` is set the CPU count is split between the
+workers instead of every worker starting one hashing process per core.
+Request metrics are kept per process too: each writes its own to a
+temporary directory and /metrics on any worker adds them up (see
+metrics.py). Cached list responses go to a shared directory next to them,
+so a page is built once for all workers (see table_versions.py).
+
+Every process keeps its own event broker, so the workers run with
+``BROKER_RELAY`` on: each commit also records its /api/stream events in the
+database, and every worker relays the ones other processes committed (see
+broker.py). A dashboard therefore sees changes made through any worker and by
+the scheduler. Run ``flask expire-reservations --watch`` with
+``BROKER_RELAY=on`` for the same.
+"""
+import argparse
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+RESTART_DELAY = 1.0
+POLL_INTERVAL = 0.5
+
+class RequestHandler(WSGIRequestHandler):
+    # Idle keep-alive connections would otherwise hold a thread (and a
+    # graceful shutdown) open until the client goes away.
+    timeout = 5
+
+def parse_bind(value):
+    host, _, port = value.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+class Worker:
+    """One forked serving process."""
+    def __init__(self, app, sock):
+        self.app = app
+        self.sock = sock
+        self.server = None
+
+    def stop(self, signum=None, frame=None):
+        import broker
+        broker.relay.stop()
+        broker.broker.close()
+        # shutdown() waits for serve_forever, which runs on this thread.
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def run(self):
+        import broker
+        import database
+        import hashing
+        import metrics
+        import notifications
+
+        database.dispose_after_fork(self.app)
+        broker.relay.start(self.app)
+        metrics.metrics.start(self.app)
+        host, port = self.sock.getsockname()[:2]
+        self.server = ThreadedWSGIServer(host, port, self.app, RequestHandler, fd=self.sock.fileno())
+        # Join request threads on close instead of abandoning them.
+        self.server.daemon_threads = False
+        self.server.block_on_close = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            notifications.writer.flush()
+            metrics.metrics.stop()
+            hashing.hasher.shutdown()
+            with self.app.app_context():
+                from models import db
+                db.engine.dispose()
+
+class Scheduler:
+    """The forked process running the reservation expiry scheduler."""
+    def __init__(self, app, sock):
+        self.app = app
+        self.sock = sock
+
+    def stop(self, signum=None, frame=None):
+        import expiry
+        threading.Thread(target=expiry.scheduler.stop, daemon=True).start()
+
+    def run(self):
+        import database
+        import expiry
+        import metrics
+        import notifications
+
+        self.sock.close()
+        database.dispose_after_fork(self.app)
+        metrics.metrics.start(self.app)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        try:
+            expiry.scheduler.run(self.app)
+        finally:
+            notifications.writer.flush()
+            metrics.metrics.stop()
+
+class Master:
+    def __init__(self, app, sock, workers, graceful_timeout, scheduler=True):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.scheduler = scheduler
+        self.children = {}
+        self.stopping = False
+
+    def spawn(self, kind=Worker):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                kind(self.app, self.sock).run()
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = (kind, time.monotonic())
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+        if self.scheduler:
+            self.spawn(Scheduler)
+        print(f'serving on {self.sock.getsockname()[0]}:{self.sock.getsockname()[1]} '
+              f'with {self.workers} worker(s)', file=sys.stderr)
+
+        while not self.stopping:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if not pid:
+                time.sleep(POLL_INTERVAL)
+                continue
+            child = self.children.pop(pid, None)
+            if child is not None and not self.stopping:
+                kind, started = child
+                print(f'{kind.__name__.lower()} {pid} exited with status {status}; restarting', file=sys.stderr)
+                if time.monotonic() - started < RESTART_DELAY:
+                    time.sleep(RESTART_DELAY)
+                self.spawn(kind)
+        self.shutdown()
+
+    def shutdown(self):
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.children and time.monotonic() < deadline:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+        for pid in self.children:
+            print(f'process {pid} did not stop in time; killing it', file=sys.stderr)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.sock.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bind', default=os.environ.get('BIND', '127.0.0.1:8000'),
+                        help='host:port to listen on (default: $BIND or 127.0.0.1:8000)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1)),
+                        help='worker processes (default: $WEB_WORKERS or the CPU count)')
+    parser.add_argument('--graceful-timeout', type=float, default=30.0,
+                        help='seconds to let workers finish before killing them')
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--no-expiry', action='store_true',
+                        help='do not run the reservation expiry scheduler process')
+    args = parser.parse_args(argv)
+
+    from sqlalchemy import inspect
+    from app import create_app
+    from models import db, BrokerEvent, User
+
+    workers = max(args.workers, 1)
+    # Workers never start their own expiry thread; see Scheduler.
+    config = {'EXPIRY_SCHEDULER': 'off', 'BROKER_RELAY': True}
+    if 'PASSWORD_HASH_WORKERS' not in os.environ:
+        # Every worker has its own hashing pool; together they get one process per core.
+        config['PASSWORD_HASH_WORKERS'] = max(1, (os.cpu_count() or 1) // workers)
+    # Shared by the workers: their metrics snapshots and cached response bodies.
+    runtime = tempfile.mkdtemp(prefix='admin-panel-')
+    config['METRICS_DIR'] = os.path.join(runtime, 'metrics')
+    config['RESPONSE_CACHE_DIR'] = os.path.join(runtime, 'responses')
+    os.mkdir(config['METRICS_DIR'])
+    os.mkdir(config['RESPONSE_CACHE_DIR'])
+    try:
+        app = create_app(config)
+        with app.app_context():
+            tables = inspect(db.engine)
+            if not all(tables.has_table(model.__tablename__) for model in (User, BrokerEvent)):
+                print('database has no schema; run `flask --app app upgrade-db` first', file=sys.stderr)
+                return 1
+            db.engine.dispose()
+
+        sock = socket.create_server(parse_bind(args.bind), backlog=args.backlog)
+        sock.set_inheritable(True)
+        Master(app, sock, workers, args.graceful_timeout, not args.no_expiry).run()
+        return 0
+    finally:
+        shutil.rmtree(runtime, ignore_errors=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
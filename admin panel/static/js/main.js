@@ -1,43 +1,69 @@
-// Initialize charts
+// Dashboard charts, filled from the /api/analytics rollups
+const charts = {};
+
 function initializeCharts() {
-    // User Chart
-    new Chart(document.getElementById('userChart').getContext('2d'), {
-        type: 'doughnut',
+    charts.users = new Chart(document.getElementById('userChart').getContext('2d'), {
+        type: 'bar',
         data: {
-            labels: ['Active Users', 'Passive Users'],
-            datasets: [{
-                data: [80, 20],
-                backgroundColor: ['#007bff', '#ffc107']
-            }]
+            labels: [],
+            datasets: [{ label: 'New customers', data: [], backgroundColor: '#007bff' }]
         }
     });
 
-    // Locker Chart
-    new Chart(document.getElementById('lockerChart').getContext('2d'), {
-        type: 'bar',
+    charts.lockers = new Chart(document.getElementById('lockerChart').getContext('2d'), {
+        type: 'line',
         data: {
-            labels: ['Full', 'Empty'],
-            datasets: [{
-                data: [60, 40],
-                backgroundColor: ['#28a745', '#dc3545']
-            }]
-        }
+            labels: [],
+            datasets: [{ label: 'Occupancy %', data: [], borderColor: '#28a745', backgroundColor: '#28a745', fill: false }]
+        },
+        options: { scales: { y: { min: 0, suggestedMax: 100 } } }
     });
 
-    // Payment Chart
-    new Chart(document.getElementById('paymentChart').getContext('2d'), {
-        type: 'pie',
+    charts.payments = new Chart(document.getElementById('paymentChart').getContext('2d'), {
+        type: 'bar',
         data: {
-            labels: ['Completed', 'Pending', 'Cancelled'],
-            datasets: [{
-                data: [70, 20, 10],
-                backgroundColor: ['#17a2b8', '#ffc107', '#dc3545']
-            }]
-        }
+            labels: [],
+            datasets: [
+                { label: 'Completed', data: [], backgroundColor: '#17a2b8' },
+                { label: 'Pending', data: [], backgroundColor: '#ffc107' },
+                { label: 'Cancelled', data: [], backgroundColor: '#dc3545' }
+            ]
+        },
+        options: { scales: { x: { stacked: true }, y: { stacked: true } } }
     });
+
+    document.getElementById('analyticsRange')?.addEventListener('change', loadAnalytics);
+}
+
+// Format a bucket start for the x axis: hours for hourly buckets, dates for daily ones
+function bucketLabel(start, bucket) {
+    return bucket === 'hour' ? start.slice(11, 16) : start.slice(5, 10);
+}
+
+async function loadAnalytics() {
+    const [range, bucket] = (document.getElementById('analyticsRange')?.value || '7d:day').split(':');
+    try {
+        const response = await fetch(`/api/analytics?range=${range}&bucket=${bucket}`);
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        const data = await response.json();
+        const labels = data.labels.map(start => bucketLabel(start, data.bucket));
+
+        charts.users.data.labels = labels;
+        charts.users.data.datasets[0].data = data.new_customers;
+        charts.lockers.data.labels = labels;
+        charts.lockers.data.datasets[0].data = data.occupancy;
+        charts.payments.data.labels = labels;
+        ['completed', 'pending', 'cancelled'].forEach((status, index) => {
+            charts.payments.data.datasets[index].data = data.revenue[status] || [];
+        });
+        Object.values(charts).forEach(chart => chart.update());
+    } catch (error) {
+        console.error('Error loading analytics:', error);
+    }
 }
 
 // Search Functions
+// Hide loaded rows that do not contain the search text (tables without server-side search)
 function filterTable(tableId, searchId) {
     const searchText = document.getElementById(searchId).value.toLowerCase();
     const table = document.getElementById(tableId);
@@ -60,12 +86,12 @@ function filterTable(tableId, searchId) {
     }
 }
 
-// Initialize search listeners
+// Initialize search listeners; customer, locker and payment searches reload their table from /api/search
 function initializeSearchListeners() {
-    document.getElementById('userSearch')?.addEventListener('input', () => filterTable('userTableBody', 'userSearch'));
-    document.getElementById('lockerSearch')?.addEventListener('input', () => filterTable('lockerTableBody', 'lockerSearch'));
+    document.getElementById('userSearch')?.addEventListener('input', () => scheduleReload(loadCustomers));
+    document.getElementById('lockerSearch')?.addEventListener('input', () => scheduleReload(loadLockers));
     document.getElementById('reservationSearch')?.addEventListener('input', () => filterTable('reservationTableBody', 'reservationSearch'));
-    document.getElementById('paymentSearch')?.addEventListener('input', () => filterTable('paymentTableBody', 'paymentSearch'));
+    document.getElementById('paymentSearch')?.addEventListener('input', () => scheduleReload(loadPayments));
     document.getElementById('notificationSearch')?.addEventListener('input', () => {
         const searchText = document.getElementById('notificationSearch').value.toLowerCase();
         const notifications = document.querySelectorAll('#notificationList li');
@@ -77,15 +103,59 @@ function initializeSearchListeners() {
     });
 }
 
+// Pagination helpers
+const PAGE_SIZE = 100;
+
+// Fetch one page of a list endpoint; the cursor for the next page comes back in X-Next-After-Id
+async function fetchPage(url, afterId = null) {
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    if (afterId !== null) params.set('after_id', afterId);
+    const response = await fetch(`${url}?${params}`);
+    const items = await response.json();
+    return { items, nextAfterId: response.headers.get('X-Next-After-Id') };
+}
+
+// Fetch one page of ranked search hits of one type; the next offset comes back in X-Next-Offset
+async function fetchSearchPage(type, query, offset = null) {
+    const params = new URLSearchParams({ q: query, type, limit: PAGE_SIZE });
+    if (offset !== null) params.set('offset', offset);
+    const response = await fetch(`/api/search?${params}`);
+    const items = await response.json();
+    return { items, nextAfterId: response.headers.get('X-Next-Offset') };
+}
+
+// Fetch a page of the list endpoint, or of search hits while the search box has text
+function fetchListPage(url, type, searchId, cursor) {
+    const query = document.getElementById(searchId)?.value.trim();
+    return query ? fetchSearchPage(type, query, cursor) : fetchPage(url, cursor);
+}
+
+// Append a "Load more" row that fetches the next page into the same table
+function appendLoadMoreRow(tbody, colspan, nextAfterId, loader) {
+    if (!nextAfterId) return;
+    const row = document.createElement('tr');
+    row.className = 'load-more-row';
+    row.innerHTML = `
+        <td colspan="${colspan}" class="text-center">
+            <button class="btn btn-outline-secondary btn-sm">Load more</button>
+        </td>
+    `;
+    row.querySelector('button').addEventListener('click', () => {
+        row.remove();
+        loader(nextAfterId);
+    });
+    tbody.appendChild(row);
+}
+
 // Fetch and update customer table
-async function loadCustomers() {
+async function loadCustomers(afterId = null) {
     try {
-        const response = await fetch('/api/customers');
-        const customers = await response.json();
+        const { items, nextAfterId } = await fetchListPage('/api/customers', 'user', 'userSearch', afterId);
+        const customers = items.filter(user => user.role === 'customer');
         const tbody = document.getElementById('userTableBody');
         if (!tbody) return;
         
-        tbody.innerHTML = '';
+        if (afterId === null) tbody.innerHTML = '';
         customers.forEach(customer => {
             const row = document.createElement('tr');
             row.innerHTML = `
@@ -109,6 +179,7 @@ async function loadCustomers() {
             `;
             tbody.appendChild(row);
         });
+        appendLoadMoreRow(tbody, 5, nextAfterId, loadCustomers);
     } catch (error) {
         console.error('Error loading customers:', error);
         showToast('Error loading customers', 'danger');
@@ -280,14 +351,13 @@ function showToast(message, type = 'info') {
 }
 
 // Fetch and update locker table
-async function loadLockers() {
+async function loadLockers(afterId = null) {
     try {
-        const response = await fetch('/api/lockers');
-        const lockers = await response.json();
+        const { items: lockers, nextAfterId } = await fetchListPage('/api/lockers', 'locker', 'lockerSearch', afterId);
         const tbody = document.getElementById('lockerTableBody');
         if (!tbody) return;
         
-        tbody.innerHTML = '';
+        if (afterId === null) tbody.innerHTML = '';
         lockers.forEach(locker => {
             const row = document.createElement('tr');
             row.innerHTML = `
@@ -302,20 +372,20 @@ async function loadLockers() {
             `;
             tbody.appendChild(row);
         });
+        appendLoadMoreRow(tbody, 4, nextAfterId, loadLockers);
     } catch (error) {
         console.error('Error loading lockers:', error);
     }
 }
 
 // Fetch and update reservation table
-async function loadReservations() {
+async function loadReservations(afterId = null) {
     try {
-        const response = await fetch('/api/reservations');
-        const reservations = await response.json();
+        const { items: reservations, nextAfterId } = await fetchPage('/api/reservations', afterId);
         const tbody = document.getElementById('reservationTableBody');
         if (!tbody) return;
         
-        tbody.innerHTML = '';
+        if (afterId === null) tbody.innerHTML = '';
         reservations.forEach(reservation => {
             const row = document.createElement('tr');
             row.innerHTML = `
@@ -331,20 +401,20 @@ async function loadReservations() {
             `;
             tbody.appendChild(row);
         });
+        appendLoadMoreRow(tbody, 6, nextAfterId, loadReservations);
     } catch (error) {
         console.error('Error loading reservations:', error);
     }
 }
 
 // Fetch and update payment table
-async function loadPayments() {
+async function loadPayments(afterId = null) {
     try {
-        const response = await fetch('/api/payments');
-        const payments = await response.json();
+        const { items: payments, nextAfterId } = await fetchListPage('/api/payments', 'payment', 'paymentSearch', afterId);
         const tbody = document.getElementById('paymentTableBody');
         if (!tbody) return;
         
-        tbody.innerHTML = '';
+        if (afterId === null) tbody.innerHTML = '';
         payments.forEach(payment => {
             const row = document.createElement('tr');
             row.innerHTML = `
@@ -356,20 +426,27 @@ async function loadPayments() {
             `;
             tbody.appendChild(row);
         });
+        appendLoadMoreRow(tbody, 5, nextAfterId, loadPayments);
     } catch (error) {
         console.error('Error loading payments:', error);
     }
 }
 
-// Fetch and update notifications
+// Cursor of the newest notification shown; null until the first load
+let notificationsSince = null;
+
+// Fetch and update notifications; later calls only fetch events newer than the cursor
 async function loadNotifications() {
     try {
-        const response = await fetch('/api/notifications');
+        const url = notificationsSince === null ? '/api/notifications' : `/api/notifications?since=${notificationsSince}`;
+        const response = await fetch(url);
         const notifications = await response.json();
         const list = document.getElementById('notificationList');
         if (!list) return;
         
-        list.innerHTML = '';
+        if (notificationsSince === null) list.innerHTML = '';
+        notificationsSince = response.headers.get('X-Next-Since');
+        // Responses are oldest first; prepend so the newest ends up on top
         notifications.forEach(notification => {
             const li = document.createElement('li');
             li.className = 'list-group-item';
@@ -383,18 +460,21 @@ async function loadNotifications() {
                 </div>
                 <small class="text-muted">${notification.timestamp}</small>
             `;
-            list.appendChild(li);
+            list.prepend(li);
         });
     } catch (error) {
         console.error('Error loading notifications:', error);
     }
 }
 
+// Latest dashboard statistics, kept current by the change stream
+let dashboardStats = {};
+
 // Fetch and update dashboard statistics
 async function updateDashboardStats() {
     try {
         const response = await fetch('/api/stats');
-        const data = await response.json();
+        dashboardStats = await response.json();
         
         // Update the charts with real data
         // You can implement this based on your needs
@@ -403,6 +483,51 @@ async function updateDashboardStats() {
     }
 }
 
+// Coalesce bursts of change events into one reload per table
+const pendingReloads = new Map();
+function scheduleReload(loader) {
+    if (pendingReloads.has(loader)) return;
+    pendingReloads.set(loader, setTimeout(() => {
+        pendingReloads.delete(loader);
+        loader();
+    }, 250));
+}
+
+// Subscribe to /api/stream; EventSource reconnects and resumes with Last-Event-ID on its own
+function initializeChangeStream() {
+    if (!window.EventSource) {
+        setInterval(updateDashboardStats, 30000); // Fall back to polling every 30 seconds
+        return;
+    }
+
+    const source = new EventSource('/api/stream');
+    source.addEventListener('stats', event => {
+        const deltas = JSON.parse(event.data);
+        Object.entries(deltas).forEach(([name, delta]) => {
+            dashboardStats[name] = (dashboardStats[name] || 0) + delta;
+        });
+    });
+    source.addEventListener('locker', () => scheduleReload(loadLockers));
+    source.addEventListener('reservation', () => {
+        scheduleReload(loadReservations);
+        scheduleReload(loadAnalytics);
+    });
+    source.addEventListener('payment', () => {
+        scheduleReload(loadPayments);
+        scheduleReload(loadAnalytics);
+    });
+    source.addEventListener('customer', () => {
+        scheduleReload(loadCustomers);
+        scheduleReload(loadAnalytics);
+    });
+    source.addEventListener('notifications', () => scheduleReload(loadNotifications));
+    source.addEventListener('reset', () => {
+        // We missed events (buffer overrun or server restart): reload everything
+        updateDashboardStats();
+        [loadCustomers, loadLockers, loadReservations, loadPayments, loadAnalytics].forEach(scheduleReload);
+    });
+}
+
 // Helper function to get status color
 function getStatusColor(status) {
     switch (status?.toLowerCase()) {
@@ -429,6 +554,7 @@ function getStatusColor(status) {
 // Initialize everything when the page loads
 document.addEventListener('DOMContentLoaded', () => {
     initializeCharts();
+    loadAnalytics();
     initializeSearchListeners();
     loadCustomers();
     loadLockers();
@@ -436,7 +562,7 @@ document.addEventListener('DOMContentLoaded', () => {
     loadPayments();
     loadNotifications();
     
-    // Update dashboard stats periodically
+    // Load dashboard stats once, then follow the change stream
     updateDashboardStats();
-    setInterval(updateDashboardStats, 30000); // Update every 30 seconds
+    initializeChangeStream();
 }); 
\ No newline at end of file
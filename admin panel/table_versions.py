@@ -0,0 +1,219 @@
+"""Per-table versions for conditional GETs and cached list responses.
+
+Every flush that inserts, updates or deletes rows of a table bumps that
+table's ``TableVersion`` row in the same transaction, so the version changes
+exactly when a commit makes new data visible. Code that writes with Core
+statements bypasses the flush hook and must call ``bump`` itself.
+
+``conditional(*tables)`` wraps a list endpoint: it reads the versions of the
+tables the response is built from and derives a strong ETag and
+``Last-Modified`` from them. A request whose ``If-None-Match`` or
+``If-Modified-Since`` still matches is answered with ``304`` from the small
+version table alone, and a repeated read of an unchanged page is served from
+the serialized, already compressed body cached under that ETag. Versions are
+read through the read session, so they come from the same snapshot as the
+page itself.
+
+With ``RESPONSE_CACHE_DIR`` set (serve.py gives its workers one), cached
+bodies are also written there as files named by their ETag, so a page one
+worker has built is served by the others as well. The ETag covers the URL,
+role, encoding and table versions, so a file never goes stale; the oldest
+are deleted once there are more than ``RESPONSE_CACHE_FILES``.
+"""
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+import hashlib
+import json
+import os
+import threading
+
+from flask import current_app, request
+from flask_login import current_user
+from sqlalchemy import event, insert, select, update
+from werkzeug.http import is_resource_modified
+
+from models import db, TableVersion
+from database import reads
+import compression
+
+def bump(connection, names):
+    """Increment the versions of ``names`` inside the caller's transaction."""
+    table = TableVersion.__table__
+    now = datetime.utcnow()
+    for name in sorted(names):
+        result = connection.execute(
+            update(table).where(table.c.name == name)
+            .values(version=table.c.version + 1, updated_at=now)
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(table).values(name=name, version=1, updated_at=now))
+
+def current(names):
+    """Return ``{name: (version, updated_at)}``; unknown tables are ``(0, None)``."""
+    rows = reads.execute(
+        select(TableVersion.name, TableVersion.version, TableVersion.updated_at)
+        .where(TableVersion.name.in_(names))
+    )
+    versions = {name: (0, None) for name in names}
+    versions.update((name, (version, updated_at)) for name, version, updated_at in rows)
+    return versions
+
+def _after_flush(session, flush_context):
+    names = {obj.__table__.name for obj in session.new | session.deleted}
+    names.update(
+        obj.__table__.name for obj in session.dirty
+        if session.is_modified(obj, include_collections=False)
+    )
+    if names:
+        bump(session.connection(), names)
+
+PRUNE_EVERY = 64
+
+class ResponseCache:
+    """LRU of serialized responses, one entry per endpoint/URL/role/encoding.
+
+    Misses fall back to the files in ``directory``, if set.
+    """
+    def __init__(self, size=128, directory=None, files=1024):
+        self.size = size
+        self.directory = directory
+        self.files = files
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stored = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == etag:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], entry[2]
+        cached = self._load(etag) if self.directory else None
+        with self._lock:
+            if cached is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+        self._remember(key, etag, *cached)
+        return cached
+
+    def put(self, key, etag, body, headers):
+        self._remember(key, etag, body, headers)
+        if self.directory:
+            self._store(etag, body, headers)
+
+    def _remember(self, key, etag, body, headers):
+        with self._lock:
+            self._entries[key] = (etag, body, headers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def _load(self, etag):
+        try:
+            with open(os.path.join(self.directory, etag), 'rb') as handle:
+                headers = [tuple(header) for header in json.loads(handle.readline())]
+                return handle.read(), headers
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, etag, body, headers):
+        path = os.path.join(self.directory, etag)
+        partial = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(partial, 'wb') as handle:
+                handle.write(json.dumps(headers).encode() + b'\n')
+                handle.write(body)
+            os.replace(partial, path)
+        except OSError:
+            current_app.logger.exception('could not write the shared response cache')
+            return
+        with self._lock:
+            self._stored += 1
+            prune = self._stored % PRUNE_EVERY == 0
+        if prune:
+            self._prune()
+
+    def _prune(self):
+        try:
+            with os.scandir(self.directory) as entries:
+                files = [(entry.stat().st_mtime, entry.path) for entry in entries
+                         if not entry.name.endswith('.tmp')]
+        except OSError:
+            return
+        files.sort()
+        for _, path in files[:max(len(files) - self.files, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.size,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
+
+responses = ResponseCache()
+
+def conditional(*tables):
+    """Serve the decorated GET view with ETag/Last-Modified from ``tables``.
+
+    The response must depend only on the URL and the caller's role. Place
+    below ``login_required`` so anonymous requests never reach the cache.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = current(tables)
+            encoding = compression.negotiate()
+            key = (request.endpoint, request.full_path, getattr(current_user, 'role', None), encoding)
+            etag = hashlib.sha1(repr((key, sorted(versions.items()))).encode()).hexdigest()
+            last_modified = max(
+                (updated_at for _, updated_at in versions.values() if updated_at), default=None)
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                # The client's copy is current; don't build or look up the body.
+                response = current_app.response_class(status=304)
+                if encoding:
+                    response.vary.add('Accept-Encoding')
+            else:
+                cached = responses.get(key, etag)
+                if cached is None:
+                    response = current_app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    compression.compress_response(response, encoding)
+                    headers = [(name, value) for name, value in response.headers
+                               if name != 'Content-Length']
+                    responses.put(key, etag, response.get_data(), headers)
+                else:
+                    body, headers = cached
+                    response = current_app.response_class(body, headers=headers)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+def init_app(app):
+    responses.size = app.config.get('RESPONSE_CACHE_SIZE', responses.size)
+    responses.directory = app.config.get('RESPONSE_CACHE_DIR')
+    responses.files = app.config.get('RESPONSE_CACHE_FILES', responses.files)
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
@@ -0,0 +1,32 @@
+"""Background threads that every process starts for itself.
+
+Threads do not survive fork: a serve.py worker inherits the objects of the
+master but none of its threads. ``PerProcessThread`` remembers which process
+started its thread, so the first ``start`` in each process starts one and
+later calls in the same process do nothing.
+"""
+import os
+import threading
+
+class PerProcessThread:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self, factory):
+        """Start the thread ``factory()`` returns unless this process already has one.
+
+        ``factory`` runs under a lock, so it can also reset per-process state.
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return False
+            thread = factory()
+            self._pid = os.getpid()
+            thread.start()
+            return True
+
+    @property
+    def running(self):
+        """Whether this process has started its thread."""
+        return self._pid == os.getpid()
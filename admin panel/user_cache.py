@@ -0,0 +1,133 @@
+"""TTL + LRU cache for the Flask-Login session user.
+
+``load_user`` runs on every authenticated request, so the user row is the
+most frequently read row in the system. Entries are detached copies keyed by
+user id and tagged with the row ``version``; routes that change a user call
+``invalidate`` and a commit hook drops any user whose row version moved, so
+role changes and deactivations apply on the next request in this process.
+Hits are served without touching the database. With the broker relay on,
+the hook also queues a ``user`` event with the changed ids, and every
+process drops them when the relay delivers it, so other workers follow
+within a relay interval; otherwise they follow within ``ttl``. Core writers
+that change users queue the event themselves.
+"""
+from collections import OrderedDict
+import threading
+import time
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from models import db, User
+import broker
+
+class UserCache:
+    def __init__(self, size=1024, ttl=30.0):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # id -> (user, version, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[2] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, user):
+        copy = _detached_copy(user)
+        with self._lock:
+            self._entries[user.id] = (copy, user.version, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return copy
+
+    def invalidate(self, user_id, version=None):
+        """Drop ``user_id``; with ``version``, only if the cached row is older."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and (version is None or entry[1] != version):
+                del self._entries[user_id]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def load(self, user_id):
+        user = self.get(user_id)
+        if user is None:
+            user = db.session.get(User, user_id)
+            if user is not None:
+                user = self.put(user)
+        return user
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+def _detached_copy(user):
+    """Copy the loaded columns into a detached User that no session owns."""
+    copy = User(**{attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs})
+    make_transient_to_detached(copy)
+    return copy
+
+cache = UserCache()
+
+def queue_event(session, versions):
+    """Have every process drop ``{user_id: version or None}`` once ``session`` commits."""
+    if broker.relay.enabled and versions:
+        broker.queue_event(session, 'user', {'users': sorted(versions.items())})
+
+def _after_flush(session, flush_context):
+    changed = session.info.setdefault('changed_users', {})
+    flushed = {}
+    for obj in session.dirty | session.deleted:
+        if isinstance(obj, User) and (obj in session.deleted or session.is_modified(obj)):
+            flushed[obj.id] = None if obj in session.deleted else obj.version
+    changed.update(flushed)
+    queue_event(session, flushed)
+
+def _after_commit(session):
+    for user_id, version in session.info.pop('changed_users', {}).items():
+        cache.invalidate(user_id, version)
+
+def _after_rollback(session):
+    session.info.pop('changed_users', None)
+
+def _on_relayed(name, data):
+    if name == 'user':
+        for user_id, version in data['users']:
+            cache.invalidate(user_id, version)
+
+def init_app(app):
+    cache.size = app.config.get('USER_CACHE_SIZE', cache.size)
+    cache.ttl = app.config.get('USER_CACHE_TTL', cache.ttl)
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+        event.listen(db.session, 'after_commit', _after_commit)
+        event.listen(db.session, 'after_rollback', _after_rollback)
+        broker.relay.add_listener(_on_relayed)